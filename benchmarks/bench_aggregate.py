@@ -0,0 +1,74 @@
+#!/.venv/bin/python
+"""Microbenchmark the compiled flat aggregation engine against the recursive
+`aggregate_dictlikes` it replaces, folding a batch of full snapshots.
+
+Usage:
+
+    python benchmarks/bench_aggregate.py [--rows ROWS] [-n NUMBER] [-r REPEAT]
+
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+from aggregator.lib.dynamo_aggregator.engine import (  # noqa: E402
+    ROLLUP_SCHEMA,
+    FlatAggregator,
+    aggregate_dictlikes,
+    np,
+)
+
+
+def random_rows(n, seed=0):
+    """Generate `n` rollup rows with every skill and activity leaf."""
+    rng = random.Random(seed)
+    return [
+        ROLLUP_SCHEMA.unflatten(
+            [rng.randint(-1, 200000000) for _ in range(len(ROLLUP_SCHEMA) - 1)] + [1]
+        )
+        for _ in range(n)
+    ]
+
+
+def recursive_fold(rows):
+    """Fold rows pairwise, as the aggregator did before the engine."""
+    folded = rows[0]
+    for row in rows[1:]:
+        folded = aggregate_dictlikes(folded, row)
+    return folded
+
+
+def main(args):
+    rows = random_rows(args.rows)
+    flat_rows = [ROLLUP_SCHEMA.flatten(row) for row in rows]
+    pure_python = FlatAggregator(ROLLUP_SCHEMA, numpy_min_rows=args.rows + 1)
+    vectorized = FlatAggregator(ROLLUP_SCHEMA, numpy_min_rows=1)
+    assert pure_python.aggregate(rows) == recursive_fold(rows)
+
+    cases = {
+        "recursive dictlikes": lambda: recursive_fold(rows),
+        "compiled, pure Python": lambda: pure_python.aggregate(rows),
+        "compiled, flat input": lambda: pure_python.reduce_flat(flat_rows),
+    }
+    if np is not None:
+        cases["compiled, NumPy"] = lambda: vectorized.aggregate(rows)
+    else:
+        print("NumPy is not installed; skipping the vectorized case.")
+    baseline = None
+    for name, fn in cases.items():
+        best = min(timeit.repeat(fn, number=args.number, repeat=args.repeat))
+        per_call = best / args.number * 1e6
+        baseline = baseline or per_call
+        print(f"{name:<24} {per_call:8.1f} us/call  {baseline / per_call:5.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=48, help="rows per fold")
+    parser.add_argument("-n", "--number", type=int, default=200)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,109 @@
+#!/.venv/bin/python
+"""Microbenchmark bucketing raw timestamps into every rollup tier, and parsing
+query times, against the `strptime`-based code they replace.
+
+Usage:
+
+    python benchmarks/bench_bucketing.py [--rows ROWS] [-n NUMBER] [-r REPEAT]
+
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+from hiscores_common.lib.table.bucketing import (  # noqa: E402
+    DATE_FMT,
+    MONTH_FMT,
+    TIMESTAMP_FMT,
+    parse,
+    validate_timestamp,
+)
+from hiscores_common.lib.table.tiers import TIERS  # noqa: E402
+
+STRPTIME_FORMATS = {
+    "hourly": "%Y-%m-%d %H:00:00",
+    "daily": "%Y-%m-%d",
+    "weekly": "%Y-%m-%d",
+    "monthly": "%Y-%m",
+    "yearly": "%Y",
+}
+
+
+def strptime_key(tier, timestamp):
+    """Bucket a timestamp as the aggregator did before, parsing it per tier."""
+    dt = datetime.strptime(timestamp, TIMESTAMP_FMT)
+    if tier.name == "weekly":
+        dt -= timedelta(days=dt.weekday())
+    return tier.sentinel + dt.strftime(STRPTIME_FORMATS[tier.name])
+
+
+def strptime_parse_time(value):
+    """Parse a query time as the queryer did before, trying each format."""
+    for fmt in (TIMESTAMP_FMT, DATE_FMT, MONTH_FMT):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError(value)
+
+
+def random_timestamps(n, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2021, 1, 1)
+    return [
+        (start + timedelta(seconds=rng.randrange(365 * 86400))).strftime(TIMESTAMP_FMT)
+        for _ in range(n)
+    ]
+
+
+def main(args):
+    timestamps = random_timestamps(args.rows)
+    tiers = list(TIERS.values())
+    query_times = [t[:width] for t, width in zip(timestamps, [19, 10, 7] * args.rows)]
+
+    def sliced():
+        for timestamp in timestamps:
+            validate_timestamp(timestamp)
+        return [[tier.bucket_key(t) for t in timestamps] for tier in tiers]
+
+    def parsed():
+        return [[strptime_key(tier, t) for t in timestamps] for tier in tiers]
+
+    assert sliced() == parsed()
+    assert [parse(t) for t in query_times] == [
+        strptime_parse_time(t) for t in query_times
+    ]
+
+    groups = {
+        f"bucket {args.rows} rows into {len(tiers)} tiers": {
+            "strptime per tier": parsed,
+            "validate once, slice": sliced,
+        },
+        f"parse {args.rows} query times": {
+            "strptime per format": lambda: [
+                strptime_parse_time(t) for t in query_times
+            ],
+            "fixed-width parse": lambda: [parse(t) for t in query_times],
+        },
+    }
+    for title, cases in groups.items():
+        print(title)
+        baseline = None
+        for name, fn in cases.items():
+            best = min(timeit.repeat(fn, number=args.number, repeat=args.repeat))
+            per_call = best / args.number * 1e6
+            baseline = baseline or per_call
+            print(f"  {name:<24} {per_call:8.1f} us/call  {baseline / per_call:5.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100, help="timestamps per call")
+    parser.add_argument("-n", "--number", type=int, default=100)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,96 @@
+#!/.venv/bin/python
+"""Microbenchmark decoding stream images of snapshots into flat, schema-ordered
+values, and folding a batch of them, against unrolling them into nested dicts.
+
+Usage:
+
+    python benchmarks/bench_deserialize.py [--rows ROWS] [-n NUMBER] [-r REPEAT]
+
+"""
+import argparse
+import base64
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+from aggregator.lib.dynamo_aggregator.engine import SNAPSHOT_SCHEMA  # noqa: E402
+from aggregator.lib.dynamo_aggregator.util import (  # noqa: E402
+    fold_flat_rows,
+    fold_hiscores_rows,
+    image_to_flat,
+    unroll_image,
+)
+from boto3.dynamodb.types import TypeSerializer  # noqa: E402
+from hiscores_common.lib.snapshot.codec import (  # noqa: E402
+    PACKED_ATTRIBUTE,
+    encode_snapshot,
+)
+
+
+def random_images(n, packed=False, seed=0):
+    """Build stream images of `n` random full snapshots of one player."""
+    rng = random.Random(seed)
+    serializer = TypeSerializer()
+    images = []
+    for i in range(n):
+        item = SNAPSHOT_SCHEMA.unflatten(
+            [rng.randint(-1, 200000000) for _ in range(len(SNAPSHOT_SCHEMA))]
+        )
+        item.update(player="PlayerName", timestamp=f"2021-12-17 20:{i % 60:02d}:00")
+        if packed:
+            item = encode_snapshot(item)
+            blob = base64.b64encode(item.pop(PACKED_ATTRIBUTE)).decode()
+        image = {key: serializer.serialize(value) for key, value in item.items()}
+        if packed:
+            image[PACKED_ATTRIBUTE] = {"B": blob}
+        images.append(image)
+    return images
+
+
+def main(args):
+    groups = dict()
+    for packed in (False, True):
+        images = random_images(args.rows, packed=packed)
+
+        def nested(images=images):
+            return [unroll_image(image) for image in images]
+
+        def flat(images=images):
+            return [image_to_flat(image) for image in images]
+
+        def nested_fold(images=images):
+            return fold_hiscores_rows(nested(images), "Daily#2021-12-17")
+
+        def flat_fold(images=images):
+            return fold_flat_rows(flat(images))
+
+        assert flat() == [SNAPSHOT_SCHEMA.flatten(row) for row in nested()]
+        layout = "packed" if packed else "nested"
+        groups[f"decode {args.rows} {layout} images"] = {
+            "unroll_image": nested,
+            "image_to_flat": flat,
+        }
+        groups[f"decode and fold {args.rows} {layout} images"] = {
+            "unroll, fold nested": nested_fold,
+            "flat decode, fold flat": flat_fold,
+        }
+
+    for title, cases in groups.items():
+        print(title)
+        baseline = None
+        for name, fn in cases.items():
+            best = min(timeit.repeat(fn, number=args.number, repeat=args.repeat))
+            per_call = best / args.number * 1e6
+            baseline = baseline or per_call
+            print(f"  {name:<24} {per_call:8.1f} us/call  {baseline / per_call:5.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=48, help="images per call")
+    parser.add_argument("-n", "--number", type=int, default=20)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,95 @@
+#!/.venv/bin/python
+"""Microbenchmark the compiled HiScores parser against the line-by-line parser.
+
+Usage:
+
+    python benchmarks/bench_parser.py [-n NUMBER] [-r REPEAT]
+
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+from get_and_parse_hiscores.lib.hiscores.parser import HiscoresParser  # noqa: E402
+from hiscores_common.lib.snapshot.constants import (  # noqa: E402
+    HISCORE_RESPONSE_ACTIVITY_COLS,
+    HISCORES_RESPONSE_ACTIVITIES,
+    HISCORES_RESPONSE_SKILL_COLS,
+    HISCORES_RESPONSE_SKILLS,
+)
+
+
+def line_by_line_sanitize(text):
+    """The original `sanitize_hiscores_stats`, kept as a baseline."""
+
+    def parse_line(line, schema):
+        split_line = line.split(",")
+        if len(schema) != len(split_line):
+            raise ValueError(f"Schema '{schema}' is invalid for line '{line}'.")
+        return dict(zip(schema, map(int, split_line)))
+
+    lines = text.strip().split("\n")
+    skill_lines = lines[: len(HISCORES_RESPONSE_SKILLS)]
+    skill_dict = dict(
+        zip(
+            HISCORES_RESPONSE_SKILLS,
+            (parse_line(line, HISCORES_RESPONSE_SKILL_COLS) for line in skill_lines),
+        )
+    )
+    activity_lines = lines[len(HISCORES_RESPONSE_SKILLS) :]
+    activity_dict = dict(
+        zip(
+            HISCORES_RESPONSE_ACTIVITIES,
+            (
+                parse_line(line, HISCORE_RESPONSE_ACTIVITY_COLS)
+                for line in activity_lines
+            ),
+        )
+    )
+    return dict(skills=skill_dict, activities=activity_dict)
+
+
+def random_response_text(seed=0):
+    """Generate a realistic response with one line per skill and activity."""
+    rng = random.Random(seed)
+    skill_lines = [
+        f"{rng.randint(1, 2000000)},{rng.randint(1, 99)},{rng.randint(0, 200000000)}"
+        for _ in HISCORES_RESPONSE_SKILLS
+    ]
+    activity_lines = [
+        f"{rng.randint(1, 2000000)},{rng.randint(1, 5000)}"
+        if rng.random() < 0.3
+        else "-1,-1"
+        for _ in HISCORES_RESPONSE_ACTIVITIES
+    ]
+    return "\n".join(skill_lines + activity_lines)
+
+
+def main(args):
+    text = random_response_text()
+    parser = HiscoresParser()
+    buffer = parser.new_buffer()
+    assert parser.parse(text).to_dict() == line_by_line_sanitize(text)
+
+    cases = {
+        "line-by-line dicts": lambda: line_by_line_sanitize(text),
+        "compiled, nested dicts": lambda: parser.parse(text).to_dict(),
+        "compiled, flat buffer": lambda: parser.parse(text, out=buffer),
+    }
+    baseline = None
+    for name, fn in cases.items():
+        best = min(timeit.repeat(fn, number=args.number, repeat=args.repeat))
+        per_call = best / args.number * 1e6
+        baseline = baseline or per_call
+        print(f"{name:<24} {per_call:8.1f} us/call  {baseline / per_call:5.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=2000)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    main(parser.parse_args())
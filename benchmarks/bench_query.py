@@ -0,0 +1,134 @@
+#!/.venv/bin/python
+"""Benchmark reading wide raw ranges through `run_table_query`.
+
+The query handler runs against an in-memory stand-in table whose queries return
+at most `--page-items` items per page, standing in for the 1 MB page limit, and
+take `--latency-ms` each. A single query, as the handler made before, is
+compared with following every page into lists of rows, and with streaming the
+pages through linting and JSON encoding, reading one range or concurrently read
+sub-ranges, and with projecting the streamed rows onto one skill's xp, as rows
+or columns. Peak memory is traced in a second run of each case.
+
+Usage:
+
+    python benchmarks/bench_query.py [--days N] [--page-items N] [--latency-ms N]
+
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+os.environ.setdefault("HISCORES_TABLE_NAME", "HiScores")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import read_hiscores_table.handler as handler  # noqa: E402
+from boto3.dynamodb.conditions import Key  # noqa: E402
+from hiscores_common.lib.table.bucketing import format_timestamp  # noqa: E402
+from hiscores_common.tst.snapshot.test_codec import snapshot  # noqa: E402
+from read_hiscores_table.lib.aggregation_queryer.pagination import (  # noqa: E402
+    query_segments,
+)
+from read_hiscores_table.lib.aggregation_queryer.projection import select  # noqa: E402
+from read_hiscores_table.lib.aggregation_queryer.util import (  # noqa: E402
+    CustomEncoder,
+    dump_json,
+    lint_items,
+    split_key_range,
+    to_columns,
+)
+from standins import InMemoryTable  # noqa: E402
+
+NONE = handler.AggregationLevel.NONE
+
+
+def fill_table(table, days, poll_minutes):
+    start = datetime(2021, 12, 1)
+    for i in range(int(days * 24 * 60 / poll_minutes)):
+        timestamp = format_timestamp(start + i * timedelta(minutes=poll_minutes))
+        table.put_item(Item=dict(snapshot(), timestamp=timestamp))
+    return format_timestamp(start), timestamp
+
+
+def measure(fn):
+    """Run `fn`, returning its result, wall time and peak traced memory."""
+    begin = time.perf_counter()
+    fn()
+    secs = time.perf_counter() - begin
+    tracemalloc.start()
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, secs, peak
+
+
+def main(args):
+    logging.disable(logging.INFO)
+    table = InMemoryTable(page_items=args.page_items)
+    start, end = fill_table(table, args.days, handler.POLL_INTERVAL_MINUTES)
+    table.latency_secs = args.latency_ms / 1000
+    handler.table = table
+    # raw rows are only read when the range needs no rollup tier
+    handler.TARGET_POINTS = len(table)
+
+    def single_query():
+        items = table.query(
+            KeyConditionExpression=Key("player").eq("PlayerName")
+            & Key("timestamp").between(start, end)
+        )["Items"]
+        return json.dumps(list(lint_items(items, NONE)), cls=CustomEncoder)
+
+    def listed(concurrency):
+        segments = split_key_range(start, end, 1800, handler.QUERY_SEGMENT_ROWS, 8)
+        items = query_segments(
+            lambda low, high, **kwargs: table.query(
+                KeyConditionExpression=Key("player").eq("PlayerName")
+                & Key("timestamp").between(low, high),
+                **kwargs,
+            ),
+            segments,
+            max_workers=concurrency,
+        )
+        linted = list(lint_items(items, NONE))
+        return json.dumps(linted, cls=CustomEncoder)
+
+    def streamed(concurrency, selection=None, columnar=False):
+        handler.QUERY_CONCURRENCY = concurrency
+        rows = handler.run_table_query("PlayerName", start, end, selection=selection)
+        return dump_json(to_columns(rows, selection) if columnar else rows)
+
+    magic_xp = select(skills=["Magic"], fields=["xp"])
+    print(f"{len(table)} raw rows, {args.page_items} items per page")
+    cases = {
+        "single query (before)": single_query,
+        f"lists, {args.concurrency} ranges": lambda: listed(args.concurrency),
+        "streamed, 1 range": lambda: streamed(1),
+        f"streamed, {args.concurrency} ranges": lambda: streamed(args.concurrency),
+        "columnar": lambda: streamed(args.concurrency, columnar=True),
+        "Magic xp": lambda: streamed(args.concurrency, magic_xp),
+        "Magic xp, columnar": lambda: streamed(args.concurrency, magic_xp, True),
+    }
+    for name, fn in cases.items():
+        table.calls.clear()
+        body, secs, peak = measure(fn)
+        decoded = json.loads(body)
+        rows = len(decoded["timestamps"] if "columns" in decoded else decoded)
+        print(
+            f"  {name:<24} {rows:6d} rows {table.calls['Query'] // 2:4d} queries "
+            f"{secs * 1000:8.1f} ms {peak / 2**20:7.1f} MiB peak "
+            f"{len(body) / 2**10:7.1f} KiB body"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--days", type=float, default=28)
+    parser.add_argument("--page-items", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=8)
+    main(parser.parse_args())
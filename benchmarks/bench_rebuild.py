@@ -0,0 +1,113 @@
+#!/.venv/bin/python
+"""Benchmark `rebuild_aggregates.py` against an in-memory stand-in table.
+
+The table is filled with random raw snapshots, a share of which are stored as
+deltas, and the rollups are rebuilt with one worker and with `--workers`. The
+rebuilt rows are checked against folding every snapshot in a single process.
+
+Usage:
+
+    python benchmarks/bench_rebuild.py [--players N] [--days N] [--workers N]
+
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+from aggregator.lib.dynamo_aggregator.engine import ROLLUP_SCHEMA  # noqa: E402
+from aggregator.lib.dynamo_aggregator.rebuild import (  # noqa: E402
+    RollupAccumulator,
+    derive_rows,
+)
+from hiscores_common.lib.snapshot.delta import make_delta  # noqa: E402
+from hiscores_common.lib.table.tiers import (  # noqa: E402
+    derivation_sources,
+    parse_tiers,
+)
+from standins import InMemoryTable  # noqa: E402
+
+import rebuild_aggregates  # noqa: E402
+
+TABLE = InMemoryTable()
+"""Table shared with forked workers."""
+
+
+def stand_in_table():
+    return TABLE
+
+
+def fill_table(table, players, days, polls_per_day, delta_share, seed=0):
+    """Write raw snapshots of `players` every poll over `days`."""
+    rng = random.Random(seed)
+    start = datetime(2021, 12, 1)
+    step = timedelta(days=1) / polls_per_day
+    for p in range(players):
+        base = None
+        for i in range(days * polls_per_day):
+            timestamp = (start + i * step).strftime("%Y-%m-%d %H:%M:%S")
+            item = ROLLUP_SCHEMA.unflatten(
+                [rng.randint(-1, 200000000) for _ in range(len(ROLLUP_SCHEMA))]
+            )
+            del item["divisor"]
+            item.update(player=f"Player{p}", timestamp=timestamp)
+            if base is not None and rng.random() < delta_share:
+                table.put_item(Item=make_delta(base, dict(base, **item)))
+            else:
+                table.put_item(Item=item)
+                base = item
+
+
+def run(workers, segments, tiers, strategy):
+    args = argparse.Namespace(
+        export=None,
+        segments=segments,
+        workers=workers,
+        writers=8,
+        page_size=None,
+        tiers=tiers,
+        strategy=strategy,
+        dry_run=False,
+    )
+    start = time.perf_counter()
+    written = rebuild_aggregates.rebuild(args, stand_in_table)
+    return written, time.perf_counter() - start
+
+
+def main(args):
+    fill_table(TABLE, args.players, args.days, args.polls_per_day, args.delta_share)
+    raw = len(TABLE)
+    print(f"Filled the stand-in table with {raw} raw items.")
+
+    tiers = parse_tiers(args.tiers)
+    sources = derivation_sources(tiers) if args.strategy == "hierarchical" else {}
+    accumulator = RollupAccumulator([t for t in tiers if t.name not in sources])
+    accumulator.add_items(sorted(TABLE._items.values(), key=TABLE._key))
+    expected = {**accumulator.rows, **derive_rows(accumulator.rows, sources)}
+
+    for workers in sorted({1, args.workers}):
+        written, secs = run(workers, args.segments, args.tiers, args.strategy)
+        rebuilt = {key: item for key, item in TABLE._items.items() if key in expected}
+        assert written == len(expected) and rebuilt == expected
+        print(
+            f"{workers:3d} workers: {raw / secs:10,.0f} raw items/s "
+            f"({written} rows in {secs:.2f}s)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--players", type=int, default=200)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--polls-per-day", type=int, default=48)
+    parser.add_argument("--delta-share", type=float, default=0.5)
+    parser.add_argument("--segments", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--tiers", default="daily,weekly,monthly,yearly")
+    parser.add_argument("--strategy", default="hierarchical")
+    main(parser.parse_args())
@@ -0,0 +1,252 @@
+#!/.venv/bin/python
+"""Load test the orchestrator -> queue -> GetAndParse ingestion path locally.
+
+The Lambda handlers run in-process against in-memory stand-ins for SQS and
+DynamoDB, and fetch from the stub HiScores server, so throughput can be sized
+without deploying or touching the real API. Concurrent invocations run as
+threads sharing one warm container's module state, such as its HTTP session,
+rate limiter and circuit breaker. Handler settings are passed as environment
+variables with `--env`, for example:
+
+    python benchmarks/load_test.py --players 2000 --concurrency 8 \\
+        --latency-ms 150 --env MAX_WORKERS=10 --env INGEST_MODE=skip
+
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+import boto3  # noqa: E402
+from standins import InMemoryDynamoResource, InMemoryQueue  # noqa: E402
+from stub_server import add_arguments, start_server  # noqa: E402
+
+GET_AND_PARSE_QUEUE_URL = "local://GetAndParseForPlayerQueue"
+SEGMENTS_QUEUE_URL = "local://OrchestratorSegmentsQueue"
+TABLE_NAME = "HiScores"
+
+
+def load_handlers(sqs, dynamodb, env):
+    """Import the Lambda handlers with their AWS clients replaced by stand-ins."""
+    os.environ.update(
+        AWS_DEFAULT_REGION="us-east-1",
+        HISCORES_TABLE_NAME=TABLE_NAME,
+        GET_AND_PARSE_QUEUE_URL=GET_AND_PARSE_QUEUE_URL,
+        SEGMENTS_QUEUE_URL=SEGMENTS_QUEUE_URL,
+        **env,
+    )
+    with mock.patch.object(boto3, "client", return_value=sqs), mock.patch.object(
+        boto3, "resource", return_value=dynamodb
+    ):
+        import get_and_parse_hiscores.handler as get_and_parse
+        import orchestrator.handler as orchestrator
+    return orchestrator, get_and_parse
+
+
+class Stats(object):
+    """Thread-safe counters and fetch latencies collected during the run."""
+
+    def __init__(self):
+        self.latencies = []
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def add_latency(self, secs):
+        with self._lock:
+            self.latencies.append(secs)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counts[name] += n
+
+
+def instrument(rs_api, stats, api_url):
+    """Point `rs_api` at the stub server and record fetch latencies."""
+    rs_api.HISCORES_API = f"{api_url}/m=hiscore_oldschool/index_lite.ws"
+    rs_api.HISCORES_IRONMAN_API = f"{api_url}/m=hiscore_oldschool_ironman/index_lite.ws"
+    request_once = rs_api._request_hiscores_once
+    process = rs_api.process_hiscores_response
+
+    def timed_request_once(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return request_once(*args, **kwargs)
+        finally:
+            stats.add_latency(time.perf_counter() - start)
+
+    def counted_process(response):
+        result = process(response)
+        stats.count("snapshots")
+        return result
+
+    rs_api._request_hiscores_once = timed_request_once
+    rs_api.process_hiscores_response = counted_process
+
+
+def drain(sqs, queue_url, handler, batch_size, concurrency, max_receives, stats):
+    """Invoke `handler` on batches from a queue until no message is visible.
+
+    Reported batch item failures are requeued until they have been received
+    `max_receives` times, after which they count as dead letters.
+
+    """
+    busy = Counter()
+    lock = threading.Lock()
+
+    def consume():
+        while True:
+            with lock:
+                records = sqs.receive(queue_url, max_messages=batch_size)
+                if not records and not busy["workers"]:
+                    return
+                busy["workers"] += bool(records)
+            if not records:
+                time.sleep(0.01)
+                continue
+            try:
+                response = handler({"Records": records}, None) or {}
+                failed = {
+                    failure["itemIdentifier"]
+                    for failure in response.get("batchItemFailures", [])
+                }
+            except Exception:
+                logging.exception("Invocation failed; retrying the whole batch.")
+                failed = {record["messageId"] for record in records}
+            stats.count("invocations")
+            retry = [
+                record
+                for record in records
+                if record["messageId"] in failed
+                and int(record["attributes"]["ApproximateReceiveCount"]) < max_receives
+            ]
+            stats.count("dead_letters", len(failed) - len(retry))
+            sqs.requeue(queue_url, retry)
+            with lock:
+                busy["workers"] -= 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(consume) for _ in range(concurrency)]:
+            future.result()
+
+
+def percentile(values, pct):
+    if len(values) < 2:
+        return values[0] if values else float("nan")
+    return statistics.quantiles(values, n=100)[pct - 1]
+
+
+def main(args):
+    logging.basicConfig(level=args.log_level)
+    env = dict(item.split("=", 1) for item in args.env)
+
+    server = None
+    api_url = args.api_url
+    if api_url is None:
+        server = start_server(
+            latency_ms=args.latency_ms,
+            latency_sigma=args.latency_sigma,
+            error_rate=args.error_rate,
+            html_rate=args.html_rate,
+            change_rate=args.change_rate,
+        )
+        api_url = f"http://127.0.0.1:{server.server_port}"
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt") as players_file:
+        players_file.writelines(
+            f"{'Iron' if i % 10 == 0 else ''}Player{i:06d}\n"
+            for i in range(args.players)
+        )
+        players_file.flush()
+        env.setdefault("PLAYER_REGISTRY", f"file:{players_file.name}")
+
+        sqs, dynamodb = InMemoryQueue(), InMemoryDynamoResource()
+        orchestrator, get_and_parse = load_handlers(sqs, dynamodb, env)
+        # the handlers raise the root logger to DEBUG on import
+        logging.getLogger().setLevel(args.log_level)
+        # concurrent invocations share one connection pool here, unlike in Lambda
+        logging.getLogger("urllib3").setLevel(logging.ERROR)
+        stats = Stats()
+        instrument(get_and_parse.rs_api, stats, api_url)
+
+        start = time.perf_counter()
+        for cycle in range(args.cycles):
+            orchestrator.handler({}, None)
+            drain(
+                sqs,
+                SEGMENTS_QUEUE_URL,
+                orchestrator.handler,
+                batch_size=1,
+                concurrency=args.concurrency,
+                max_receives=args.max_receives,
+                stats=Stats(),
+            )
+            drain(
+                sqs,
+                GET_AND_PARSE_QUEUE_URL,
+                get_and_parse.handler,
+                batch_size=10,
+                concurrency=args.concurrency,
+                max_receives=args.max_receives,
+                stats=stats,
+            )
+        elapsed = time.perf_counter() - start
+
+    if server is not None:
+        server.shutdown()
+
+    table = dynamodb.Table(TABLE_NAME)
+    latencies_ms = sorted(secs * 1e3 for secs in stats.latencies)
+    report = {
+        "players": args.players,
+        "cycles": args.cycles,
+        "elapsed_secs": round(elapsed, 3),
+        "snapshots": stats.counts["snapshots"],
+        "players_per_sec": round(stats.counts["snapshots"] / elapsed, 1),
+        "fetches": len(latencies_ms),
+        "fetch_p50_ms": round(percentile(latencies_ms, 50), 1),
+        "fetch_p99_ms": round(percentile(latencies_ms, 99), 1),
+        "get_and_parse_invocations": stats.counts["invocations"],
+        "dead_letters": stats.counts["dead_letters"],
+        "delayed_messages_left": sqs.pending(GET_AND_PARSE_QUEUE_URL),
+        "items_written": table.items_written,
+        "dynamodb_calls": dict(table.calls),
+        "sqs_calls": dict(sqs.calls),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--players", type=int, default=500)
+    parser.add_argument("--cycles", type=int, default=1)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="number of concurrent GetAndParse invocations",
+    )
+    parser.add_argument("--max-receives", type=int, default=3)
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="environment variable for the handlers; may be repeated",
+    )
+    parser.add_argument(
+        "--api-url",
+        help="base URL of an already running stub server; by default one is started",
+    )
+    parser.add_argument("--log-level", default="WARNING")
+    add_arguments(parser)
+    main(parser.parse_args())
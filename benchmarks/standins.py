@@ -0,0 +1,344 @@
+"""In-process stand-ins for the SQS and DynamoDB clients used by the Lambdas.
+
+They implement just the calls the orchestrator and GetAndParse handlers make,
+and count them, so the ingestion path can be load tested without AWS.
+
+"""
+import copy
+import itertools
+import re
+import threading
+import time
+import zlib
+from collections import Counter, deque
+
+from botocore.exceptions import ClientError
+
+
+class InMemoryQueue(object):
+    """Stand-in for an SQS client, holding the messages of every queue URL."""
+
+    def __init__(self, clock=time.monotonic):
+        self._queues = dict()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._clock = clock
+        self.calls = Counter()
+
+    def _queue(self, queue_url):
+        return self._queues.setdefault(queue_url, deque())
+
+    def _put(self, queue_url, body, delay_secs=0, receives=0):
+        message = dict(
+            messageId=str(next(self._ids)),
+            body=body,
+            visible_at=self._clock() + delay_secs,
+            receives=receives,
+        )
+        self._queue(queue_url).append(message)
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0):
+        with self._lock:
+            self.calls["SendMessage"] += 1
+            self._put(QueueUrl, MessageBody, DelaySeconds)
+        return {}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        if len(Entries) > 10:
+            raise ValueError("SendMessageBatch accepts at most 10 entries.")
+        with self._lock:
+            self.calls["SendMessageBatch"] += 1
+            for entry in Entries:
+                self._put(QueueUrl, entry["MessageBody"], entry.get("DelaySeconds", 0))
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+    def receive(self, queue_url, max_messages=10):
+        """Take up to `max_messages` visible messages as Lambda event records."""
+        now = self._clock()
+        records = []
+        with self._lock:
+            queue = self._queue(queue_url)
+            for _ in range(len(queue)):
+                if len(records) == max_messages:
+                    break
+                message = queue.popleft()
+                if message["visible_at"] <= now:
+                    message["receives"] += 1
+                    records.append(
+                        dict(
+                            messageId=message["messageId"],
+                            body=message["body"],
+                            attributes={
+                                "ApproximateReceiveCount": str(message["receives"])
+                            },
+                        )
+                    )
+                else:
+                    queue.append(message)
+        return records
+
+    def requeue(self, queue_url, records):
+        """Put records back, as SQS does for reported batch item failures."""
+        with self._lock:
+            for record in records:
+                receives = int(record["attributes"]["ApproximateReceiveCount"])
+                self._put(queue_url, record["body"], receives=receives)
+
+    def pending(self, queue_url):
+        with self._lock:
+            return len(self._queue(queue_url))
+
+
+def _evaluate(condition, item):
+    """Evaluate a boto3 key condition against an item."""
+    expression = condition.get_expression()
+    operator, values = expression["operator"], expression["values"]
+    if operator == "AND":
+        return all(_evaluate(value, item) for value in values)
+    name, *operands = values
+    value = item.get(name.name)
+    if value is None:
+        return False
+    if operator == "=":
+        return value == operands[0]
+    if operator == "<":
+        return value < operands[0]
+    if operator == "<=":
+        return value <= operands[0]
+    if operator == ">":
+        return value > operands[0]
+    if operator == ">=":
+        return value >= operands[0]
+    if operator == "BETWEEN":
+        return operands[0] <= value <= operands[1]
+    if operator == "begins_with":
+        return value.startswith(operands[0])
+    raise NotImplementedError(f"Unsupported key condition operator '{operator}'.")
+
+
+def _check(condition, item, names, values):
+    """Evaluate a disjunction of `attribute_not_exists(a)`, `a = :v` and
+    `a < :v` terms against an item."""
+    for term in condition.split(" OR "):
+        term = term.strip()
+        if term.startswith("attribute_not_exists("):
+            name = term[len("attribute_not_exists(") : -1]
+            if names.get(name, name) not in item:
+                return True
+            continue
+        name, operator, value = term.split()
+        current = item.get(names.get(name, name))
+        if current is None:
+            continue
+        if operator == "=" and current == values[value]:
+            return True
+        if operator == "<" and current < values[value]:
+            return True
+    return False
+
+
+def _project(item, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+    """Keep the document paths of a projection expression of an item."""
+    if ProjectionExpression is None:
+        return item
+    names = ExpressionAttributeNames or dict()
+    projected = dict()
+    for path in ProjectionExpression.split(","):
+        *parents, leaf = [names.get(name, name) for name in path.strip().split(".")]
+        source = item
+        for name in parents:
+            source = source.get(name) if isinstance(source, dict) else None
+        if not isinstance(source, dict) or leaf not in source:
+            continue
+        target = projected
+        for name in parents:
+            target = target.setdefault(name, dict())
+        target[leaf] = source[leaf]
+    return projected
+
+
+def _conditional_check_failed(operation):
+    return ClientError(
+        {"Error": {"Code": "ConditionalCheckFailedException"}}, operation
+    )
+
+
+class _Meta(object):
+    def __init__(self, client):
+        self.client = client
+
+
+class InMemoryTable(object):
+    """Stand-in for a DynamoDB `Table` resource keyed on player and timestamp.
+
+    Queries return at most `page_items` items per page, standing in for the
+    1 MB page limit, and take `latency_secs` each.
+
+    """
+
+    def __init__(self, name="HiScores", page_items=None, latency_secs=0):
+        self.name = name
+        self.page_items = page_items
+        self.latency_secs = latency_secs
+        self._items = dict()
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.items_written = 0
+        self.meta = _Meta(self)
+
+    @staticmethod
+    def _key(item):
+        return item["player"], item["timestamp"]
+
+    def put_item(self, Item, **kwargs):
+        with self._lock:
+            self.calls["PutItem"] += 1
+            self.items_written += 1
+            self._items[self._key(Item)] = copy.deepcopy(Item)
+        return {}
+
+    def get_item(self, Key, **kwargs):
+        with self._lock:
+            self.calls["GetItem"] += 1
+            item = self._items.get(self._key(Key))
+        return {} if item is None else {"Item": copy.deepcopy(_project(item, **kwargs))}
+
+    def update_item(
+        self,
+        Key,
+        UpdateExpression,
+        ExpressionAttributeValues,
+        ExpressionAttributeNames=None,
+        ConditionExpression=None,
+        **kwargs,
+    ):
+        """Apply the `SET a = :v, b = if_not_exists(b, :v) ADD c :n, ...` subset,
+        in either order, if the condition holds."""
+        names = ExpressionAttributeNames or dict()
+        values = ExpressionAttributeValues
+        clauses = dict(
+            zip(*[iter(re.split(r"\b(SET|ADD) ", UpdateExpression)[1:])] * 2)
+        )
+        with self._lock:
+            self.calls["UpdateItem"] += 1
+            item = self._items.get(self._key(Key), dict(Key))
+            if ConditionExpression and not _check(
+                ConditionExpression, item, names, values
+            ):
+                raise _conditional_check_failed("UpdateItem")
+            self.items_written += 1
+            self._items[self._key(Key)] = item
+            # commas that are not inside the parentheses of a function call
+            assignments = re.split(r",\s*(?![^(]*\))", clauses.get("SET", ""))
+            for assignment in filter(None, map(str.strip, assignments)):
+                name, value = (part.strip() for part in assignment.split("="))
+                name = names.get(name, name)
+                if value.startswith("if_not_exists"):
+                    value = value[value.index(":") : -1]
+                    item.setdefault(name, values[value])
+                else:
+                    item[name] = values[value]
+            for action in filter(None, clauses.get("ADD", "").split(", ")):
+                name, value = action.split()
+                name = names.get(name, name)
+                item[name] = item.get(name, 0) + values[value]
+        return {}
+
+    def query(
+        self,
+        KeyConditionExpression,
+        ScanIndexForward=True,
+        Limit=None,
+        ExclusiveStartKey=None,
+        **kwargs,
+    ):
+        with self._lock:
+            self.calls["Query"] += 1
+            items = sorted(
+                (
+                    item
+                    for item in self._items.values()
+                    if _evaluate(KeyConditionExpression, item)
+                ),
+                key=self._key,
+                reverse=not ScanIndexForward,
+            )
+        if ExclusiveStartKey is not None:
+            start = self._key(ExclusiveStartKey)
+            items = [
+                item
+                for item in items
+                if (self._key(item) > start) == ScanIndexForward
+                and self._key(item) != start
+            ]
+        if self.page_items is not None:
+            Limit = min(Limit or self.page_items, self.page_items)
+        time.sleep(self.latency_secs)
+        response = {
+            "Items": [copy.deepcopy(_project(item, **kwargs)) for item in items[:Limit]]
+        }
+        if Limit is not None and len(items) > Limit:
+            response["LastEvaluatedKey"] = {
+                "player": items[Limit - 1]["player"],
+                "timestamp": items[Limit - 1]["timestamp"],
+            }
+        return response
+
+    def scan(
+        self, Segment=0, TotalSegments=1, Limit=None, ExclusiveStartKey=None, **kwargs
+    ):
+        """Scan one segment, holding whole partitions, in key order."""
+        with self._lock:
+            self.calls["Scan"] += 1
+            items = sorted(
+                (
+                    item
+                    for item in self._items.values()
+                    if zlib.crc32(item["player"].encode()) % TotalSegments == Segment
+                ),
+                key=self._key,
+            )
+        if ExclusiveStartKey is not None:
+            start = self._key(ExclusiveStartKey)
+            items = [item for item in items if self._key(item) > start]
+        response = {
+            "Items": [copy.deepcopy(_project(item, **kwargs)) for item in items[:Limit]]
+        }
+        if Limit is not None and len(items) > Limit:
+            response["LastEvaluatedKey"] = {
+                "player": items[Limit - 1]["player"],
+                "timestamp": items[Limit - 1]["timestamp"],
+            }
+        return response
+
+    def batch_write_item(self, RequestItems):
+        with self._lock:
+            self.calls["BatchWriteItem"] += 1
+            for request in RequestItems[self.name]:
+                item = request["PutRequest"]["Item"]
+                self.items_written += 1
+                self._items[self._key(item)] = copy.deepcopy(item)
+        return {"UnprocessedItems": {}}
+
+    def batch_get_item(self, RequestItems):
+        with self._lock:
+            self.calls["BatchGetItem"] += 1
+            items = [
+                copy.deepcopy(self._items[self._key(key)])
+                for key in RequestItems[self.name]["Keys"]
+                if self._key(key) in self._items
+            ]
+        return {"Responses": {self.name: items}, "UnprocessedKeys": {}}
+
+    def __len__(self):
+        return len(self._items)
+
+
+class InMemoryDynamoResource(object):
+    """Stand-in for `boto3.resource("dynamodb")`, sharing one table per name."""
+
+    def __init__(self):
+        self.tables = dict()
+
+    def Table(self, name):
+        return self.tables.setdefault(name, InMemoryTable(name))
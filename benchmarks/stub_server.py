@@ -0,0 +1,199 @@
+#!/.venv/bin/python
+"""Local stand-in for the HiScores `index_lite.ws` endpoints.
+
+Responses have one line per row of `HISCORES_RESPONSE_ROWS`, with levels that
+match their experience. Each request may first gain the player some experience,
+so that repeated polls see both changed and unchanged snapshots. Latency, error
+rate and HTML outages are configurable.
+
+Usage:
+
+    python benchmarks/stub_server.py [--port PORT] [--latency-ms MS] ...
+
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+from hiscores_common.lib.snapshot.constants import (  # noqa: E402
+    HISCORES_RESPONSE_ACTIVITIES,
+    HISCORES_RESPONSE_ROWS,
+    HISCORES_RESPONSE_SKILLS,
+)
+
+OUTAGE_PAGE = "<!doctype html><html><body>The HiScores are down.</body></html>"
+
+# experience needed for each level, from 1 to 99
+XP_TABLE = [0]
+for _level in range(1, 99):
+    XP_TABLE.append(XP_TABLE[-1] + int(_level + 300 * 2 ** (_level / 7)) // 4)
+
+
+def level_for(xp):
+    """Get the level of a skill with `xp` experience."""
+    return max(level for level, needed in enumerate(XP_TABLE, 1) if xp >= needed)
+
+
+class StubHiscores(object):
+    """Per-player stats, generated on first request and grown on later ones."""
+
+    def __init__(self, change_rate=0.2, seed=0):
+        self.change_rate = change_rate
+        self.seed = seed
+        self._players = dict()
+        self._lock = threading.Lock()
+
+    def _new_player(self, player):
+        rng = random.Random(zlib.crc32(player.encode("utf-8")) ^ self.seed)
+        # every skill but Overall, which is their total
+        skills = [
+            int(rng.paretovariate(1.2) * 20000) for _ in HISCORES_RESPONSE_SKILLS[1:]
+        ]
+        activities = [
+            rng.randint(1, 3000) if rng.random() < 0.3 else -1
+            for _ in HISCORES_RESPONSE_ACTIVITIES
+        ]
+        return dict(rng=rng, skills=skills, activities=activities)
+
+    def response_text(self, player):
+        """Get the `index_lite.ws` response for a player."""
+        with self._lock:
+            if player not in self._players:
+                self._players[player] = self._new_player(player)
+            state = self._players[player]
+            rng = state["rng"]
+            if rng.random() < self.change_rate:
+                state["skills"][rng.randrange(len(state["skills"]))] += rng.randint(
+                    100, 50000
+                )
+            skills = [min(xp, 200000000) for xp in state["skills"]]
+            activities = list(state["activities"])
+
+        levels = [level_for(xp) for xp in skills]
+        lines = [f"{rng.randint(1, 2000000)},{sum(levels)},{sum(skills)}"]
+        lines.extend(
+            f"{2000000 - int(math.log1p(xp) * 100000)},{level},{xp}"
+            for level, xp in zip(levels, skills)
+        )
+        lines.extend(
+            f"{rng.randint(1, 500000)},{kc}" if kc >= 0 else "-1,-1"
+            for kc in activities
+        )
+        assert len(lines) == len(HISCORES_RESPONSE_ROWS)
+        return "\n".join(lines) + "\n"
+
+
+def make_handler(hiscores, latency_ms, latency_sigma, error_rate, html_rate):
+    """Build a request handler class serving `hiscores`."""
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if not url.path.endswith("index_lite.ws"):
+                return self._reply(404, "Not Found")
+            players = parse_qs(url.query).get("player")
+            if not players:
+                return self._reply(404, "Not Found")
+
+            if latency_ms > 0:
+                delay_ms = random.lognormvariate(math.log(latency_ms), latency_sigma)
+                time.sleep(delay_ms / 1e3)
+            roll = random.random()
+            if roll < html_rate:
+                return self._reply(200, OUTAGE_PAGE, content_type="text/html")
+            if roll < html_rate + error_rate:
+                return self._reply(503, "Service Unavailable")
+            return self._reply(200, hiscores.response_text(players[0]))
+
+        def _reply(self, status, text, content_type="text/plain"):
+            body = text.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def start_server(
+    port=0,
+    latency_ms=100.0,
+    latency_sigma=0.5,
+    error_rate=0.0,
+    html_rate=0.0,
+    change_rate=0.2,
+):
+    """Serve the stub on a background thread.
+
+    Returns the server, whose base URL is `http://127.0.0.1:<server_port>`.
+
+    """
+    handler = make_handler(
+        StubHiscores(change_rate=change_rate),
+        latency_ms=latency_ms,
+        latency_sigma=latency_sigma,
+        error_rate=error_rate,
+        html_rate=html_rate,
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument(
+        "--latency-sigma",
+        type=float,
+        default=0.5,
+        help="sigma of the log-normal latency distribution",
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--html-rate",
+        type=float,
+        default=0.0,
+        help="fraction of requests served the outage page; 1 is a full outage",
+    )
+    parser.add_argument(
+        "--change-rate",
+        type=float,
+        default=0.2,
+        help="probability that a player gained experience since the last poll",
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8080)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = start_server(
+        port=args.port,
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        html_rate=args.html_rate,
+        change_rate=args.change_rate,
+    )
+    print(f"Serving stub HiScores on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -3,6 +3,7 @@ from aws_cdk import aws_apigateway as apigw
 from aws_cdk import aws_dynamodb as ddb
 from aws_cdk import aws_lambda as _lambda
 from aws_cdk import aws_lambda_event_sources as lambda_event_sources
+from aws_cdk import aws_sqs as sqs
 from constructs import Construct
 
 from .util import package_lambda
@@ -28,7 +29,16 @@ class AggregatingTimeSeriesTable(Construct):
     def query_api(self):
         return self._query_api
 
-    def __init__(self, scope: Construct, id: str, **kwargs):
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        aggregation_mode="read_modify_write",
+        rollup_tiers=("daily", "monthly"),
+        rollup_strategy="direct",
+        query_cache="memory",
+        **kwargs,
+    ):
         super().__init__(scope, id, **kwargs)
 
         # Provision Dynamo Table: provisioned capacity, streaming enabled
@@ -42,6 +52,8 @@ class AggregatingTimeSeriesTable(Construct):
             write_capacity=5,
             removal_policy=RemovalPolicy.DESTROY,
             stream=ddb.StreamViewType.NEW_IMAGE,
+            # Expire query responses cached in the table (see `query_cache`)
+            time_to_live_attribute="expiresAt" if query_cache == "dynamodb" else None,
         )
 
         # Provision aggregator Lambda and grant write access
@@ -52,18 +64,39 @@ class AggregatingTimeSeriesTable(Construct):
             description="Aggregate write events into daily rows.",
             environment={
                 "HISCORES_TABLE_NAME": self._table.table_name,
+                "AGGREGATION_MODE": aggregation_mode,
+                "ROLLUP_TIERS": ",".join(rollup_tiers),
+                "ROLLUP_STRATEGY": rollup_strategy,
             },
             retry_attempts=0,
+            timeout=Duration.seconds(60),
         )
         self._table.grant_read_write_data(aggregator)
 
-        # Subscribe aggregator to table events
+        # Records of batches that still fail after retries are sent here
+        aggregator_dlq = sqs.Queue(
+            self,
+            "AggregatorDeadLetterQueue",
+            retention_period=Duration.days(14),
+        )
+
+        # Subscribe aggregator to table events, in batches that it coalesces
+        # into one write per aggregation row. Atomic increments commute, so
+        # each shard may then be processed by several concurrent batches.
+        # Failed batches are retried from their earliest failed record, and
+        # split in half on every retry to isolate the records that keep failing;
+        # aggregation rows ignore replayed records they already include.
         aggregator.add_event_source(
             lambda_event_sources.DynamoEventSource(
                 self._table,
                 starting_position=_lambda.StartingPosition.TRIM_HORIZON,
-                batch_size=1,
-                retry_attempts=0,
+                batch_size=100,
+                max_batching_window=Duration.seconds(10),
+                parallelization_factor=10 if aggregation_mode == "atomic" else 1,
+                report_batch_item_failures=True,
+                bisect_batch_on_error=True,
+                retry_attempts=3,
+                on_failure=lambda_event_sources.SqsDlq(aggregator_dlq),
             )
         )
 
@@ -75,16 +108,31 @@ class AggregatingTimeSeriesTable(Construct):
             description="Retrieve data from HiScoresTable for a given player.",
             environment={
                 "HISCORES_TABLE_NAME": self._table.table_name,
+                "ROLLUP_TIERS": ",".join(rollup_tiers),
+                "ROLLUP_STRATEGY": rollup_strategy,
+                "QUERY_CACHE": query_cache,
             },
             timeout=Duration.seconds(60),
         )
-        self._table.grant_read_data(queryer)
+        # Write access lets the queryer cache responses in the table
+        if query_cache == "dynamodb":
+            self._table.grant_read_write_data(queryer)
+        else:
+            self._table.grant_read_data(queryer)
 
         # Expose Rest API for queryer
         self._query_api = apigw.LambdaRestApi(
             self,
             "QueryHiScoresData",
             handler=queryer,
-            parameters={"player": "str", "startTime": "str", "endTime": "str"},
+            parameters={
+                "player": "str",
+                "startTime": "str",
+                "endTime": "str",
+                "skills": "str",
+                "activities": "str",
+                "fields": "str",
+                "format": "str",
+            },
         )
         self._query_api.root.add_method("GET")
@@ -7,12 +7,13 @@ from aws_cdk import aws_dynamodb as ddb
 from aws_cdk import aws_events as events
 from aws_cdk import aws_events_targets as targets
 from aws_cdk import aws_lambda as _lambda
-from aws_cdk import aws_lambda_event_sources as lambda_event_sources
 from aws_cdk import aws_sqs as sqs
 from constructs import Construct
 
 from hiscores_tracker.util import package_lambda
 
+TRIGGER_HOURS = "0-2,7-23"  # Trigger between 7am and 2am (UTC)
+
 
 class HiScoresLogger(Construct):
     """Automatically log OldSchoolRuneScape HiScores metrics to Dynamo table."""
@@ -22,7 +23,17 @@ class HiScoresLogger(Construct):
         return self._orchestrator
 
     def __init__(
-        self, scope: Construct, id: str, table: ddb.ITable, enabled=True, **kwargs
+        self,
+        scope: Construct,
+        id: str,
+        table: ddb.ITable,
+        enabled=True,
+        storage_format="nested",
+        ingest_mode="full",
+        registry="file:orchestrator/players.txt",
+        activity_store="none",
+        circuit_breaker="memory",
+        **kwargs,
     ):
         super().__init__(scope, id, **kwargs)
 
@@ -36,7 +47,12 @@ class HiScoresLogger(Construct):
                 description="Retrieve, parse, and save HiScores data for a player.",
                 environment={
                     "HISCORES_TABLE_NAME": table.table_name,
+                    "STORAGE_FORMAT": storage_format,
+                    "INGEST_MODE": ingest_mode,
+                    "ACTIVITY_STORE": activity_store,
+                    "CIRCUIT_BREAKER": circuit_breaker,
                 },
+                timeout=Duration.seconds(30),
                 layers=[
                     self.create_dependencies_layer(
                         layer_id="get-and-parse-dependencies",
@@ -47,25 +63,71 @@ class HiScoresLogger(Construct):
                     )
                 ],
             )
-        table.grant_write_data(get_and_parse_handler)
+        # Read access lets the handler compare snapshots with the last stored one
+        table.grant_read_write_data(get_and_parse_handler)
 
         # Provision GetAndParseForPlayer Queue
         get_and_parse_queue = sqs.Queue(
-            self, "GetAndParseForPlayerQueue", retention_period=Duration.days(1)
+            self,
+            "GetAndParseForPlayerQueue",
+            retention_period=Duration.days(1),
+            visibility_timeout=Duration.minutes(3),
+        )
+        # Consume full batches, retrying only the records that failed
+        get_and_parse_handler.add_event_source_mapping(
+            "GetAndParseForPlayerQueueEventSource",
+            event_source_arn=get_and_parse_queue.queue_arn,
+            batch_size=10,
+            report_batch_item_failures=True,
+        )
+        get_and_parse_queue.grant_consume_messages(get_and_parse_handler)
+        # Players rejected by the open circuit breaker are requeued with a delay
+        get_and_parse_handler.add_environment(
+            "GET_AND_PARSE_QUEUE_URL", get_and_parse_queue.queue_url
         )
-        get_and_parse_handler.add_event_source(
-            lambda_event_sources.SqsEventSource(get_and_parse_queue, batch_size=1)
+        get_and_parse_queue.grant_send_messages(get_and_parse_handler)
+
+        # Provision OrchestratorSegments Queue, used to split large rosters
+        segments_queue = sqs.Queue(
+            self,
+            "OrchestratorSegmentsQueue",
+            retention_period=Duration.hours(1),
+            visibility_timeout=Duration.minutes(6),
         )
 
         # Create Orchestrator Lambda
+        environment = {
+            "GET_AND_PARSE_QUEUE_URL": get_and_parse_queue.queue_url,
+            "SEGMENTS_QUEUE_URL": segments_queue.queue_url,
+            "PLAYER_REGISTRY": registry,
+            "ACTIVITY_STORE": activity_store,
+            # The adaptive schedule counts only the cycles the trigger runs in
+            "ACTIVE_HOURS": TRIGGER_HOURS,
+        }
+        # The registry and activity statistics may live in the HiScores table
+        uses_table = "dynamodb" in (registry, activity_store)
+        if uses_table:
+            environment["HISCORES_TABLE_NAME"] = table.table_name
         self._orchestrator = package_lambda(
             scope=self,
             handler_name="orchestrator",
             function_name="OrchestratorLambda",
             description="Read configuration and kick off HiScores tracking.",
-            environment={"GET_AND_PARSE_QUEUE_URL": get_and_parse_queue.queue_url},
+            environment=environment,
+            timeout=Duration.minutes(1),
         )
         get_and_parse_queue.grant_send_messages(self._orchestrator)
+        segments_queue.grant_send_messages(self._orchestrator)
+        if uses_table:
+            table.grant_read_data(self._orchestrator)
+
+        # Segments are dispatched by the Orchestrator in parallel invocations
+        self._orchestrator.add_event_source_mapping(
+            "OrchestratorSegmentsQueueEventSource",
+            event_source_arn=segments_queue.queue_arn,
+            batch_size=1,
+        )
+        segments_queue.grant_consume_messages(self._orchestrator)
 
         # Create Event to trigger Orchestrator on schedule
         rule = events.Rule(
@@ -75,7 +137,7 @@ class HiScoresLogger(Construct):
             enabled=enabled,
             schedule=events.Schedule.cron(
                 minute="*/30",  # Trigger every 30 minutes
-                hour="0-2,7-23",  # Trigger between 7am and 2am
+                hour=TRIGGER_HOURS,
             ),
         )
         rule.add_target(targets.LambdaFunction(self._orchestrator))
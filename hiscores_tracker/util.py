@@ -5,13 +5,16 @@ from tempfile import TemporaryDirectory
 
 from aws_cdk import aws_lambda as _lambda
 
+SHARED_CODE_DIR = os.path.join("lambda", "hiscores_common")
+
 
 @contextmanager
-def wraps_code_dir(code_dir):
-    """Copy a code directory into a temporary directory."""
+def wraps_code_dir(code_dir, shared_code_dirs=(SHARED_CODE_DIR,)):
+    """Copy a code directory, and any shared code, into a temporary directory."""
     with TemporaryDirectory() as tmp_dir:
-        new_path = os.path.join(tmp_dir, os.path.basename(code_dir))
-        shutil.copytree(code_dir, new_path)
+        for _dir in (code_dir, *shared_code_dirs):
+            new_path = os.path.join(tmp_dir, os.path.basename(_dir))
+            shutil.copytree(_dir, new_path)
         yield tmp_dir
 
 
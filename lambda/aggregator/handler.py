@@ -1,94 +1,416 @@
 import logging
 import os
-from datetime import datetime
 
 import boto3
+from aggregator.lib.dynamo_aggregator.engine import (
+    ROLLUP_SCHEMA,
+    SNAPSHOT_SCHEMA,
+    SchemaMismatch,
+)
 from aggregator.lib.dynamo_aggregator.util import (
+    ROLLUP_AGGREGATOR,
     aggregate_hiscores_rows,
+    apply_flat_delta,
+    fold_flat_rows,
+    fold_hiscores_rows,
+    group_rows,
+    image_to_flat,
+    item_to_flat,
     lint_query_response,
     parse_image,
     unroll_image,
 )
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from hiscores_common.lib.snapshot.delta import BASE_ATTRIBUTE, apply_delta
+from hiscores_common.lib.snapshot.rollup import WATERMARK_ATTRIBUTE, build_add_update
+from hiscores_common.lib.table.bucketing import validate_timestamp
+from hiscores_common.lib.table.keys import RESERVED_PARTITIONS
+from hiscores_common.lib.table.tiers import (
+    DEFAULT_TIERS,
+    ROLLUP_SENTINELS,
+    TIERS,
+    derivation_sources,
+    parse_tiers,
+)
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 ddb = boto3.resource("dynamodb")
 table = ddb.Table(os.environ["HISCORES_TABLE_NAME"])
+# read_modify_write or atomic
+AGGREGATION_MODE = os.environ.get("AGGREGATION_MODE", "read_modify_write")
+# comma-separated rollup tiers to maintain, from hiscores_common.lib.table.tiers
+ROLLUP_TIERS = parse_tiers(os.environ.get("ROLLUP_TIERS", DEFAULT_TIERS))
+# direct: every tier from raw snapshots; hierarchical: coarser tiers from finer ones
+ROLLUP_STRATEGY = os.environ.get("ROLLUP_STRATEGY", "direct")
+if ROLLUP_STRATEGY not in ("direct", "hierarchical"):
+    raise ValueError(f"Unsupported rollup strategy: {ROLLUP_STRATEGY}")
+
+SOURCES = derivation_sources(ROLLUP_TIERS) if ROLLUP_STRATEGY == "hierarchical" else {}
+RAW_TIERS = [tier for tier in ROLLUP_TIERS if tier.name not in SOURCES]
+DERIVED_TIERS = {
+    source.name: [TIERS[name] for name, s in SOURCES.items() if s == source]
+    for source in SOURCES.values()
+}
+"""Tiers derived from each source tier, by the source's name."""
 
-DAILY_SENTINEL = "Daily#"
-MONTHLY_SENTINEL = "Monthly#"
-TIMESTAMP = "%Y-%m-%d %H:%M:%S"
-DATE = "%Y-%m-%d"
-MONTH = "%Y-%m"
 
+def read_snapshot(image, bases=None):
+    """Decode the stream image of a snapshot into its player, its timestamp
+    and the flat `values` of its stats, in `SNAPSHOT_SCHEMA` order.
 
-def _timestamp_to_date(timestamp):
-    """Parse a date from a timestamp."""
-    return datetime.strptime(timestamp, TIMESTAMP).strftime(DATE)
+    Deltas are rebuilt by reading their base, and bases are cached in `bases`,
+    if given, since the deltas of a batch tend to share them. Snapshots whose
+    stats do not match the schema, e.g. ones written before it last changed,
+    are unrolled into nested items instead.
 
+    """
+    player_id, timestamp = parse_image(image)
+    snapshot = {"player": player_id, "timestamp": timestamp}
+    if BASE_ATTRIBUTE not in image:
+        try:
+            return dict(snapshot, values=image_to_flat(image))
+        except SchemaMismatch:
+            logger.warning(f"Snapshot {player_id}:{timestamp} is outside the schema.")
+            return unroll_image(image)
 
-def _timestamp_to_month(timestamp):
-    """Parse a month from a timestamp."""
-    return datetime.strptime(timestamp, TIMESTAMP).strftime(MONTH)
+    delta = unroll_image(image)
+    key = (player_id, delta[BASE_ATTRIBUTE])
+    bases = dict() if bases is None else bases
+    if key not in bases:
+        logger.info(f"Reading base snapshot {key} for delta.")
+        bases[key] = table.get_item(Key={"player": key[0], "timestamp": key[1]}).get(
+            "Item"
+        )
+    if bases[key] is None:
+        raise ValueError(f"Base snapshot {key} does not exist.")
+    try:
+        return dict(snapshot, values=apply_flat_delta(item_to_flat(bases[key]), delta))
+    except SchemaMismatch:
+        logger.warning(f"Base snapshot {key} is outside the schema.")
+        return apply_delta(lint_query_response(bases[key]), delta)
 
 
-def aggregate(image, interval="daily"):
-    player_id, timestamp = parse_image(image)
+def nested_snapshot(snapshot):
+    """Get a snapshot read by `read_snapshot` as a nested item."""
+    if "values" not in snapshot:
+        return snapshot
+    return dict(
+        SNAPSHOT_SCHEMA.unflatten(snapshot["values"]),
+        player=snapshot["player"],
+        timestamp=snapshot["timestamp"],
+    )
+
+
+def fold_snapshots(snapshots, key):
+    """Fold snapshots read by `read_snapshot` into one row keyed on `key`.
+
+    Returns:
+        tuple: The nested row, and its flat values, or `None` if any snapshot is
+        outside the rollup schema.
+
+    """
+    if all("values" in snapshot for snapshot in snapshots):
+        values = fold_flat_rows([snapshot["values"] for snapshot in snapshots])
+        return dict(ROLLUP_SCHEMA.unflatten(values), **key), values
+    logger.info("Folding snapshots outside the schema as nested items.")
+    folded = fold_hiscores_rows(
+        [nested_snapshot(snapshot) for snapshot in snapshots], key["timestamp"]
+    )
+    return folded, None
+
+
+def read_watermark(key):
+    """Get the timestamp of the last snapshot added to an aggregation row."""
+    response = table.get_item(
+        Key=key,
+        ProjectionExpression="#w",
+        ExpressionAttributeNames={"#w": WATERMARK_ATTRIBUTE},
+        ConsistentRead=True,
+    )
+    return response.get("Item", dict()).get(WATERMARK_ATTRIBUTE)
 
-    if interval == "daily":
-        timestamp = f"{DAILY_SENTINEL}{_timestamp_to_date(timestamp)}"
-        logger.info(f"Processing daily aggregation for {player_id}:{timestamp}.")
-    elif interval == "monthly":
-        timestamp = f"{MONTHLY_SENTINEL}{_timestamp_to_month(timestamp)}"
-        logger.info(f"Processing monthly aggregation for {player_id}:{timestamp}.")
-    else:
-        raise ValueError(f"Unsupported aggregation interval: {interval}")
 
-    unrolled_new_image = unroll_image(image)
-    unrolled_new_image["timestamp"] = timestamp
-    unrolled_new_image["divisor"] = 1
-    logger.info(f"Formatted incoming row: {unrolled_new_image}")
+def newer_snapshots(snapshots, watermark):
+    """Drop the snapshots already added to a row with the given watermark."""
+    if watermark is None:
+        return snapshots
+    newer = [snapshot for snapshot in snapshots if snapshot["timestamp"] > watermark]
+    if len(newer) < len(snapshots):
+        logger.info(
+            f"Skipping {len(snapshots) - len(newer)} snapshots already aggregated "
+            f"through '{watermark}'."
+        )
+    return newer
+
+
+def add_atomically(snapshots, key):
+    """Add snapshots to an aggregation row with one conditional `UpdateItem`."""
+    folded, _ = fold_snapshots(snapshots, key)
+    logger.debug(f"Folded incoming rows: {folded}")
+    logger.info(f"Adding to {key}")
+    table.update_item(
+        Key=key,
+        **build_add_update(
+            folded,
+            folded["divisor"],
+            watermark=snapshots[-1]["timestamp"],
+            after=snapshots[0]["timestamp"],
+        ),
+    )
+    return folded
+
+
+def aggregate(snapshots, interval="daily", mode=None):
+    """Add snapshots of one player and one bucket of `interval` to the stored
+    aggregation of that bucket.
+
+    In `read_modify_write` mode this takes a single read and write. In `atomic`
+    mode it is a single `UpdateItem` adding every leaf server-side, which stays
+    correct when several invocations update the same row concurrently.
+
+    Snapshots and stored rows are summed as flat values, unless any of them is
+    outside the rollup schema, in which case they are summed as nested items.
+
+    A player's snapshots are aggregated in order, so each row records the last
+    snapshot added to it and ignores older ones: replayed stream records, such
+    as those of a retried batch, add nothing twice. Returns `None` if every
+    snapshot had already been added.
+
+    """
+    if interval not in TIERS:
+        raise ValueError(f"Unsupported aggregation interval: {interval}")
+    mode = mode or AGGREGATION_MODE
+    if mode not in ("read_modify_write", "atomic"):
+        raise ValueError(f"Unsupported aggregation mode: {mode}")
+    snapshots = sorted(snapshots, key=lambda snapshot: snapshot["timestamp"])
+    player_id = snapshots[0]["player"]
+    timestamp = TIERS[interval].timestamp_key(snapshots[0]["timestamp"])
+    logger.info(
+        f"Processing {interval} aggregation of {len(snapshots)} snapshots for "
+        f"{player_id}:{timestamp}."
+    )
 
     key = {"player": player_id, "timestamp": timestamp}
+    if mode == "atomic":
+        try:
+            return add_atomically(snapshots, key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+        # some snapshots were added before, so add only the newer ones
+        snapshots = newer_snapshots(snapshots, read_watermark(key))
+        if not snapshots:
+            return None
+        return add_atomically(snapshots, key)
+
     logger.info(f"Querying table for {key}")
     resp = table.get_item(Key=key)
-    logger.info(f"Received response {resp}")
+    logger.debug(f"Received response {resp}")
+
+    stored = resp.get("Item")
+    if stored is not None:
+        snapshots = newer_snapshots(snapshots, stored.pop(WATERMARK_ATTRIBUTE, None))
+        if not snapshots:
+            return None
+    folded, values = fold_snapshots(snapshots, key)
+    logger.debug(f"Folded incoming rows: {folded}")
+
+    if stored is not None and values is not None:
+        try:
+            stored_values = item_to_flat(stored, ROLLUP_SCHEMA)
+        except SchemaMismatch:
+            logger.info(f"Stored row {key} is outside the schema.")
+        else:
+            values = ROLLUP_AGGREGATOR.reduce_flat([stored_values, values])
+            folded = dict(ROLLUP_SCHEMA.unflatten(values), **key)
+            stored = None
 
-    linted_resp = lint_query_response(resp.get("Item"))
-    logger.info(f"Linted response: {linted_resp}")
+    linted_resp = lint_query_response(stored)
+    logger.debug(f"Linted response: {linted_resp}")
 
-    new_item = aggregate_hiscores_rows(linted_resp, unrolled_new_image)
-    logger.info(f"Produced aggregation {new_item}")
+    new_item = aggregate_hiscores_rows(linted_resp, folded)
+    new_item[WATERMARK_ATTRIBUTE] = snapshots[-1]["timestamp"]
+    logger.debug(f"Produced aggregation {new_item}")
 
     table.put_item(Item=new_item)
 
     return new_item
 
 
+def previous_row(player_id, tier, timestamp):
+    """Get the latest row of `tier` before the row at `timestamp`, if any."""
+    response = table.query(
+        KeyConditionExpression=Key("player").eq(player_id)
+        & Key("timestamp").between(tier.sentinel, timestamp),
+        ScanIndexForward=False,
+        Limit=2,
+        ConsistentRead=True,
+    )
+    for item in response["Items"]:
+        if item["timestamp"] != timestamp:
+            return item
+    return None
+
+
+def roll_up(player_id, tier, timestamp):
+    """Add the row of `tier` preceding a newly inserted one to the rows derived
+    from it.
+
+    A player's rows are written in order, so the preceding row is final once a
+    new one exists. Each derived row records the last row added to it, and
+    ignores rows that are not newer, so replays add nothing twice.
+
+    """
+    item = lint_query_response(previous_row(player_id, tier, timestamp))
+    if item is None:
+        return 0
+    start = tier.bucket_start(item["timestamp"])
+    for derived in DERIVED_TIERS[tier.name]:
+        key = {"player": player_id, "timestamp": derived.key(start)}
+        logger.info(f"Rolling up {player_id}:{item['timestamp']} into {key}")
+        try:
+            table.update_item(
+                Key=key,
+                **build_add_update(item, item["divisor"], watermark=item["timestamp"]),
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            logger.info(f"{key} already includes {item['timestamp']}.")
+    return len(DERIVED_TIERS[tier.name])
+
+
+def parse_rollovers(records):
+    """Get the player and sort key of every row of a source tier inserted by a
+    batch of stream records."""
+    sentinels = tuple(TIERS[name].sentinel for name in DERIVED_TIERS)
+    rollovers = []
+    for record in records:
+        if record["eventName"] != "INSERT" or not sentinels:
+            continue
+        player_id, timestamp = parse_image(record["dynamodb"]["NewImage"])
+        if timestamp.startswith(sentinels):
+            rollovers.append((player_id, timestamp))
+    return rollovers
+
+
+def parse_snapshots(records):
+    """Get the full snapshots inserted by a batch of stream records, as read by
+    `read_snapshot`, skipping writes to reserved partitions and to aggregation
+    rows.
+
+    Snapshots that can never be read, as their timestamp is malformed or their
+    base does not exist, are logged and skipped. Those that failed otherwise,
+    e.g. as reading their base was throttled, are returned apart to be retried.
+
+    Returns:
+        tuple: The snapshots read, and the player and timestamp of each snapshot
+        that failed to be read but may be on a retry.
+
+    """
+    snapshots = []
+    unread = []
+    bases = dict()
+    for record in records:
+        event_name = record["eventName"]
+        if event_name != "INSERT":
+            logger.info(f"Ignoring non-insert event '{event_name}'.")
+            continue
+        new_image = record["dynamodb"]["NewImage"]
+        player_id, timestamp = parse_image(new_image)
+        if player_id in RESERVED_PARTITIONS:
+            logger.info(f"Ignoring event from reserved partition '{player_id}'.")
+            continue
+        if timestamp.startswith(ROLLUP_SENTINELS):
+            logger.info(f"Ignoring event from aggregation write '{timestamp}'.")
+            continue
+
+        logger.debug(f"Received image: {new_image}")
+        try:
+            validate_timestamp(timestamp)
+            snapshots.append(read_snapshot(new_image, bases))
+        except ValueError:
+            logger.exception(f"Skipping unreadable snapshot {player_id}:{timestamp}")
+        except Exception:
+            logger.exception(f"Failed to read snapshot {player_id}:{timestamp}")
+            unread.append((player_id, timestamp))
+    return snapshots, unread
+
+
+def sequence_numbers(records):
+    """Get the sequence number of each inserted row of a batch of stream
+    records, by player and sort key."""
+    return {
+        parse_image(record["dynamodb"]["NewImage"]): record["dynamodb"][
+            "SequenceNumber"
+        ]
+        for record in records
+        if record["eventName"] == "INSERT"
+    }
+
+
 def handler(event, context):
-    event_name = event["Records"][0]["eventName"]
-    event_source = event["Records"][0]["eventSource"]
-    logger.info(f"Processing Event '{event_name}' from source '{event_source}'.")
-
-    if event_name == "INSERT":
-        new_image = event["Records"][0]["dynamodb"]["NewImage"]
-        _, timestamp = parse_image(new_image)
-        if timestamp.startswith(DAILY_SENTINEL):
-            logger.info("Ignoring event from daily aggregation write.")
-            return
-        if timestamp.startswith(MONTHLY_SENTINEL):
-            logger.info("Ignoring event from monthly aggregation write.")
-            return
-
-        logger.info(f"Received image: {new_image}")
-
-        # aggregate daily
-        daily = aggregate(new_image, interval="daily")
-
-        # aggregate monthly
-        monthly = aggregate(new_image, interval="monthly")
-
-        return daily, monthly
-    else:
-        logger.info("Ignoring non-insert event.")
+    """Aggregate every snapshot inserted by a batch of stream records.
+
+    Snapshots are grouped by player and by bucket of every tier in
+    `ROLLUP_TIERS`, and each group is folded in memory and added to its
+    aggregation row with one write, however many snapshots it holds.
+
+    With the hierarchical `ROLLUP_STRATEGY`, snapshots are only aggregated into
+    the finest tiers. Each coarser tier is derived from a finer one, whose rows
+    are added to it once they are final.
+
+    The earliest record of any group or rollup that failed is reported as a
+    batch item failure, so the stream is retried from it. Rows ignore what
+    they already include, so records after it are replayed harmlessly.
+
+    """
+    records = event["Records"]
+    logger.info(f"Processing batch of {len(records)} records.")
+    snapshots, unread = parse_snapshots(records)
+    sequences = sequence_numbers(records)
+    failed = {sequences[key] for key in unread}
+    # a row ignores snapshots older than its latest, so none of a player's
+    # snapshots after one to be retried may be added before it
+    retry_after = dict()
+    for player_id, timestamp in unread:
+        retry_after[player_id] = min(timestamp, retry_after.get(player_id, timestamp))
+    snapshots = [
+        snapshot
+        for snapshot in snapshots
+        if snapshot["player"] not in retry_after
+        or snapshot["timestamp"] < retry_after[snapshot["player"]]
+    ]
+
+    written = dict()
+    for player_id, timestamp in parse_rollovers(records):
+        tier = next(t for t in ROLLUP_TIERS if timestamp.startswith(t.sentinel))
+        try:
+            written["rolled_up"] = written.get("rolled_up", 0) + roll_up(
+                player_id, tier, timestamp
+            )
+        except Exception:
+            logger.exception(f"Failed to roll up before {player_id}:{timestamp}")
+            failed.add(sequences[(player_id, timestamp)])
+
+    for tier in RAW_TIERS:
+        groups = group_rows(snapshots, tier.bucket_key)
+        for (player_id, bucket), group in groups.items():
+            try:
+                aggregate(group, interval=tier.name)
+            except Exception:
+                logger.exception(f"Failed to aggregate {player_id}:{bucket}")
+                failed.update(
+                    sequences[(player_id, snapshot["timestamp"])] for snapshot in group
+                )
+        written[tier.name] = len(groups)
+
+    logger.info(f"Aggregated {len(snapshots)} snapshots into {written} rows.")
+    if not failed:
+        return {"batchItemFailures": []}
+    retry_from = min(failed, key=int)
+    logger.warning(f"Retrying {len(records)} records from sequence {retry_from}.")
+    return {"batchItemFailures": [{"itemIdentifier": retry_from}]}
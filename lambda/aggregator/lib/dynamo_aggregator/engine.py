@@ -0,0 +1,371 @@
+"""Aggregation of nested rows as flat arrays, compiled from a schema.
+
+A `CompiledSchema` fixes the order of the leaves of a nested row once. Rows are
+then flattened into lists of their leaf values, reduced column by column, and
+built back into nested rows, without walking or type-checking them key by key.
+Batches are reduced with NumPy when it is installed.
+
+"""
+from decimal import Decimal
+from itertools import chain
+from operator import itemgetter
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from hiscores_common.lib.snapshot.rollup import DIVISOR_ATTRIBUTE, ROLLUP_LEAVES
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class SchemaMismatch(ValueError):
+    """Schemas of nested dicts do not match."""
+
+
+def aggregate_dictlikes(a, b, aggregation_fn=lambda a, b: a + b, _key_path=""):
+    """Aggregate nested dict-likes, preserving schema.
+
+    Adds to a nested aggregation with values from a second dict-like containing
+    the same keys. While the second object must contain all of the keys in the
+    aggregation, it may contain additional keys. These will be ignored.
+
+    Args:
+        a (dict): First dict-like to aggregate.
+        b (dict): Second dict-like to aggregate.
+        aggregation_fn (Callable): Two-item aggregation operation.
+
+    Returns:
+        dict
+
+    """
+    result = dict()
+    for key, a_val in a.items():
+        new_key_path = _key_path + "_" + key
+        if key not in b:
+            raise SchemaMismatch(
+                f"Expected key '{new_key_path}' does not exist in object b."
+            )
+        b_val = b[key]
+        a_val_type = type(a_val)
+        b_val_type = type(b_val)
+        if a_val_type != b_val_type:
+            raise SchemaMismatch(
+                f"Key '{new_key_path}' of type '{b_val_type}' does not match "
+                f"expected type of '{a_val_type}'"
+            )
+        if isinstance(a_val, dict):
+            result[key] = aggregate_dictlikes(
+                a_val,
+                b_val,
+                aggregation_fn=aggregation_fn,
+                _key_path=new_key_path,
+            )
+        else:
+            result[key] = aggregation_fn(a_val, b_val)
+    return result
+
+
+def _tuple_getter(keys: Sequence[str]) -> Callable[[dict], tuple]:
+    """Get an `itemgetter` of keys that returns a tuple even for a single key."""
+    if len(keys) > 1:
+        return itemgetter(*keys)
+    (key,) = keys
+    return lambda node: (node[key],)
+
+
+class _Segment(NamedTuple):
+    """Consecutive leaves of a schema: the leaves `keys` of the node at `path`,
+    or of each of its children `names`."""
+
+    path: Tuple[str, ...]
+    names: Optional[Tuple[str, ...]]
+    keys: Tuple[str, ...]
+    get_names: Optional[Callable[[dict], tuple]]
+    get_keys: Callable[[dict], tuple]
+
+
+def _segments(paths: Sequence[Tuple[str, ...]]) -> List[_Segment]:
+    """Split leaf paths, in order, into segments of children of one node with the
+    same leaves, such as the rank, level and experience of every skill.
+
+    Examples:
+    >>> paths = [("d",), ("s", "a", "x"), ("s", "a", "y"), ("s", "b", "x"), ("s", "b", "y")]
+    >>> [segment[:3] for segment in _segments(paths)]
+    [((), None, ('d',)), (('s',), ('a', 'b'), ('x', 'y'))]
+
+    """  # noqa: E501
+    runs: List[Tuple[Tuple[str, ...], List[str]]] = []
+    for path in paths:
+        if runs and runs[-1][0] == path[:-1]:
+            runs[-1][1].append(path[-1])
+        else:
+            runs.append((path[:-1], [path[-1]]))
+
+    segments: List[Tuple[Tuple[str, ...], Optional[List[str]], Tuple[str, ...]]] = []
+    seen = set()
+    for parent, keys in runs:
+        keys = tuple(keys)
+        if not parent or parent in seen:
+            # leaves of the root, or more leaves of a node seen before
+            segments.append((parent, None, keys))
+        elif (
+            segments
+            and segments[-1][1] is not None
+            and segments[-1][0] == parent[:-1]
+            and segments[-1][2] == keys
+        ):
+            segments[-1][1].append(parent[-1])
+        else:
+            segments.append((parent[:-1], [parent[-1]], keys))
+        seen.add(parent)
+    return [
+        _Segment(
+            path,
+            None if names is None else tuple(names),
+            keys,
+            None if names is None else _tuple_getter(names),
+            _tuple_getter(keys),
+        )
+        for path, names, keys in segments
+    ]
+
+
+_get_map = itemgetter("M")
+_get_number = itemgetter("N")
+
+
+class CompiledSchema(object):
+    """Fixed ordering of the leaves of a nested row.
+
+    Leaves are split, when the schema is built, into segments of children of one
+    node with the same leaves, such as every skill's rank, level and experience.
+    Each segment is then flattened with `itemgetter` calls mapped over its
+    children, and unflattened with one comprehension, rather than by walking
+    the row key by key. Keys of the row outside the schema are ignored. A row
+    that lacks a leaf, or has a leaf that is not a `leaf_type`, raises the same
+    `SchemaMismatch` as `aggregate_dictlikes` would.
+
+    Rows can also be flattened straight from DynamoDB stream images, or from
+    items read with boto3, whose leaves are cast to `leaf_type` on the way.
+
+    Examples:
+    >>> schema = CompiledSchema([("a",), ("b", "x"), ("b", "y")])
+    >>> schema.flatten({"a": 1, "b": {"x": 2, "y": 3}, "player": "Brec"})
+    [1, 2, 3]
+    >>> schema.unflatten([1, 2, 3])
+    {'a': 1, 'b': {'x': 2, 'y': 3}}
+    >>> schema.flatten_image(
+    ...     {"a": {"N": "1"}, "b": {"M": {"x": {"N": "2"}, "y": {"N": "3"}}}}
+    ... )
+    [1, 2, 3]
+    >>> schema.flatten({"a": 1, "b": {"x": 2}})
+    Traceback (most recent call last):
+    ...
+    aggregator.lib.dynamo_aggregator.engine.SchemaMismatch: Expected key '_b_y' does not exist in object b.
+
+    """  # noqa: E501
+
+    def __init__(self, paths: Iterable[Tuple[str, ...]], leaf_type: type = int):
+        self.paths = [tuple(path) for path in paths]
+        if not self.paths:
+            raise ValueError("A schema must have at least one leaf.")
+        self.leaf_type = leaf_type
+        self.index = {path: i for i, path in enumerate(self.paths)}
+        if len(self.index) != len(self.paths):
+            raise ValueError("Leaf paths of a schema must be unique.")
+        self._segments = _segments(self.paths)
+        self.template = self.unflatten([leaf_type()] * len(self.paths))
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def _leaves(self, row: dict, image: bool = False) -> Iterable:
+        """Get the leaves of a row, in schema order, or the typed attribute
+        values of the leaves of a DynamoDB stream image."""
+        for segment in self._segments:
+            node = row
+            for key in segment.path:
+                node = node[key]["M"] if image else node[key]
+            if segment.names is None:
+                yield segment.get_keys(node)
+                continue
+            children = segment.get_names(node)
+            if image:
+                children = map(_get_map, children)
+            yield chain.from_iterable(map(segment.get_keys, children))
+
+    def flatten(self, row: dict) -> list:
+        """Get the leaf values of a nested row, in schema order."""
+        try:
+            values = list(chain.from_iterable(self._leaves(row)))
+        except (KeyError, TypeError):
+            values = None
+        if values is None or set(map(type, values)) != {self.leaf_type}:
+            self._raise_schema_mismatch(row)
+        return values
+
+    def flatten_image(self, image: dict) -> list:
+        """Get the leaf values of a DynamoDB stream image, in schema order,
+        reading the typed attribute values of its leaves directly.
+
+        Raises:
+            SchemaMismatch: if the image lacks a leaf, or holds one as anything
+                but a number.
+
+        """
+        leaves = chain.from_iterable(self._leaves(image, image=True))
+        try:
+            return list(map(self.leaf_type, map(_get_number, leaves)))
+        except (KeyError, TypeError, ValueError) as e:
+            raise SchemaMismatch(f"Image lacks numeric leaf {e} of the schema.")
+
+    def flatten_item(self, item: dict) -> list:
+        """Get the leaf values of an item read with boto3, in schema order,
+        casting each from `Decimal` to `leaf_type`.
+
+        Raises:
+            SchemaMismatch: if the item lacks a leaf, or holds one as anything
+                but a number.
+
+        """
+        leaves = chain.from_iterable(self._leaves(item))
+        try:
+            return list(map(self._cast_decimal, leaves))
+        except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+            raise SchemaMismatch(f"Item lacks numeric leaf {e} of the schema.")
+
+    def _cast_decimal(self, value):
+        if type(value) is not Decimal and type(value) is not self.leaf_type:
+            raise TypeError(f"{value!r} is not a number.")
+        return self.leaf_type(value)
+
+    def unflatten(self, values: Sequence) -> dict:
+        """Build a nested row from leaf values in schema order."""
+        if len(values) != len(self.paths):
+            raise ValueError(f"Expected {len(self.paths)} values, got {len(values)}.")
+        values = iter(values)
+        row: dict = dict()
+        for segment in self._segments:
+            node = row
+            for key in segment.path:
+                node = node.setdefault(key, dict())
+            # `zip` stops at the end of the keys, before taking another value
+            if segment.names is None:
+                node.update(zip(segment.keys, values))
+            else:
+                node.update(
+                    {name: dict(zip(segment.keys, values)) for name in segment.names}
+                )
+        return row
+
+    def _raise_schema_mismatch(self, row):
+        """Raise the same error as `aggregate_dictlikes` for a bad row."""
+        if not isinstance(row, dict):
+            raise SchemaMismatch(f"Row of type '{type(row)}' is not a dict.")
+        aggregate_dictlikes(self.template, row)
+        raise SchemaMismatch("Row does not match the compiled schema.")
+
+
+class Reducer(NamedTuple):
+    """Column-wise reduction of flat rows."""
+
+    reduce_rows: Callable[[Sequence[Sequence]], list]
+    """Reduce a sequence of flat rows into one."""
+    reduce_array: Optional[Callable] = None
+    """Reduce a 2-D NumPy array of rows into a 1-D array, if vectorizable."""
+
+
+def _sum_rows(rows: Sequence[Sequence]) -> list:
+    return [sum(column) for column in zip(*rows)]
+
+
+def _min_rows(rows: Sequence[Sequence]) -> list:
+    return [min(column) for column in zip(*rows)]
+
+
+def _max_rows(rows: Sequence[Sequence]) -> list:
+    return [max(column) for column in zip(*rows)]
+
+
+REDUCERS: Dict[str, Reducer] = {
+    "sum": Reducer(_sum_rows, lambda array: array.sum(axis=0)),
+    "min": Reducer(_min_rows, lambda array: array.min(axis=0)),
+    "max": Reducer(_max_rows, lambda array: array.max(axis=0)),
+    "first": Reducer(lambda rows: list(rows[0]), lambda array: array[0]),
+    "last": Reducer(lambda rows: list(rows[-1]), lambda array: array[-1]),
+}
+"""Reducers by name; add to it to make a reducer available by name."""
+
+
+class FlatAggregator(object):
+    """Aggregate nested rows of a compiled schema with a column-wise reducer.
+
+    Batches of at least `numpy_min_rows` rows are reduced with NumPy, when it
+    is installed and the reducer is vectorizable; smaller ones are not worth
+    converting to an array.
+
+    Examples:
+    >>> schema = CompiledSchema([("a",), ("b", "x")])
+    >>> rows = [{"a": 1, "b": {"x": 5}}, {"a": 2, "b": {"x": 3}}]
+    >>> FlatAggregator(schema).aggregate(rows)
+    {'a': 3, 'b': {'x': 8}}
+    >>> FlatAggregator(schema, reducer="max").aggregate(rows)
+    {'a': 2, 'b': {'x': 5}}
+    >>> FlatAggregator(schema, reducer="median")
+    Traceback (most recent call last):
+    ...
+    ValueError: Unsupported reducer 'median'.
+
+    """
+
+    def __init__(
+        self,
+        schema: CompiledSchema,
+        reducer: Union[str, Reducer] = "sum",
+        numpy_min_rows: int = 16,
+    ):
+        if isinstance(reducer, str):
+            if reducer not in REDUCERS:
+                raise ValueError(f"Unsupported reducer '{reducer}'.")
+            reducer = REDUCERS[reducer]
+        self.schema = schema
+        self.reducer = reducer
+        self.numpy_min_rows = numpy_min_rows
+
+    def reduce_flat(self, rows: Sequence[Sequence]) -> list:
+        """Reduce flat rows of the schema into one."""
+        if not rows:
+            raise ValueError("Cannot aggregate an empty group of rows.")
+        if (
+            np is not None
+            and self.reducer.reduce_array is not None
+            and len(rows) >= self.numpy_min_rows
+        ):
+            return self.reducer.reduce_array(np.array(rows)).tolist()
+        return self.reducer.reduce_rows(rows)
+
+    def aggregate_flat(self, rows: Iterable[dict]) -> List:
+        """Reduce nested rows into the flat values of their aggregation."""
+        return self.reduce_flat([self.schema.flatten(row) for row in rows])
+
+    def aggregate(self, rows: Iterable[dict]) -> dict:
+        """Reduce nested rows into their nested aggregation."""
+        return self.schema.unflatten(self.aggregate_flat(rows))
+
+
+SNAPSHOT_SCHEMA = CompiledSchema(ROLLUP_LEAVES)
+"""Schema of full snapshots: every skill and activity leaf."""
+
+ROLLUP_SCHEMA = CompiledSchema(ROLLUP_LEAVES + [(DIVISOR_ATTRIBUTE,)])
+"""Schema of rollup rows: the leaves of a snapshot, then the divisor."""
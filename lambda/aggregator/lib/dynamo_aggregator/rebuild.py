@@ -0,0 +1,325 @@
+"""Offline rebuild of the rollup rows of the HiScores table from raw snapshots.
+
+Raw items are read in shards, such as the segments of a parallel scan or the
+files of a table export, and each shard is folded into partial rollup rows of
+the tiers aggregated from raw snapshots. Partial rows of the same bucket, from
+players whose snapshots span shards, are then added together, and tiers derived
+hierarchically are rolled up from their sources as the aggregator would. Like
+the aggregator's, every row records the last snapshot or row added to it, so
+stream records replayed after the rebuild are not added again.
+
+"""
+import gzip
+import json
+import logging
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from aggregator.lib.dynamo_aggregator.util import (
+    KEY_ATTRIBUTES,
+    aggregate_hiscores_rows,
+    fold_hiscores_rows,
+    group_rows,
+    lint_query_response,
+    sum_rows,
+    unroll_image,
+)
+from hiscores_common.lib.snapshot.delta import BASE_ATTRIBUTE, apply_delta, is_delta
+from hiscores_common.lib.snapshot.rollup import WATERMARK_ATTRIBUTE
+from hiscores_common.lib.table.bucketing import validate_timestamp
+from hiscores_common.lib.table.keys import RESERVED_PARTITIONS
+from hiscores_common.lib.table.tiers import ROLLUP_SENTINELS, TIERS, RollupTier
+
+logger = logging.getLogger()
+
+Rows = Dict[Tuple[str, str], dict]
+"""Rollup rows by player and sort key."""
+
+
+def is_raw_snapshot(item: dict) -> bool:
+    """Whether an item is a raw snapshot, rather than bookkeeping or a rollup.
+
+    Examples:
+    >>> is_raw_snapshot({"player": "Brec", "timestamp": "2021-12-17 20:41:59"})
+    True
+    >>> is_raw_snapshot({"player": "Brec", "timestamp": "Daily#2021-12-17"})
+    False
+
+    """
+    return item["player"] not in RESERVED_PARTITIONS and not item[
+        "timestamp"
+    ].startswith(ROLLUP_SENTINELS)
+
+
+class RollupAccumulator(object):
+    """Fold pages of raw items into partial rollup rows of some tiers.
+
+    Deltas are resolved against the last full snapshot of their player seen so
+    far, which is their base when items arrive in sort key order, and otherwise
+    against `get_base(player, timestamp)`, so only one snapshot per player is
+    held in memory however many items are added.
+
+    Examples:
+    >>> from hiscores_common.lib.table.tiers import DAILY, MONTHLY
+    >>> accumulator = RollupAccumulator([DAILY, MONTHLY])
+    >>> accumulator.add_items([
+    ...     {"player": "Brec", "timestamp": "2021-12-17 20:00:00", "skills": {"Magic": {"xp": 10}}},
+    ...     {"player": "Brec", "timestamp": "2021-12-17 20:30:00", "base": "2021-12-17 20:00:00"},
+    ...     {"player": "Brec", "timestamp": "Daily#2021-12-17", "divisor": 1},
+    ... ])
+    2
+    >>> accumulator.rows[("Brec", "Monthly#2021-12")]
+    {'skills': {'Magic': {'xp': 20}}, 'divisor': 2, 'player': 'Brec', 'timestamp': 'Monthly#2021-12', 'through': '2021-12-17 20:30:00'}
+
+    """  # noqa: E501
+
+    def __init__(
+        self,
+        tiers: Iterable[RollupTier],
+        get_base: Optional[Callable[[str, str], Optional[dict]]] = None,
+    ):
+        self.tiers = list(tiers)
+        self.get_base = get_base
+        self.rows: Rows = dict()
+        self.snapshots = 0
+        self._bases: Dict[str, dict] = dict()
+
+    def _resolve(self, item: dict) -> dict:
+        """Get the full snapshot of a raw item."""
+        validate_timestamp(item["timestamp"])
+        player_id = item["player"]
+        if not is_delta(item):
+            self._bases[player_id] = item
+            return item
+        base = self._bases.get(player_id)
+        if base is None or base["timestamp"] != item[BASE_ATTRIBUTE]:
+            key = (player_id, item[BASE_ATTRIBUTE])
+            base = self.get_base and lint_query_response(self.get_base(*key))
+            if base is None:
+                raise ValueError(f"Base snapshot {key} does not exist.")
+            self._bases[player_id] = base
+        return apply_delta(base, item)
+
+    def add_items(self, items: Iterable[dict]) -> int:
+        """Fold raw items into the rows, ignoring items that are not snapshots.
+
+        Snapshots that cannot be read, as their timestamp is malformed or their
+        base does not exist, are logged and skipped, like the aggregator does.
+
+        Returns:
+            int: Number of snapshots folded.
+
+        """
+        snapshots = []
+        for item in items:
+            if not is_raw_snapshot(item):
+                continue
+            try:
+                snapshots.append(self._resolve(lint_query_response(item)))
+            except ValueError:
+                logger.exception(
+                    f"Skipping unreadable snapshot {item['player']}:{item['timestamp']}"
+                )
+        for tier in self.tiers:
+            for key, group in group_rows(snapshots, tier.bucket_key).items():
+                folded = fold_hiscores_rows(group, key[1])
+                folded[WATERMARK_ATTRIBUTE] = max(row["timestamp"] for row in group)
+                self.rows[key] = add_rows(self.rows.get(key), folded)
+        self.snapshots += len(snapshots)
+        return len(snapshots)
+
+
+def add_rows(row: Optional[dict], other: dict) -> dict:
+    """Add a partial rollup row to another of the same bucket, if any, keeping
+    the later of their watermarks.
+
+    Examples:
+    >>> add_rows(
+    ...     {"player": "Brec", "timestamp": "Daily#2021-12-17", "xp": 1, "divisor": 1, "through": "2021-12-17 20:30:00"},
+    ...     {"player": "Brec", "timestamp": "Daily#2021-12-17", "xp": 2, "divisor": 1, "through": "2021-12-17 20:00:00"},
+    ... )
+    {'xp': 3, 'divisor': 2, 'player': 'Brec', 'timestamp': 'Daily#2021-12-17', 'through': '2021-12-17 20:30:00'}
+
+    """  # noqa: E501
+    if row is None:
+        return other
+    row, other = dict(row), dict(other)
+    watermarks = [
+        added.pop(WATERMARK_ATTRIBUTE)
+        for added in (row, other)
+        if WATERMARK_ATTRIBUTE in added
+    ]
+    row = aggregate_hiscores_rows(row, other)
+    if watermarks:
+        row[WATERMARK_ATTRIBUTE] = max(watermarks)
+    return row
+
+
+def scan_pages(table, segment: int, total_segments: int, **kwargs) -> Iterator[list]:
+    """Get the pages of items of one segment of a parallel scan of a table.
+
+    Every item of a partition is in the same segment.
+
+    """
+    kwargs = dict(kwargs, Segment=segment, TotalSegments=total_segments)
+    while True:
+        response = table.scan(**kwargs)
+        yield response["Items"]
+        if "LastEvaluatedKey" not in response:
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def read_export_file(path: str, page_size: int = 1000) -> Iterator[list]:
+    """Get pages of the items of a file of a table export in DynamoDB JSON
+    format, optionally gzipped."""
+    opener = gzip.open if path.endswith(".gz") else open
+    page = []
+    with opener(path, "rt") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            page.append(unroll_image(json.loads(line)["Item"]))
+            if len(page) >= page_size:
+                yield page
+                page = []
+    if page:
+        yield page
+
+
+def _base_getter(table) -> Optional[Callable[[str, str], Optional[dict]]]:
+    """Read the bases of deltas from a table, if any."""
+    if table is None:
+        return None
+    return lambda player_id, timestamp: table.get_item(
+        Key={"player": player_id, "timestamp": timestamp}
+    ).get("Item")
+
+
+def aggregate_scan_segment(
+    segment: int,
+    table_factory: Callable,
+    total_segments: int,
+    tiers: List[RollupTier],
+    page_size: Optional[int] = None,
+) -> Rows:
+    """Fold one segment of a parallel scan into partial rollup rows.
+
+    `table_factory` builds the table in the process that scans the segment.
+
+    """
+    table = table_factory()
+    accumulator = RollupAccumulator(tiers, get_base=_base_getter(table))
+    kwargs = dict() if page_size is None else dict(Limit=page_size)
+    for page in scan_pages(table, segment, total_segments, **kwargs):
+        accumulator.add_items(page)
+    return accumulator.rows
+
+
+def aggregate_export_file(
+    path: str, tiers: List[RollupTier], table_factory: Optional[Callable] = None
+) -> Rows:
+    """Fold one file of a table export into partial rollup rows.
+
+    The bases of deltas in earlier files are read from the table built by
+    `table_factory`, if given.
+
+    """
+    table = table_factory() if table_factory is not None else None
+    accumulator = RollupAccumulator(tiers, get_base=_base_getter(table))
+    for page in read_export_file(path):
+        accumulator.add_items(page)
+    return accumulator.rows
+
+
+def merge_rows(partials: Iterable[Rows]) -> Rows:
+    """Add together partial rows of the same buckets.
+
+    Examples:
+    >>> merge_rows([
+    ...     {("Brec", "Daily#2021-12-17"): {"player": "Brec", "timestamp": "Daily#2021-12-17", "xp": 1, "divisor": 1}},
+    ...     {("Brec", "Daily#2021-12-17"): {"player": "Brec", "timestamp": "Daily#2021-12-17", "xp": 2, "divisor": 1}},
+    ... ])
+    {('Brec', 'Daily#2021-12-17'): {'xp': 3, 'divisor': 2, 'player': 'Brec', 'timestamp': 'Daily#2021-12-17'}}
+
+    """  # noqa: E501
+    rows: Rows = dict()
+    for partial in partials:
+        for key, row in partial.items():
+            rows[key] = add_rows(rows.get(key), row)
+    return rows
+
+
+def derive_rows(rows: Rows, sources: Dict[str, RollupTier]) -> Rows:
+    """Roll up the rows of each derived tier from the rows of its source.
+
+    The last row of each player in a source tier is still open, so, as in the
+    aggregator, it is left out until a newer one exists. Each derived row
+    records the last row added to it, so the aggregator continues from there.
+
+    Args:
+        rows (dict): Rows of the source tiers, by player and sort key.
+        sources (dict): Tier each derived tier is derived from, by name, in
+            order from finest to coarsest.
+
+    Returns:
+        dict: Rows of the derived tiers, by player and sort key.
+
+    """
+    rows = dict(rows)
+    derived: Rows = dict()
+    for name, source in sources.items():
+        tier = TIERS[name]
+        by_player = defaultdict(list)
+        for (player_id, timestamp), row in rows.items():
+            if timestamp.startswith(source.sentinel):
+                by_player[player_id].append(timestamp)
+        groups = defaultdict(list)
+        for player_id, timestamps in by_player.items():
+            for timestamp in sorted(timestamps)[:-1]:
+                bucket = tier.key(source.bucket_start(timestamp))
+                groups[(player_id, bucket)].append(timestamp)
+        for (player_id, bucket), timestamps in groups.items():
+            row = sum_rows(
+                [
+                    {
+                        key: value
+                        for key, value in rows[(player_id, timestamp)].items()
+                        if key not in KEY_ATTRIBUTES + (WATERMARK_ATTRIBUTE,)
+                    }
+                    for timestamp in timestamps
+                ]
+            )
+            row.update(
+                {
+                    "player": player_id,
+                    "timestamp": bucket,
+                    WATERMARK_ATTRIBUTE: timestamps[-1],
+                }
+            )
+            derived[(player_id, bucket)] = rows[(player_id, bucket)] = row
+    return derived
+
+
+def rebuild_rows(
+    shards: Iterable,
+    aggregate_shard: Callable[..., Rows],
+    sources: Optional[Dict[str, RollupTier]] = None,
+    map_fn: Callable = map,
+) -> List[dict]:
+    """Rebuild every rollup row from shards of raw items.
+
+    Args:
+        shards (Iterable): Shards of raw items, e.g. scan segments.
+        aggregate_shard (Callable): Fold a shard into partial rollup rows.
+        sources (dict): Tier each hierarchically derived tier is derived from.
+        map_fn (Callable): `map`, or the `map` of an executor to fold shards in
+            parallel.
+
+    Returns:
+        list: Rollup rows, sorted by player and sort key.
+
+    """
+    rows = merge_rows(map_fn(aggregate_shard, shards))
+    rows.update(derive_rows(rows, sources or dict()))
+    return [rows[key] for key in sorted(rows)]
@@ -1,51 +1,52 @@
 """Utility functions for aggregator lambda."""
+from collections import defaultdict
 from decimal import Decimal
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aggregator.lib.dynamo_aggregator.engine import (
+    ROLLUP_SCHEMA,
+    SNAPSHOT_SCHEMA,
+    CompiledSchema,
+    FlatAggregator,
+    SchemaMismatch,
+    aggregate_dictlikes,
+)
+from hiscores_common.lib.snapshot.codec import (
+    PACKED_ATTRIBUTE,
+    decode_snapshot,
+    is_packed,
+    layout_leaves,
+    unpack_values,
+)
+from hiscores_common.lib.snapshot.delta import STAT_ATTRIBUTES
+from hiscores_common.lib.snapshot.rollup import merge_flat_leaves
+
+KEY_ATTRIBUTES = ("player", "timestamp")
+
+ROLLUP_AGGREGATOR = FlatAggregator(ROLLUP_SCHEMA)
+SNAPSHOT_AGGREGATOR = FlatAggregator(SNAPSHOT_SCHEMA)
+
+
+def sum_rows(rows: List[dict]) -> dict:
+    """Sum nested rows, keeping the schema of the first.
+
+    Rows of the rollup schema are summed as flat arrays. Rows of any other
+    schema, such as those written before the schema last changed, fall back to
+    `aggregate_dictlikes`, which also reports rows that do not match.
 
-
-class SchemaMismatch(ValueError):
-    """Schemas of nested dicts do not match."""
-
-
-def aggregate_dictlikes(a, b, aggregation_fn=lambda a, b: a + b, _key_path=""):
-    """Aggregate nested dict-likes, preserving schema.
-
-    Adds to a nested aggregation with values from a second dict-like containing
-    the same keys. While the second object must contain all of the keys in the
-    aggregation, it may contain additional keys. These will be ignored.
-
-    Args:
-        a (dict): First dict-like to aggregate.
-        b (dict): Second dict-like to aggregate.
-        aggregation_fn (Callable): Two-item aggregation operation.
-
-    Returns:
-        dict
+    Examples:
+    >>> sum_rows([{"xp": 1, "divisor": 1}, {"xp": 2, "divisor": 1}])
+    {'xp': 3, 'divisor': 2}
 
     """
-    result = dict()
-    for key, a_val in a.items():
-        new_key_path = _key_path + "_" + key
-        if key not in b:
-            raise SchemaMismatch(
-                f"Expected key '{new_key_path}' does not exist in object b."
-            )
-        b_val = b[key]
-        a_val_type = type(a_val)
-        b_val_type = type(b_val)
-        if a_val_type != b_val_type:
-            raise SchemaMismatch(
-                f"Key '{new_key_path}' of type '{b_val_type}' does not match "
-                f"expected type of '{a_val_type}'"
-            )
-        if isinstance(a_val, dict):
-            result[key] = aggregate_dictlikes(
-                a_val,
-                b_val,
-                aggregation_fn=aggregation_fn,
-                _key_path=new_key_path,
-            )
-        else:
-            result[key] = aggregation_fn(a_val, b_val)
+    try:
+        return ROLLUP_AGGREGATOR.aggregate(rows)
+    except SchemaMismatch:
+        pass
+    result = rows[0]
+    for row in rows[1:]:
+        result = aggregate_dictlikes(result, row)
     return result
 
 
@@ -55,12 +56,64 @@ def aggregate_hiscores_rows(sum_row, new_data):
         return new_data
     player_id = sum_row.pop("player")
     timestamp = sum_row.pop("timestamp")
-    aggregation = aggregate_dictlikes(sum_row, new_data)
+    aggregation = sum_rows([sum_row, new_data])
     aggregation["player"] = player_id
     aggregation["timestamp"] = timestamp
     return aggregation
 
 
+def fold_hiscores_rows(rows, timestamp):
+    """Sum rows into a single aggregation row keyed on `timestamp`.
+
+    The `divisor` of the result counts the rows folded into it, so that it can
+    be added to a stored aggregation like a single row would be.
+
+    Examples:
+    >>> rows = [
+    ...     {"player": "Brec", "timestamp": "2021-12-17 20:00:00", "xp": 10},
+    ...     {"player": "Brec", "timestamp": "2021-12-17 20:30:00", "xp": 20},
+    ... ]
+    >>> fold_hiscores_rows(rows, "Daily#2021-12-17")
+    {'xp': 30, 'divisor': 2, 'player': 'Brec', 'timestamp': 'Daily#2021-12-17'}
+
+    """
+    if not rows:
+        raise ValueError("Cannot fold an empty group of rows.")
+    folded = sum_rows(
+        [
+            {key: value for key, value in row.items() if key not in KEY_ATTRIBUTES}
+            for row in (dict(row, divisor=1) for row in rows)
+        ]
+    )
+    folded["player"] = rows[0]["player"]
+    folded["timestamp"] = timestamp
+    return folded
+
+
+def group_rows(
+    rows: Iterable[dict], bucket_fn: Callable[[str], str]
+) -> Dict[Tuple[str, str], List[dict]]:
+    """Group rows by player and by the bucket `bucket_fn` maps their timestamp to.
+
+    Groups, and rows within them, keep the order in which they were first seen.
+
+    Examples:
+    >>> rows = [
+    ...     {"player": "Brec", "timestamp": "2021-12-17 20:00:00"},
+    ...     {"player": "Plinius", "timestamp": "2021-12-17 20:00:00"},
+    ...     {"player": "Brec", "timestamp": "2021-12-18 20:00:00"},
+    ...     {"player": "Brec", "timestamp": "2021-12-17 21:00:00"},
+    ... ]
+    >>> {key: len(group) for key, group in group_rows(rows, lambda t: t[:10]).items()}
+    {('Brec', '2021-12-17'): 2, ('Plinius', '2021-12-17'): 1, ('Brec', '2021-12-18'): 1}
+
+    """
+    groups = defaultdict(list)
+    for row in rows:
+        groups[(row["player"], bucket_fn(row["timestamp"]))].append(row)
+    return dict(groups)
+
+
 """
 Utility functions for unrolling DDB images.
 """
@@ -78,6 +131,10 @@ def _image_str(_map):
     return str(_map["S"])
 
 
+def _image_bin(_map):
+    return _map["B"]
+
+
 """
 \\Utility functions.
 """
@@ -101,6 +158,9 @@ def parse_image(image):
 def unroll_image(image):
     """Convert DDBEvent to Item schema.
 
+    Packed snapshots (see `hiscores_common.lib.snapshot.codec`) are expanded
+    into nested `skills` and `activities` maps.
+
     Examples:
     >>> img = {
     ...     "skills": {
@@ -141,15 +201,21 @@ def unroll_image(image):
     {'hi': 'hello'}
 
     """
+    return decode_snapshot(_unroll_image(image))
+
+
+def _unroll_image(image):
     unrolled = dict()
     for k, v in image.items():
         if isinstance(v, dict):
             if "M" in v:
-                unrolled[k] = unroll_image(_image_map(v))
+                unrolled[k] = _unroll_image(_image_map(v))
             elif "S" in v:
                 unrolled[k] = _image_str(v)
             elif "N" in v:
                 unrolled[k] = _image_num(v)
+            elif "B" in v:
+                unrolled[k] = _image_bin(v)
         else:
             unrolled[k] = v
     return unrolled
@@ -187,7 +253,8 @@ def cast_nested_dict(d, original_type, new_type):
 
 
 def lint_query_response(item):
-    """Convert query response to nested dict of ints.
+    """Convert query response to nested dict of ints, expanding packed items and
+    folding in the flat leaves of atomically updated rollups.
 
     Examples:
     >>> lint_query_response(None)
@@ -226,4 +293,122 @@ def lint_query_response(item):
     if item is None:
         return item
     else:
-        return cast_nested_dict(d=item, original_type=Decimal, new_type=int)
+        return merge_flat_leaves(
+            decode_snapshot(
+                cast_nested_dict(d=item, original_type=Decimal, new_type=int)
+            )
+        )
+
+
+"""
+Flat decoding of snapshots, straight into `SNAPSHOT_SCHEMA` order.
+"""
+
+
+@lru_cache(maxsize=None)
+def _packed_order(version: int) -> Optional[List[int]]:
+    """Get the position of each leaf of `SNAPSHOT_SCHEMA` in the packed values
+    of a codec version, or None if they are already in schema order."""
+    leaves = layout_leaves(version)
+    if leaves == SNAPSHOT_SCHEMA.paths:
+        return None
+    position = {leaf: i for i, leaf in enumerate(leaves)}
+    try:
+        return [position[path] for path in SNAPSHOT_SCHEMA.paths]
+    except KeyError as e:
+        raise SchemaMismatch(f"Codec version {version} lacks leaf {e}.") from e
+
+
+def _unpack_flat(packed) -> list:
+    version, values = unpack_values(packed)
+    order = _packed_order(version)
+    return values if order is None else [values[i] for i in order]
+
+
+def image_to_flat(image: dict) -> list:
+    """Decode the stats of a full snapshot's stream image into the flat values
+    of `SNAPSHOT_SCHEMA`, without unrolling it into nested dicts.
+
+    Packed images are unpacked straight into schema order, and nested ones are
+    read leaf by leaf, ignoring any attributes outside the schema. Images that
+    lack a leaf, or hold one as anything but a number, are unrolled and
+    flattened generically instead.
+
+    Raises:
+        SchemaMismatch: if the image does not hold a full snapshot.
+
+    Examples:
+    >>> image = {
+    ...     "player": {"S": "PlayerName"},
+    ...     "skills": {"M": {"Overall": {"M": {"rnk": {"N": "1"}}}}},
+    ... }
+    >>> image_to_flat(image)
+    Traceback (most recent call last):
+    ...
+    aggregator.lib.dynamo_aggregator.engine.SchemaMismatch: Expected key '_skills_Overall_lvl' does not exist in object b.
+
+    """  # noqa: E501
+    if PACKED_ATTRIBUTE in image:
+        return _unpack_flat(_image_bin(image[PACKED_ATTRIBUTE]))
+    try:
+        return SNAPSHOT_SCHEMA.flatten_image(image)
+    except SchemaMismatch:
+        return SNAPSHOT_SCHEMA.flatten(unroll_image(image))
+
+
+def item_to_flat(item: dict, schema: CompiledSchema = SNAPSHOT_SCHEMA) -> list:
+    """Decode an item read with boto3 into the flat values of `schema`.
+
+    Items holding packed stats, or flat leaves of atomic updates, and items of
+    any other schema go through `lint_query_response` first.
+
+    Raises:
+        SchemaMismatch: if the item does not match `schema`.
+
+    Examples:
+    >>> schema = CompiledSchema([("skills", "Magic", "xp"), ("divisor",)])
+    >>> item_to_flat({"skills": {"Magic": {"xp": Decimal("5")}}, "divisor": Decimal("1")}, schema)
+    [5, 1]
+    >>> item_to_flat({"skills.Magic.xp": Decimal("5"), "divisor": Decimal("1")}, schema)
+    [5, 1]
+
+    """  # noqa: E501
+    if is_packed(item) or any("." in key for key in item):
+        return schema.flatten(lint_query_response(item))
+    try:
+        return schema.flatten_item(item)
+    except SchemaMismatch:
+        return schema.flatten(lint_query_response(item))
+
+
+def apply_flat_delta(values: Sequence[int], delta: dict) -> list:
+    """Rebuild the flat values of a full snapshot from those of its base and a
+    nested delta, by overwriting the leaves of the rows that changed.
+
+    Raises:
+        SchemaMismatch: if the delta holds a leaf outside `SNAPSHOT_SCHEMA`.
+
+    """
+    values = list(values)
+    try:
+        for group in STAT_ATTRIBUTES:
+            for row, cols in delta.get(group, {}).items():
+                for col, value in cols.items():
+                    values[SNAPSHOT_SCHEMA.index[(group, row, col)]] = value
+    except KeyError as e:
+        raise SchemaMismatch(f"Delta holds leaf {e} outside the schema.") from e
+    return values
+
+
+def fold_flat_rows(rows: Sequence[Sequence[int]]) -> list:
+    """Sum flat snapshots into the flat values of a `ROLLUP_SCHEMA` row, whose
+    divisor counts the snapshots folded.
+
+    Examples:
+    >>> rows = [[1] * len(SNAPSHOT_SCHEMA), [2] * len(SNAPSHOT_SCHEMA)]
+    >>> folded = fold_flat_rows(rows)
+    >>> folded[:3], folded[-1], len(folded) == len(ROLLUP_SCHEMA)
+    ([3, 3, 3], 2, True)
+
+    """
+    return SNAPSHOT_AGGREGATOR.reduce_flat(rows) + [len(rows)]
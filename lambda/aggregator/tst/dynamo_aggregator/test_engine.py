@@ -0,0 +1,145 @@
+from decimal import Decimal
+
+import aggregator.lib.dynamo_aggregator.engine as engine
+import pytest
+from hiscores_common.tst.snapshot.test_codec import snapshot
+
+
+def rollup_row(offset=0):
+    row = snapshot()
+    del row["player"], row["timestamp"]
+    row["skills"]["Magic"]["xp"] += offset
+    return dict(row, divisor=1)
+
+
+def test_rollup_schema_round_trip():
+    row = rollup_row()
+    flat = engine.ROLLUP_SCHEMA.flatten(row)
+    assert len(flat) == len(engine.ROLLUP_SCHEMA)
+    assert engine.ROLLUP_SCHEMA.unflatten(flat) == row
+
+
+@pytest.mark.parametrize("reducer", sorted(engine.REDUCERS))
+def test_reducers_match_dictlikes(reducer):
+    fns = dict(
+        sum=lambda a, b: a + b,
+        min=min,
+        max=max,
+        first=lambda a, b: a,
+        last=lambda a, b: b,
+    )
+    rows = [rollup_row(offset) for offset in (30, 0, 10)]
+    expected = rows[0]
+    for row in rows[1:]:
+        expected = engine.aggregate_dictlikes(expected, row, fns[reducer])
+    aggregator = engine.FlatAggregator(engine.ROLLUP_SCHEMA, reducer=reducer)
+    assert aggregator.aggregate(rows) == expected
+
+
+def test_custom_reducer():
+    reducer = engine.Reducer(lambda rows: [len(rows)] * len(rows[0]))
+    schema = engine.CompiledSchema([("a",), ("b",)])
+    aggregator = engine.FlatAggregator(schema, reducer=reducer)
+    assert aggregator.aggregate([{"a": 1, "b": 2}] * 3) == {"a": 3, "b": 3}
+
+
+@pytest.mark.parametrize(
+    "row,message",
+    [
+        ({"skills": {}}, "Expected key '_skills_Overall' does not exist"),
+        (None, "is not a dict"),
+    ],
+)
+def test_flatten_mismatch(row, message):
+    with pytest.raises(engine.SchemaMismatch, match=message):
+        engine.ROLLUP_SCHEMA.flatten(row)
+
+
+def test_flatten_mismatch_type():
+    row = rollup_row()
+    row["skills"]["Magic"]["xp"] = "13034431"
+    with pytest.raises(engine.SchemaMismatch) as e:
+        engine.ROLLUP_SCHEMA.flatten(row)
+    with pytest.raises(engine.SchemaMismatch) as expected:
+        engine.aggregate_dictlikes(rollup_row(), row)
+    assert str(e.value) == str(expected.value)
+
+
+def test_compiled_schema_interleaved_paths():
+    paths = [("a", "x"), ("b",), ("c", "p", "q"), ("a", "y"), ("c", "r", "q")]
+    schema = engine.CompiledSchema(paths)
+    row = {"a": {"x": 0, "y": 3}, "b": 1, "c": {"p": {"q": 2}, "r": {"q": 4}}}
+    assert schema.flatten(row) == [0, 1, 2, 3, 4]
+    unflattened = schema.unflatten(range(5))
+    assert unflattened == row
+    # keys keep the order in which the schema first reaches them
+    assert list(unflattened) == ["a", "b", "c"]
+    assert list(unflattened["a"]) == ["x", "y"]
+    with pytest.raises(ValueError):
+        schema.unflatten(range(4))
+
+
+def test_compiled_schema_invalid():
+    with pytest.raises(ValueError):
+        engine.CompiledSchema([])
+    with pytest.raises(ValueError):
+        engine.CompiledSchema([("a",), ("a",)])
+
+
+def test_aggregate_empty():
+    with pytest.raises(ValueError):
+        engine.FlatAggregator(engine.ROLLUP_SCHEMA).aggregate([])
+
+
+def test_aggregate_numpy():
+    pytest.importorskip("numpy")
+    rows = [rollup_row(offset) for offset in range(20)]
+    aggregator = engine.FlatAggregator(engine.ROLLUP_SCHEMA, numpy_min_rows=1)
+    pure_python = engine.FlatAggregator(engine.ROLLUP_SCHEMA, numpy_min_rows=100)
+    assert aggregator.aggregate(rows) == pure_python.aggregate(rows)
+    assert all(type(leaf) is int for leaf in aggregator.aggregate_flat(rows))
+
+
+def test_flatten_image_and_item():
+    row = rollup_row()
+    image = {
+        "skills": {
+            "M": {
+                skill: {"M": {col: {"N": str(v)} for col, v in cols.items()}}
+                for skill, cols in row["skills"].items()
+            }
+        },
+        "activities": {
+            "M": {
+                activity: {"M": {col: {"N": str(v)} for col, v in cols.items()}}
+                for activity, cols in row["activities"].items()
+            }
+        },
+        "divisor": {"N": "1"},
+        "unknown": {"S": "ignored"},
+    }
+    item = engine.ROLLUP_SCHEMA.unflatten(
+        [Decimal(v) for v in engine.ROLLUP_SCHEMA.flatten(row)]
+    )
+    expected = engine.ROLLUP_SCHEMA.flatten(row)
+    assert engine.ROLLUP_SCHEMA.flatten_image(image) == expected
+    assert engine.ROLLUP_SCHEMA.flatten_item(item) == expected
+    assert all(type(leaf) is int for leaf in engine.ROLLUP_SCHEMA.flatten_item(item))
+
+
+@pytest.mark.parametrize(
+    "image",
+    [{"a": {"S": "1"}}, {"a": {"N": "1.5"}}, {"a": {"L": []}}, {}],
+)
+def test_flatten_image_mismatch(image):
+    with pytest.raises(engine.SchemaMismatch):
+        engine.CompiledSchema([("a",)]).flatten_image(image)
+
+
+@pytest.mark.parametrize(
+    "item",
+    [{"a": Decimal("NaN")}, {"a": {"b": 1}}, {"a": "1"}, {"a": 1.0}, {"b": 1}],
+)
+def test_flatten_item_mismatch(item):
+    with pytest.raises(engine.SchemaMismatch):
+        engine.CompiledSchema([("a",)]).flatten_item(item)
@@ -0,0 +1,180 @@
+import gzip
+import json
+
+import aggregator.lib.dynamo_aggregator.rebuild as rebuild
+import pytest
+from aggregator.lib.dynamo_aggregator.util import fold_hiscores_rows
+from hiscores_common.lib.snapshot.delta import make_delta
+from hiscores_common.lib.table.tiers import TIERS, derivation_sources, parse_tiers
+from hiscores_common.tst.snapshot.test_codec import snapshot
+
+TIMESTAMPS = [
+    "2021-12-30 20:00:00",
+    "2021-12-30 20:30:00",
+    "2021-12-31 20:00:00",
+    "2022-01-01 20:00:00",
+    "2022-01-02 20:00:00",
+]
+
+
+def raw_items(player="PlayerName"):
+    items = []
+    for i, timestamp in enumerate(TIMESTAMPS):
+        item = dict(snapshot(), player=player, timestamp=timestamp)
+        item["skills"]["Magic"]["xp"] += i
+        items.append(item)
+    # store every other snapshot as a delta of the one before it
+    for i in range(1, len(items), 2):
+        items[i] = make_delta(items[i - 1], items[i])
+    return items
+
+
+def accumulate(items, tiers=("daily", "monthly")):
+    accumulator = rebuild.RollupAccumulator([TIERS[name] for name in tiers])
+    accumulator.add_items(items)
+    return accumulator.rows
+
+
+def test_accumulator_matches_fold():
+    rows = accumulate(raw_items() + [{"player": "Registry#players", "timestamp": "x"}])
+    full = [dict(snapshot(), player="PlayerName", timestamp=t) for t in TIMESTAMPS]
+    for i, item in enumerate(full):
+        item["skills"]["Magic"]["xp"] += i
+    assert rows[("PlayerName", "Monthly#2021-12")] == dict(
+        fold_hiscores_rows(full[:3], "Monthly#2021-12"), through=TIMESTAMPS[2]
+    )
+    assert rows[("PlayerName", "Daily#2021-12-30")]["divisor"] == 2
+    assert len(rows) == 6
+
+
+def test_accumulator_reads_missing_bases():
+    items = raw_items()
+    get_base = {("PlayerName", items[0]["timestamp"]): items[0]}.get
+    accumulator = rebuild.RollupAccumulator(
+        [TIERS["daily"]], get_base=lambda *key: get_base(key)
+    )
+    accumulator.add_items(items[1:2])
+    assert accumulator.snapshots == 1
+
+
+def test_accumulator_skips_unreadable_snapshots(caplog):
+    items = raw_items()
+    malformed = dict(items[2], timestamp="2021-12-31")
+    accumulator = rebuild.RollupAccumulator([TIERS["daily"]])
+    # neither delta has its base, so only the last snapshot is folded
+    assert accumulator.add_items(items[1:2] + [malformed] + items[3:]) == 1
+    assert "Skipping unreadable snapshot PlayerName:2021-12-30 20:30:00" in caplog.text
+    assert "Skipping unreadable snapshot PlayerName:2021-12-31" in caplog.text
+    assert list(accumulator.rows) == [("PlayerName", "Daily#2022-01-02")]
+
+
+def test_rebuild_rows_independent_of_sharding():
+    items = raw_items("A") + raw_items("B")
+    expected = rebuild.rebuild_rows([items], accumulate)
+    shards = [items[:4], items[4:7], items[7:]]
+    assert rebuild.rebuild_rows(shards, accumulate) == expected
+    assert expected[0]["through"] == TIMESTAMPS[1]
+    assert expected[4]["through"] == TIMESTAMPS[2]
+    assert [row["timestamp"] for row in expected[:3]] == [
+        "Daily#2021-12-30",
+        "Daily#2021-12-31",
+        "Daily#2022-01-01",
+    ]
+
+
+def test_derive_rows_leaves_last_row_open():
+    sources = derivation_sources(parse_tiers("daily,monthly,yearly"))
+    rows = accumulate(raw_items(), tiers=("daily",))
+    derived = rebuild.derive_rows(rows, sources)
+    assert sorted(derived) == [
+        ("PlayerName", "Monthly#2021-12"),
+        ("PlayerName", "Monthly#2022-01"),
+        ("PlayerName", "Yearly#2021"),
+    ]
+    december = derived[("PlayerName", "Monthly#2021-12")]
+    assert december["divisor"] == 3
+    assert december["through"] == "Daily#2021-12-31"
+    # the open day is not rolled up into its month yet
+    january = derived[("PlayerName", "Monthly#2022-01")]
+    assert (january["divisor"], january["through"]) == (1, "Daily#2022-01-01")
+    assert derived[("PlayerName", "Yearly#2021")]["divisor"] == 3
+    assert ("PlayerName", "Yearly#2022") not in derived
+
+
+def test_rebuild_rows_hierarchical_matches_direct_for_closed_buckets():
+    sources = derivation_sources(parse_tiers("daily,monthly,yearly"))
+    rows = rebuild.rebuild_rows(
+        [raw_items()], lambda items: accumulate(items, ("daily",)), sources
+    )
+    assert [row["timestamp"] for row in rows] == [
+        "Daily#2021-12-30",
+        "Daily#2021-12-31",
+        "Daily#2022-01-01",
+        "Daily#2022-01-02",
+        "Monthly#2021-12",
+        "Monthly#2022-01",
+        "Yearly#2021",
+    ]
+    assert rows[-1]["through"] == "Monthly#2021-12"
+    direct = rebuild.rebuild_rows(
+        [raw_items()], lambda items: accumulate(items, ("daily", "monthly", "yearly"))
+    )
+    assert direct[-2]["through"] == TIMESTAMPS[2]
+
+    def without_watermark(row):
+        return {key: value for key, value in row.items() if key != "through"}
+
+    assert without_watermark(rows[4]) == without_watermark(direct[4])
+    assert without_watermark(rows[-1]) == without_watermark(direct[-2])
+
+
+def test_aggregate_scan_segment(mocker):
+    items = raw_items()
+    table = mocker.Mock()
+    table.scan.side_effect = [
+        {"Items": items[:2], "LastEvaluatedKey": {"player": "PlayerName"}},
+        {"Items": items[2:]},
+    ]
+    rows = rebuild.aggregate_scan_segment(
+        1, lambda: table, 4, [TIERS["daily"]], page_size=2
+    )
+    assert rows == accumulate(items, tiers=("daily",))
+    assert table.scan.call_args_list == [
+        mocker.call(Limit=2, Segment=1, TotalSegments=4),
+        mocker.call(
+            Limit=2,
+            Segment=1,
+            TotalSegments=4,
+            ExclusiveStartKey={"player": "PlayerName"},
+        ),
+    ]
+
+
+def serialize(value):
+    if isinstance(value, dict):
+        return {"M": {key: serialize(v) for key, v in value.items()}}
+    if isinstance(value, str):
+        return {"S": value}
+    return {"N": str(value)}
+
+
+@pytest.mark.parametrize("name", ["export.json", "export.json.gz"])
+def test_aggregate_export_file(tmp_path, mocker, name):
+    items = raw_items()
+    path = str(tmp_path / name)
+    opener = gzip.open if name.endswith(".gz") else open
+    with opener(path, "wt") as f:
+        for item in items[1:]:
+            f.write(json.dumps({"Item": serialize(item)["M"]}) + "\n\n")
+    table = mocker.Mock()
+    table.get_item.return_value = {"Item": items[0]}
+    rows = rebuild.aggregate_export_file(path, [TIERS["daily"]], lambda: table)
+    expected = rebuild.RollupAccumulator(
+        [TIERS["daily"]], get_base=lambda *key: items[0]
+    )
+    expected.add_items(items[1:])
+    assert rows == expected.rows
+    table.get_item.assert_called_once_with(
+        Key={"player": "PlayerName", "timestamp": items[0]["timestamp"]}
+    )
+    assert len(list(rebuild.read_export_file(path, page_size=2))) == 2
@@ -1,5 +1,18 @@
+import base64
+from decimal import Decimal
+
 import aggregator.lib.dynamo_aggregator.util as util
+import hiscores_common.lib.snapshot.codec as codec
 import pytest
+from aggregator.lib.dynamo_aggregator.engine import (
+    ROLLUP_SCHEMA,
+    SNAPSHOT_SCHEMA,
+    SchemaMismatch,
+)
+from boto3.dynamodb.types import TypeSerializer
+from hiscores_common.lib.snapshot.codec import encode_snapshot
+from hiscores_common.lib.snapshot.delta import apply_delta, make_delta
+from hiscores_common.tst.snapshot.test_codec import snapshot
 
 
 def test_aggregate_dictlikes():
@@ -124,3 +137,137 @@ def test_aggregate_hiscores_rows():
         "player": "PlayerName",
         "timestamp": "Daily#2021-12-17",
     }
+
+
+def test_unroll_image_packed():
+    packed = encode_snapshot(snapshot())
+    image = {
+        "player": {"S": packed["player"]},
+        "timestamp": {"S": packed["timestamp"]},
+        "packed": {"B": base64.b64encode(packed["packed"]).decode()},
+    }
+    assert util.unroll_image(image) == snapshot()
+
+
+def test_lint_query_response_packed():
+    item = encode_snapshot(snapshot())
+    item["divisor"] = Decimal("1")
+    expected = dict(snapshot(), divisor=1)
+    assert util.lint_query_response(item) == expected
+
+
+def test_fold_hiscores_rows():
+    rows = [dict(snapshot(), timestamp=f"2021-12-17 2{i}:00:00") for i in range(3)]
+    rows[1]["skills"]["Magic"]["xp"] += 30
+    folded = util.fold_hiscores_rows(rows, "Daily#2021-12-17")
+    assert folded["divisor"] == 3
+    assert folded["timestamp"] == "Daily#2021-12-17"
+    assert folded["player"] == rows[0]["player"]
+    assert folded["skills"]["Magic"]["xp"] == 3 * rows[0]["skills"]["Magic"]["xp"] + 30
+    # folding a group equals adding its rows one by one
+    one_by_one = None
+    for row in rows:
+        one_by_one = util.aggregate_hiscores_rows(
+            one_by_one, dict(row, timestamp="Daily#2021-12-17", divisor=1)
+        )
+    assert folded == one_by_one
+
+
+def test_fold_hiscores_rows_empty():
+    with pytest.raises(ValueError):
+        util.fold_hiscores_rows([], "Daily#2021-12-17")
+
+
+def test_lint_query_response_flat_leaves():
+    item = {
+        "player": "PlayerName",
+        "timestamp": "Daily#2021-12-17",
+        "divisor": Decimal("2"),
+        "skills.Magic.xp": Decimal("10"),
+        "activities.Zulrah.kc": Decimal("4"),
+    }
+    assert util.lint_query_response(item) == {
+        "player": "PlayerName",
+        "timestamp": "Daily#2021-12-17",
+        "divisor": 2,
+        "skills": {"Magic": {"xp": 10}},
+        "activities": {"Zulrah": {"kc": 4}},
+    }
+
+
+def stream_image(item):
+    serializer = TypeSerializer()
+    image = {key: serializer.serialize(value) for key, value in item.items()}
+    if "packed" in image:
+        image["packed"] = {"B": base64.b64encode(item["packed"]).decode()}
+    return image
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_image_to_flat(packed):
+    item = dict(snapshot(), extra="ignored")
+    if packed:
+        item = encode_snapshot(item)
+    expected = SNAPSHOT_SCHEMA.flatten(snapshot())
+    assert util.image_to_flat(stream_image(item)) == expected
+
+
+def test_image_to_flat_reorders_packed_layouts(monkeypatch):
+    skills, activities, skill_cols, activity_cols = codec.LAYOUTS[1]
+    layout = (skills[::-1], activities, skill_cols[::-1], activity_cols)
+    monkeypatch.setitem(codec.LAYOUTS, 2, layout)
+    util._packed_order.cache_clear()
+    image = stream_image(encode_snapshot(snapshot(), version=2))
+    assert util.image_to_flat(image) == SNAPSHOT_SCHEMA.flatten(snapshot())
+
+    monkeypatch.setitem(codec.LAYOUTS, 3, (skills[1:],) + layout[1:])
+    image = stream_image(encode_snapshot(snapshot(), version=3))
+    with pytest.raises(SchemaMismatch, match="lacks leaf"):
+        util.image_to_flat(image)
+    util._packed_order.cache_clear()
+
+
+def test_image_to_flat_mismatch():
+    item = snapshot()
+    item["skills"]["Magic"]["xp"] = "13034431"
+    with pytest.raises(SchemaMismatch):
+        util.image_to_flat(stream_image(item))
+
+
+def test_item_to_flat():
+    expected = SNAPSHOT_SCHEMA.flatten(snapshot())
+    item = SNAPSHOT_SCHEMA.unflatten([Decimal(v) for v in expected])
+    assert util.item_to_flat(item) == expected
+    assert util.item_to_flat(encode_snapshot(snapshot())) == expected
+    # a leaf written atomically is added to its nested counterpart
+    item["skills.Magic.xp"] = Decimal("5")
+    expected[SNAPSHOT_SCHEMA.index[("skills", "Magic", "xp")]] += 5
+    assert util.item_to_flat(item) == expected
+    # a leaf of another type falls back to linting, which leaves it as is
+    item = SNAPSHOT_SCHEMA.unflatten([Decimal(v) for v in expected])
+    item["skills"]["Magic"]["xp"] = 1.5
+    with pytest.raises(SchemaMismatch):
+        util.item_to_flat(item)
+
+
+def test_apply_flat_delta():
+    base = snapshot()
+    new = snapshot()
+    new["timestamp"] = "2021-12-17 21:00:00"
+    new["skills"]["Magic"]["xp"] += 100
+    delta = make_delta(base, new)
+    flat = util.apply_flat_delta(SNAPSHOT_SCHEMA.flatten(base), delta)
+    assert flat == SNAPSHOT_SCHEMA.flatten(apply_delta(base, delta))
+    delta["skills"]["Sailing"] = {"xp": 1}
+    with pytest.raises(SchemaMismatch, match="outside the schema"):
+        util.apply_flat_delta(SNAPSHOT_SCHEMA.flatten(base), delta)
+
+
+def test_fold_flat_rows():
+    rows = [dict(snapshot(), timestamp=f"2021-12-17 2{i}:00:00") for i in range(3)]
+    rows[1]["skills"]["Magic"]["xp"] += 30
+    folded = util.fold_flat_rows([SNAPSHOT_SCHEMA.flatten(row) for row in rows])
+    expected = util.fold_hiscores_rows(rows, "Daily#2021-12-17")
+    assert ROLLUP_SCHEMA.unflatten(folded) == {
+        key: value for key, value in expected.items() if key not in util.KEY_ATTRIBUTES
+    }
@@ -1,47 +1,238 @@
 import json
 import logging
 import os
+import random
+import time
 
 import boto3
+from get_and_parse_hiscores.lib.dynamo_writer.buffered import BufferedBatchWriter
+from get_and_parse_hiscores.lib.dynamo_writer.dedup import FULL_MODE, IngestDeduplicator
 from get_and_parse_hiscores.lib.hiscores import rs_api
+from get_and_parse_hiscores.lib.hiscores.circuit_breaker import get_circuit_breaker
+from get_and_parse_hiscores.lib.hiscores.rate_limit import get_rate_limiter
+from hiscores_common.lib.activity.store import get_activity_store
+from hiscores_common.lib.snapshot.codec import (
+    NESTED_FORMAT,
+    PACKED_FORMAT,
+    STORAGE_FORMATS,
+    encode_snapshot,
+)
+from hiscores_common.lib.snapshot.delta import is_delta
 
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
 ddb = boto3.resource("dynamodb")
 table = ddb.Table(os.environ["HISCORES_TABLE_NAME"])
+sqs = boto3.client("sqs")
+
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "10"))
+RETRIES = int(os.environ.get("HISCORES_RETRIES", "2"))
+FLUSH_SIZE = int(os.environ.get("FLUSH_SIZE", "25"))
+FLUSH_INTERVAL = float(os.environ.get("FLUSH_INTERVAL", "5.0"))
+STORAGE_FORMAT = os.environ.get("STORAGE_FORMAT", NESTED_FORMAT)
+if STORAGE_FORMAT not in STORAGE_FORMATS:
+    raise ValueError(f"STORAGE_FORMAT must be one of {STORAGE_FORMATS}.")
+
+INGEST_MODE = os.environ.get("INGEST_MODE", FULL_MODE)
+ACTIVITY_STORE = os.environ.get("ACTIVITY_STORE", "none")
+RATE_LIMIT = float(os.environ.get("RATE_LIMIT", "10"))
+MAX_RATE_LIMIT = float(os.environ.get("MAX_RATE_LIMIT", "50"))
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+CIRCUIT_BREAKER = os.environ.get("CIRCUIT_BREAKER", "memory")
+BREAKER_THRESHOLD = int(os.environ.get("BREAKER_THRESHOLD", "5"))
+BREAKER_RESET_SECS = float(os.environ.get("BREAKER_RESET_SECS", "60"))
+MAX_DELAY_SECS = 900  # SQS maximum message delay
+# Seconds of each invocation kept for writing payloads after the HiScores calls
+WRITE_MARGIN_SECS = float(os.environ.get("WRITE_MARGIN_SECS", "5"))
+
+# Created at import so connections, request rate, breaker and player state are
+# kept across warm invocations
+session = rs_api.get_session(pool_size=MAX_WORKERS)
+rate_limiter = get_rate_limiter(
+    RATE_LIMIT_BACKEND, rate=RATE_LIMIT, max_rate=MAX_RATE_LIMIT
+)
+circuit_breaker = get_circuit_breaker(
+    CIRCUIT_BREAKER,
+    table=table,
+    failure_threshold=BREAKER_THRESHOLD,
+    reset_secs=BREAKER_RESET_SECS,
+)
+activity_store = get_activity_store(ACTIVITY_STORE, table=table)
+deduplicator = IngestDeduplicator(
+    table,
+    mode=INGEST_MODE,
+    on_change=activity_store.record_change if activity_store else None,
+)
+
+
+def parse_record(record):
+    """Parse player usernames from an SQS record.
+
+    Message bodies hold either a single `{"player": ...}` or a list of
+    `{"players": [...]}`.
+
+    """
+    try:
+        body = json.loads(record["body"])
+        players = body["players"] if "players" in body else [body["player"]]
+        return [player.replace("-", " ") for player in players]
+    except (KeyError, TypeError, AttributeError, json.JSONDecodeError):
+        raise ValueError(f"Record did not contain player names: {record}")
+
+
+def to_storage_format(payload):
+    """Encode a payload in the configured `STORAGE_FORMAT`."""
+    if STORAGE_FORMAT == PACKED_FORMAT and not is_delta(payload):
+        try:
+            return encode_snapshot(payload)
+        except ValueError:
+            logger.warning(
+                f"Could not pack payload for '{payload['player']}'; "
+                f"storing it as a nested map instead.",
+                exc_info=True,
+            )
+    return payload
+
+
+def requeue(players):
+    """Send players back to the GetAndParse queue, delayed until the circuit
+    breaker lets calls through again.
+
+    Returns whether the players were requeued.
+
+    """
+    if "GET_AND_PARSE_QUEUE_URL" not in os.environ:
+        return False
+    # jitter spreads requeued players over the reset window
+    delay = circuit_breaker.retry_after() + random.uniform(0, BREAKER_RESET_SECS)
+    try:
+        sqs.send_message(
+            QueueUrl=os.environ["GET_AND_PARSE_QUEUE_URL"],
+            MessageBody=json.dumps(
+                {"players": [player.replace(" ", "-") for player in players]}
+            ),
+            DelaySeconds=min(MAX_DELAY_SECS, int(delay)),
+        )
+    except Exception:
+        logger.exception(f"Failed to requeue {players}")
+        return False
+    logger.info(f"Requeued {players} with a delay of {int(delay)}s")
+    return True
 
 
 def handler(event, context):
-    """Call HiScores API, parse response, and save to Dynamo table."""
+    """Call HiScores API, parse responses, and save to Dynamo table.
 
-    # retrieve player username
+    Every record in the batch is processed concurrently. Players that could not
+    be processed, including those not fetched before `WRITE_MARGIN_SECS` ahead
+    of the timeout, are requeued on their own, so that the players of the same
+    message that were written are not fetched and written again. Only records
+    whose players could not be requeued are reported as partial batch failures.
+    Records without player names are logged and dropped, as no retry would
+    parse them.
+
+    """
     logger.debug(f"Received event: {event}")
-    records = event["Records"]
     try:
-        players = [json.loads(record["body"])["player"] for record in records]
-        player = players[0]
-    except (KeyError, IndexError):
-        raise ValueError(f"Event did not contain player names: {event}")
-    if len(players) > 1:
-        logger.warn(
-            f"Received records for multiple players: {players}. "
-            f"Only the first player, '{player}', will be processed."
-        )
-    player = player.replace("-", " ")
+        records = event["Records"]
+    except KeyError:
+        raise ValueError(f"Event did not contain records: {event}")
 
-    # retrieve HiScores for `player`
-    logger.info(f"Getting HiScores for {player}")
-    payload = rs_api.process_hiscores_response(
-        rs_api.request_hiscores(player=player, timeout=45.0)
+    failures = set()
+    players = list()
+    for record in records:
+        try:
+            players.extend(
+                (record["messageId"], player) for player in parse_record(record)
+            )
+        except ValueError:
+            logger.exception(f"Dropping record {record.get('messageId')}")
+
+    # retrieve HiScores for all players concurrently, stopping in time to write
+    # the payloads and requeue the players left over
+    deadline = (
+        time.monotonic()
+        + context.get_remaining_time_in_millis() / 1000
+        - WRITE_MARGIN_SECS
+    )
+    logger.info(f"Getting HiScores for {[player for _, player in players]}")
+    responses = rs_api.iter_hiscores_batch(
+        [player for _, player in players],
+        max_workers=MAX_WORKERS,
+        timeout=15.0,
+        retries=RETRIES,
+        deadline=deadline,
+        session=session,
+        rate_limiter=rate_limiter,
+        circuit_breaker=circuit_breaker,
     )
 
-    # write result to `table`
-    logger.info(
-        f"Putting payload for player '{payload['player']}', "
-        f"timestamp '{payload['timestamp']}'"
+    # buffer results as they come in and write them to `table` in batches,
+    # setting aside the players to requeue
+    writer = BufferedBatchWriter(
+        table,
+        flush_size=FLUSH_SIZE,
+        flush_interval=FLUSH_INTERVAL,
+        overwrite_by_pkeys=("player", "timestamp"),
     )
-    logger.debug(f"Putting payload {payload}")
-    table.put_item(Item=payload)
+    retry = []
+    pending = dict()
+    unprocessed = []
+    for i, response in responses:
+        message_id, player = players[i]
+        try:
+            if isinstance(response, Exception):
+                raise response
+            payload = rs_api.process_hiscores_response(response)
+        except rs_api.CircuitOpenError:
+            retry.append((message_id, player))
+            continue
+        except rs_api.DeadlineExceededError:
+            logger.warning(f"Ran out of time to get HiScores for '{player}'")
+            retry.append((message_id, player))
+            continue
+        except Exception:
+            logger.exception(f"Failed to get and parse HiScores for '{player}'")
+            retry.append((message_id, player))
+            continue
 
-    return payload
+        item = deduplicator.filter(payload)
+        if item is None:
+            continue
+
+        logger.info(
+            f"Buffering payload for player '{item['player']}', "
+            f"timestamp '{item['timestamp']}'"
+        )
+        logger.debug(f"Buffering payload {item}")
+        # a player queued twice may get the same key; the writer keeps the last
+        pending.setdefault((item["player"], item["timestamp"]), []).append(message_id)
+        unprocessed.extend(writer.put_item(to_storage_format(item)))
+    unprocessed.extend(writer.flush())
+
+    failed = set()
+    for item in unprocessed:
+        logger.error(f"Failed to write payload for player '{item['player']}'")
+        failed.add(item["player"])
+        retry.extend(
+            (message_id, item["player"])
+            for message_id in pending[(item["player"], item["timestamp"])]
+        )
+    written = set(pending).difference(
+        (item["player"], item["timestamp"]) for item in unprocessed
+    )
+    logger.info(f"Wrote {len(written)} payloads in {writer.api_calls} batches.")
+    for player, _ in pending:
+        if player in failed:
+            deduplicator.forget(player)
+        else:
+            deduplicator.commit(player)
+
+    # a message is only retried in full if its failed players were not requeued
+    if retry and not requeue(sorted({player for _, player in retry})):
+        failures.update(message_id for message_id, _ in retry)
+
+    logger.info(f"Circuit breaker metrics: {json.dumps(circuit_breaker.metrics())}")
+
+    return {"batchItemFailures": [{"itemIdentifier": _id} for _id in sorted(failures)]}
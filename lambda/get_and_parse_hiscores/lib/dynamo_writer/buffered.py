@@ -0,0 +1,162 @@
+"""Buffered DynamoDB writes through BatchWriteItem."""
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Sequence
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+logger = logging.getLogger()
+
+MAX_BATCH_SIZE = 25
+"""BatchWriteItem accepts at most 25 put requests per call."""
+
+RETRYABLE_ERRORS = frozenset(
+    [
+        "ProvisionedThroughputExceededException",
+        "ThrottlingException",
+        "RequestLimitExceeded",
+        "InternalServerError",
+        "ServiceUnavailable",
+    ]
+)
+"""Error codes of batches that may succeed if sent again."""
+
+
+class BufferedBatchWriter(object):
+    """Buffer items and flush them to a table with BatchWriteItem.
+
+    Items are flushed once `flush_size` items are buffered, or on the next
+    `put_item` after `flush_interval` seconds have passed since the oldest
+    buffered item. Unprocessed items returned by DynamoDB, and batches rejected
+    with one of the `RETRYABLE_ERRORS`, are retried with jittered exponential
+    backoff up to `max_retries` times; whatever is still unprocessed after that,
+    or was in a batch DynamoDB rejected otherwise or that could not be sent, is
+    returned to the caller.
+
+    BatchWriteItem rejects batches holding the same key twice, so given
+    `overwrite_by_pkeys`, an item replaces any buffered item with the same
+    values of those attributes: the last item put wins.
+
+    Examples:
+    >>> from unittest import mock
+    >>> table = mock.Mock()
+    >>> table.name = "HiScores"
+    >>> table.meta.client.batch_write_item.return_value = {"UnprocessedItems": {}}
+    >>> with BufferedBatchWriter(table, flush_size=2) as writer:
+    ...     for i in range(3):
+    ...         _ = writer.put_item({"player": "PlayerName", "timestamp": str(i)})
+    >>> table.meta.client.batch_write_item.call_count
+    2
+
+    """
+
+    def __init__(
+        self,
+        table,
+        flush_size: int = MAX_BATCH_SIZE,
+        flush_interval: Optional[float] = None,
+        max_retries: int = 5,
+        backoff: float = 0.05,
+        clock: Callable[[], float] = time.monotonic,
+        overwrite_by_pkeys: Optional[Sequence[str]] = None,
+    ):
+        if flush_size < 1:
+            raise ValueError(f"flush_size must be positive, got {flush_size}.")
+        self._table = table
+        self._client = table.meta.client
+        self._flush_size = flush_size
+        self._flush_interval = flush_interval
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._clock = clock
+        self._pkeys = overwrite_by_pkeys
+        # keyed by the values of `overwrite_by_pkeys`, else by insertion order
+        self._buffer: Dict[Hashable, dict] = {}
+        self._buffered_since: Optional[float] = None
+        self._lock = threading.Lock()
+        self.api_calls = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        unprocessed = self.flush()
+        if unprocessed:
+            logger.error(f"Failed to write {len(unprocessed)} items on exit.")
+
+    def _due(self) -> bool:
+        """Whether the buffer should be flushed."""
+        if len(self._buffer) >= self._flush_size:
+            return True
+        return (
+            self._flush_interval is not None
+            and self._buffered_since is not None
+            and self._clock() - self._buffered_since >= self._flush_interval
+        )
+
+    def put_item(self, item: dict) -> List[dict]:
+        """Buffer an item, flushing if due. Returns any items that failed."""
+        with self._lock:
+            if not self._buffer:
+                self._buffered_since = self._clock()
+            self._add(item)
+            if not self._due():
+                return []
+            items, self._buffer = list(self._buffer.values()), {}
+            self._buffered_since = None
+        return self._write(items)
+
+    def _add(self, item: dict):
+        """Append an item to the buffer, replacing any with the same key."""
+        if self._pkeys is None:
+            self._buffer[len(self._buffer)] = item
+            return
+        key = tuple(item[name] for name in self._pkeys)
+        if key in self._buffer:
+            logger.debug(f"Overwriting buffered item with key {key}.")
+        self._buffer[key] = item
+
+    def flush(self) -> List[dict]:
+        """Write all buffered items. Returns any items that failed."""
+        with self._lock:
+            items, self._buffer = list(self._buffer.values()), {}
+            self._buffered_since = None
+        return self._write(items)
+
+    def _write(self, items: List[dict]) -> List[dict]:
+        """Write items in chunks of at most `MAX_BATCH_SIZE`."""
+        unprocessed = []
+        for i in range(0, len(items), MAX_BATCH_SIZE):
+            unprocessed.extend(self._write_batch(items[i : i + MAX_BATCH_SIZE]))
+        return unprocessed
+
+    def _write_batch(self, items: List[dict]) -> List[dict]:
+        """Write a single batch, retrying unprocessed items and throttled calls."""
+        requests = [{"PutRequest": {"Item": item}} for item in items]
+        for attempt in range(self._max_retries + 1):
+            if attempt:
+                time.sleep(random.uniform(0, self._backoff * 2**attempt))
+            logger.debug(f"Writing batch of {len(requests)} items.")
+            try:
+                response = self._client.batch_write_item(
+                    RequestItems={self._table.name: requests}
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in RETRYABLE_ERRORS:
+                    logger.exception(f"Failed to write batch of {len(requests)} items.")
+                    break
+                logger.warning(f"Batch of {len(requests)} items throttled, retrying.")
+                continue
+            except BotoCoreError:
+                # raised once botocore gave up retrying, e.g. on connection errors
+                logger.exception(f"Failed to write batch of {len(requests)} items.")
+                break
+            finally:
+                self.api_calls += 1
+            requests = response.get("UnprocessedItems", {}).get(self._table.name, [])
+            if not requests:
+                return []
+            logger.warning(f"{len(requests)} items unprocessed, retrying.")
+        return [request["PutRequest"]["Item"] for request in requests]
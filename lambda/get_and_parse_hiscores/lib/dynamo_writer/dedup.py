@@ -0,0 +1,151 @@
+"""Skip or delta-encode snapshots that have not changed since the last write."""
+import logging
+from typing import Callable, Dict, NamedTuple, Optional, Set
+
+from boto3.dynamodb.conditions import Key
+from hiscores_common.lib.snapshot.codec import decode_snapshot
+from hiscores_common.lib.snapshot.delta import (
+    BASE_ATTRIBUTE,
+    apply_delta,
+    count_rows,
+    fingerprint,
+    is_delta,
+    make_delta,
+)
+
+logger = logging.getLogger()
+
+FULL_MODE = "full"
+SKIP_MODE = "skip"
+DELTA_MODE = "delta"
+INGEST_MODES = (FULL_MODE, SKIP_MODE, DELTA_MODE)
+
+# Raw snapshot timestamps sort below the `Daily#`/`Monthly#` sentinels.
+MAX_RAW_TIMESTAMP = "9999-12-31 23:59:59"
+
+
+class PlayerState(NamedTuple):
+    """Last stored state of a player."""
+
+    base: Optional[dict]
+    """Most recent full snapshot, which new deltas reference."""
+    fingerprint: Optional[str]
+    """Fingerprint of the most recent snapshot, full or delta."""
+
+
+class IngestDeduplicator(object):
+    """Compare snapshots against each player's last stored state.
+
+    In `SKIP_MODE`, unchanged snapshots are dropped. In `DELTA_MODE`, unchanged
+    snapshots become no-change markers and changed snapshots store only their
+    changed rows, until more than `rebase_fraction` of the rows differ from the
+    base, at which point a new full snapshot is written. `FULL_MODE` writes
+    every snapshot as-is.
+
+    The last state of each player is cached across warm invocations; on a cache
+    miss it is read back from the player's most recent raw item. The state a
+    filtered snapshot leads to is only staged until its item is written, then
+    `commit` caches it, or `forget` drops it if the write failed.
+
+    If `on_change` is given, it is called with the player's name on `commit`
+    whenever the written snapshot differed from the last stored one, in every
+    mode.
+
+    """
+
+    def __init__(
+        self,
+        table,
+        mode: str = FULL_MODE,
+        rebase_fraction: float = 0.5,
+        on_change: Optional[Callable[[str], None]] = None,
+    ):
+        if mode not in INGEST_MODES:
+            raise ValueError(f"Ingest mode must be one of {INGEST_MODES}.")
+        self._table = table
+        self.mode = mode
+        self.rebase_fraction = rebase_fraction
+        self.on_change = on_change
+        self._states: Dict[str, PlayerState] = dict()
+        self._staged: Dict[str, PlayerState] = dict()
+        self._changed: Set[str] = set()
+
+    def _load_state(self, player: str) -> PlayerState:
+        """Read a player's last stored state from the table."""
+        response = self._table.query(
+            KeyConditionExpression=Key("player").eq(player)
+            & Key("timestamp").lte(MAX_RAW_TIMESTAMP),
+            ScanIndexForward=False,
+            Limit=1,
+        )
+        if not response["Items"]:
+            return PlayerState(base=None, fingerprint=None)
+        latest = decode_snapshot(response["Items"][0])
+        if not is_delta(latest):
+            return PlayerState(base=latest, fingerprint=fingerprint(latest))
+
+        key = {"player": player, "timestamp": latest[BASE_ATTRIBUTE]}
+        base = self._table.get_item(Key=key).get("Item")
+        if base is None:
+            logger.warning(f"Base snapshot {key} is missing; writing a full snapshot.")
+            return PlayerState(base=None, fingerprint=None)
+        base = decode_snapshot(base)
+        return PlayerState(
+            base=base, fingerprint=fingerprint(apply_delta(base, latest))
+        )
+
+    def _get_state(self, player: str) -> PlayerState:
+        if player not in self._states:
+            self._states[player] = self._load_state(player)
+        return self._states[player]
+
+    def commit(self, player: str):
+        """Cache a player's staged state, once its item has been written."""
+        if player in self._staged:
+            self._states[player] = self._staged.pop(player)
+        if player in self._changed:
+            self._changed.remove(player)
+            self.on_change(player)
+
+    def forget(self, player: str):
+        """Drop a player's cached and staged state, e.g. after a failed write."""
+        self._states.pop(player, None)
+        self._staged.pop(player, None)
+        self._changed.discard(player)
+
+    def filter(self, payload: dict) -> Optional[dict]:
+        """Get the item to write for a snapshot, or `None` to skip it, staging
+        the player's new state until `commit`."""
+        if self.mode == FULL_MODE and self.on_change is None:
+            return payload
+
+        player = payload["player"]
+        state = self._get_state(player)
+        new_fingerprint = fingerprint(payload)
+        if self.on_change is not None and new_fingerprint != state.fingerprint:
+            self._changed.add(player)
+
+        if self.mode == FULL_MODE:
+            self._staged[player] = PlayerState(payload, new_fingerprint)
+            return payload
+
+        if self.mode == SKIP_MODE:
+            if new_fingerprint == state.fingerprint:
+                logger.info(f"Skipping unchanged snapshot for '{player}'.")
+                return None
+            self._staged[player] = PlayerState(payload, new_fingerprint)
+            return payload
+
+        if state.base is not None:
+            delta = make_delta(state.base, payload)
+            if count_rows(delta) <= self.rebase_fraction * count_rows(payload):
+                logger.info(
+                    f"Writing delta of {count_rows(delta)} rows for '{player}' "
+                    f"against base '{state.base['timestamp']}'."
+                )
+                self._staged[player] = state._replace(fingerprint=new_fingerprint)
+                return delta
+
+        logger.info(f"Writing full snapshot for '{player}' as new base.")
+        self._staged[player] = PlayerState(payload, new_fingerprint)
+        return payload
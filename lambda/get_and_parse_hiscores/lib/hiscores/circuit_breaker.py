@@ -0,0 +1,366 @@
+"""Circuit breaker that fails fast while the HiScores API is down."""
+import abc
+import logging
+import sqlite3
+import threading
+import time
+from decimal import Decimal
+from typing import Callable, NamedTuple, Optional, Tuple, TypeVar
+
+from botocore.exceptions import ClientError
+from hiscores_common.lib.table.keys import BREAKER_PARTITION
+
+logger = logging.getLogger()
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+T = TypeVar("T")
+
+
+class BreakerState(NamedTuple):
+    """Shared state of a circuit breaker, with times in epoch seconds."""
+
+    failures: int = 0
+    """Consecutive failures since the last success."""
+    opened_at: Optional[float] = None
+    """When the breaker last opened, or `None` while it is closed."""
+    probe_until: Optional[float] = None
+    """When the probe in flight times out, or `None` if there is none."""
+    trips: int = 0
+    """Number of times the breaker has opened."""
+
+
+class BreakerBackend(abc.ABC):
+    """Storage for a `BreakerState` shared by concurrent workers."""
+
+    @abc.abstractmethod
+    def load(self) -> BreakerState:
+        """Get the current state; it may be slightly out of date."""
+
+    @abc.abstractmethod
+    def transact(self, update: Callable[[BreakerState], Tuple[BreakerState, T]]) -> T:
+        """Atomically replace the state `s` with `update(s)[0]`.
+
+        Returns `update(s)[1]`. `update` may be called more than once.
+
+        """
+
+
+class InProcessBreakerBackend(BreakerBackend):
+    """State shared by the threads of one process."""
+
+    def __init__(self):
+        self._state = BreakerState()
+        self._lock = threading.Lock()
+
+    def load(self) -> BreakerState:
+        return self._state
+
+    def transact(self, update: Callable[[BreakerState], Tuple[BreakerState, T]]) -> T:
+        with self._lock:
+            self._state, result = update(self._state)
+            return result
+
+
+class SQLiteBreakerBackend(BreakerBackend):
+    """State shared by every process using the same SQLite database file.
+
+    A local stand-in for a distributed store; each transaction is a write
+    transaction, so processes never interleave their updates.
+
+    """
+
+    def __init__(self, path: str, name: str = "hiscores"):
+        self.name = name
+        self._conn = sqlite3.connect(
+            path, timeout=30.0, isolation_level=None, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS breakers (name TEXT PRIMARY KEY, "
+            "failures INTEGER, opened_at REAL, probe_until REAL, trips INTEGER)"
+        )
+        self._conn.execute(
+            "INSERT OR IGNORE INTO breakers VALUES (?, ?, ?, ?, ?)",
+            (name, *BreakerState()),
+        )
+
+    def _select(self) -> BreakerState:
+        return BreakerState(
+            *self._conn.execute(
+                "SELECT failures, opened_at, probe_until, trips FROM breakers "
+                "WHERE name = ?",
+                (self.name,),
+            ).fetchone()
+        )
+
+    def load(self) -> BreakerState:
+        with self._lock:
+            return self._select()
+
+    def transact(self, update: Callable[[BreakerState], Tuple[BreakerState, T]]) -> T:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                state, result = update(self._select())
+                self._conn.execute(
+                    "UPDATE breakers SET failures = ?, opened_at = ?, "
+                    "probe_until = ?, trips = ? WHERE name = ?",
+                    (*state, self.name),
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+
+class DynamoBreakerBackend(BreakerBackend):
+    """State shared by every worker through an item of the HiScores table.
+
+    Updates use optimistic concurrency on a version attribute and are skipped
+    when they do not change the state, so a healthy API costs one read per
+    `cache_secs` rather than a write per request.
+
+    """
+
+    def __init__(
+        self,
+        table,
+        name: str = "hiscores",
+        cache_secs: float = 1.0,
+        max_retries: int = 10,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._table = table
+        self.key = {"player": BREAKER_PARTITION, "timestamp": name}
+        self.cache_secs = cache_secs
+        self.max_retries = max_retries
+        self._clock = clock
+        self._cached: Optional[Tuple[float, BreakerState]] = None
+
+    def _read(self) -> Tuple[int, BreakerState]:
+        item = self._table.get_item(Key=self.key, ConsistentRead=True).get("Item")
+        if item is None:
+            state = (0, BreakerState())
+        else:
+            state = (
+                int(item["version"]),
+                BreakerState(
+                    failures=int(item["failures"]),
+                    opened_at=_to_float(item.get("openedAt")),
+                    probe_until=_to_float(item.get("probeUntil")),
+                    trips=int(item["trips"]),
+                ),
+            )
+        self._cached = (self._clock(), state[1])
+        return state
+
+    def load(self) -> BreakerState:
+        if self._cached is None or self._clock() - self._cached[0] >= self.cache_secs:
+            return self._read()[1]
+        return self._cached[1]
+
+    def transact(self, update: Callable[[BreakerState], Tuple[BreakerState, T]]) -> T:
+        for _ in range(self.max_retries):
+            version, state = self._read()
+            new_state, result = update(state)
+            if new_state == state:
+                return result
+            try:
+                self._table.put_item(
+                    Item=dict(
+                        self.key,
+                        version=version + 1,
+                        failures=new_state.failures,
+                        openedAt=_to_decimal(new_state.opened_at),
+                        probeUntil=_to_decimal(new_state.probe_until),
+                        trips=new_state.trips,
+                    ),
+                    ConditionExpression="attribute_not_exists(version) OR version = :v",
+                    ExpressionAttributeValues={":v": version},
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+                continue
+            self._cached = (self._clock(), new_state)
+            return result
+        raise RuntimeError("Circuit breaker state is too contended to update.")
+
+
+def _to_float(value) -> Optional[float]:
+    return None if value is None else float(value)
+
+
+def _to_decimal(value) -> Optional[Decimal]:
+    return None if value is None else Decimal(str(value))
+
+
+class CircuitBreaker(object):
+    """Circuit breaker around calls to the HiScores API.
+
+    The breaker is closed while calls succeed. After `failure_threshold`
+    consecutive failures it opens, and calls are rejected without being made.
+    Once it has been open for `reset_secs` it is half-open: a single probe call
+    is let through, which closes the breaker if it succeeds and reopens it if it
+    fails. A probe that reports nothing within `probe_timeout_secs` is presumed
+    lost, and another is let through.
+
+    Examples:
+    >>> breaker = CircuitBreaker(failure_threshold=2, reset_secs=60, clock=lambda: 0)
+    >>> breaker.record_failure(); breaker.record_failure()
+    >>> breaker.state, breaker.allow()
+    ('open', False)
+    >>> breaker.retry_after()
+    60.0
+
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_secs: float = 60.0,
+        probe_timeout_secs: float = 60.0,
+        backend: Optional[BreakerBackend] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        if failure_threshold < 1:
+            raise ValueError("The failure threshold must be at least 1.")
+        self.failure_threshold = failure_threshold
+        self.reset_secs = reset_secs
+        self.probe_timeout_secs = probe_timeout_secs
+        self._backend = backend or InProcessBreakerBackend()
+        self._clock = clock
+        self._rejected = 0
+
+    def _state_of(self, state: BreakerState, now: float) -> str:
+        if state.opened_at is None:
+            return CLOSED
+        if now - state.opened_at < self.reset_secs:
+            return OPEN
+        return HALF_OPEN
+
+    @property
+    def state(self) -> str:
+        """One of `CLOSED`, `OPEN` or `HALF_OPEN`."""
+        return self._state_of(self._backend.load(), self._clock())
+
+    def allow(self) -> bool:
+        """Whether a call may be made now.
+
+        In the half-open state only one caller at a time is allowed through, and
+        its call is the probe.
+
+        """
+        now = self._clock()
+        if self._state_of(self._backend.load(), now) == CLOSED:
+            return True
+
+        def claim_probe(state: BreakerState) -> Tuple[BreakerState, bool]:
+            if self._state_of(state, now) == CLOSED:
+                return state, True
+            if self._state_of(state, now) == OPEN:
+                return state, False
+            if state.probe_until is not None and now < state.probe_until:
+                return state, False
+            return state._replace(probe_until=now + self.probe_timeout_secs), True
+
+        allowed = self._backend.transact(claim_probe)
+        if allowed:
+            logger.info("Circuit breaker is half-open; letting a probe through.")
+        else:
+            self._rejected += 1
+        return allowed
+
+    def record_success(self):
+        """Record a call that reached a healthy API, closing the breaker."""
+        state = self._backend.load()
+        if state.failures == 0 and state.opened_at is None:
+            return
+        if state.opened_at is not None:
+            logger.info("Circuit breaker closed after a successful call.")
+
+        def succeed(state: BreakerState) -> Tuple[BreakerState, None]:
+            return state._replace(failures=0, opened_at=None, probe_until=None), None
+
+        self._backend.transact(succeed)
+
+    def record_failure(self):
+        """Record a call that timed out or found the API down."""
+        now = self._clock()
+
+        def fail(state: BreakerState) -> Tuple[BreakerState, bool]:
+            failures = state.failures + 1
+            if state.opened_at is not None:
+                # a failed probe reopens the breaker
+                reopen = self._state_of(state, now) == HALF_OPEN
+                opened_at = now if reopen else state.opened_at
+                return (
+                    state._replace(
+                        failures=failures, opened_at=opened_at, probe_until=None
+                    ),
+                    False,
+                )
+            if failures >= self.failure_threshold:
+                return BreakerState(failures, now, None, state.trips + 1), True
+            return state._replace(failures=failures), False
+
+        if self._backend.transact(fail):
+            logger.warning(
+                f"Circuit breaker opened after {self.failure_threshold} consecutive "
+                f"failures; failing fast for {self.reset_secs}s."
+            )
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker lets a probe through; 0 if it is closed."""
+        state = self._backend.load()
+        if state.opened_at is None:
+            return 0.0
+        return max(0.0, float(state.opened_at + self.reset_secs - self._clock()))
+
+    def metrics(self) -> dict:
+        """Current state of the breaker, for logging and monitoring.
+
+        Examples:
+        >>> CircuitBreaker(clock=lambda: 0).metrics()["state"]
+        'closed'
+
+        """
+        state = self._backend.load()
+        return {
+            "state": self._state_of(state, self._clock()),
+            "consecutive_failures": state.failures,
+            "trips": state.trips,
+            "rejected": self._rejected,
+            "retry_after_secs": self.retry_after(),
+        }
+
+
+def get_circuit_breaker(spec: str, table=None, **kwargs) -> CircuitBreaker:
+    """Build a circuit breaker from a spec of the form `memory`, `sqlite:<path>`
+    or `dynamodb`.
+
+    Additional keyword arguments are forwarded to `CircuitBreaker`.
+
+    Examples:
+    >>> get_circuit_breaker("memory", failure_threshold=3).failure_threshold
+    3
+    >>> get_circuit_breaker("redis")
+    Traceback (most recent call last):
+    ...
+    ValueError: Unsupported circuit breaker backend 'redis'.
+
+    """
+    backend, _, arg = spec.partition(":")
+    if backend == "memory":
+        return CircuitBreaker(**kwargs)
+    if backend == "sqlite":
+        return CircuitBreaker(backend=SQLiteBreakerBackend(arg), **kwargs)
+    if backend == "dynamodb":
+        if table is None:
+            raise ValueError("The dynamodb circuit breaker requires a table.")
+        return CircuitBreaker(backend=DynamoBreakerBackend(table), **kwargs)
+    raise ValueError(f"Unsupported circuit breaker backend '{spec}'.")
@@ -0,0 +1,161 @@
+"""Single-pass parser for HiScores API responses, compiled from a schema."""
+import logging
+from array import array
+from operator import methodcaller
+from typing import List, Optional
+
+from hiscores_common.lib.snapshot.constants import (
+    HISCORE_RESPONSE_ACTIVITY_COLS,
+    HISCORES_RESPONSE_ACTIVITIES,
+    HISCORES_RESPONSE_SKILL_COLS,
+    HISCORES_RESPONSE_SKILLS,
+)
+
+logger = logging.getLogger()
+
+_count_commas = methodcaller("count", ",")
+
+
+class InvalidSchemaError(Exception):
+    """Indicates the schema for parsing an RS API response line is invalid."""
+
+
+class HiscoresParser(object):
+    """Parse HiScores responses into a flat buffer of integers.
+
+    The layout of the buffer is computed once, when the parser is built: each
+    skill occupies `len(skill_cols)` consecutive slots and each activity
+    `len(activity_cols)` slots, in response order. Parsing a response then
+    validates every line's width and converts the whole text to integers in one
+    pass, without building any intermediate dicts.
+
+    Examples:
+    >>> parser = HiscoresParser(["Overall"], ["Zulrah"], ["rnk", "lvl"], ["kc"])
+    >>> parsed = parser.parse("10,20\\n30")
+    >>> parsed.buffer
+    array('q', [10, 20, 30])
+    >>> parsed.to_dict()
+    {'skills': {'Overall': {'rnk': 10, 'lvl': 20}}, 'activities': {'Zulrah': {'kc': 30}}}
+
+    """  # noqa: E501
+
+    def __init__(
+        self,
+        skills: List[str] = HISCORES_RESPONSE_SKILLS,
+        activities: List[str] = HISCORES_RESPONSE_ACTIVITIES,
+        skill_cols: List[str] = HISCORES_RESPONSE_SKILL_COLS,
+        activity_cols: List[str] = HISCORE_RESPONSE_ACTIVITY_COLS,
+    ):
+        self.skills = list(skills)
+        self.activities = list(activities)
+        self.skill_cols = list(skill_cols)
+        self.activity_cols = list(activity_cols)
+        self.rows = self.skills + self.activities
+        self.row_index = {row: i for i, row in enumerate(self.rows)}
+
+        widths = [len(self.skill_cols)] * len(self.skills) + [
+            len(self.activity_cols)
+        ] * len(self.activities)
+        self.offsets = [0]
+        for width in widths:
+            self.offsets.append(self.offsets[-1] + width)
+        self.size = self.offsets[-1]
+        self._commas = [width - 1 for width in widths]
+
+    def new_buffer(self) -> array:
+        """Allocate a zeroed buffer large enough for one response."""
+        return array("q", bytes(8 * self.size))
+
+    def parse(self, text: str, out: Optional[array] = None) -> "ParsedHiscores":
+        """Parse response text, writing values into `out` if provided."""
+        lines = text.strip().split("\n")
+        if len(lines) != len(self.rows):
+            logger.warning(
+                "HiScores response contains unexpected number of lines. Have the set "
+                "of skills or activities returned by the HiScores API changed "
+                "recently? Check https://runescape.wiki/w/Application_programming_interface#Old_School_Hiscores."  # noqa: E501
+            )
+        n_rows = min(len(lines), len(self.rows))
+        lines = lines[:n_rows]
+
+        if list(map(_count_commas, lines)) != self._commas[:n_rows]:
+            self._raise_schema_error(lines)
+
+        if out is None:
+            out = self.new_buffer()
+        end = self.offsets[n_rows]
+        if n_rows:
+            out[:end] = array("q", map(int, ",".join(lines).split(",")))
+        return ParsedHiscores(self, out, n_rows)
+
+    def _raise_schema_error(self, lines: List[str]):
+        """Raise the same errors as the line-by-line parser for a bad line."""
+        for i, (line, commas) in enumerate(zip(lines, self._commas)):
+            if _count_commas(line) == commas:
+                continue
+            is_skill = i < len(self.skills)
+            schema = self.skill_cols if is_skill else self.activity_cols
+            error = InvalidSchemaError(
+                f"Schema '{schema}' is invalid for line '{line}': must be same length."
+            )
+            kind = "skill" if is_skill else "activity"
+            raise ValueError(
+                f"Expected {kind} line of API result is malformatted."
+            ) from error
+
+
+class ParsedHiscores(object):
+    """View over a parsed response that builds nested dicts on demand."""
+
+    def __init__(self, parser: HiscoresParser, buffer: array, n_rows: int):
+        self.parser = parser
+        self.buffer = buffer
+        self.n_rows = n_rows
+        self._skills: Optional[dict] = None
+        self._activities: Optional[dict] = None
+
+    def _row(self, index: int, cols: List[str]) -> dict:
+        start = self.parser.offsets[index]
+        return dict(zip(cols, self.buffer[start : start + len(cols)]))
+
+    def row(self, name: str) -> dict:
+        """Get a single skill or activity row by name."""
+        index = self.parser.row_index.get(name, self.n_rows)
+        if index >= self.n_rows:
+            raise KeyError(name)
+        if index < len(self.parser.skills):
+            return self._row(index, self.parser.skill_cols)
+        return self._row(index, self.parser.activity_cols)
+
+    def _build(self):
+        """Build nested dicts for every parsed row in a single pass."""
+        n_skills = min(self.n_rows, len(self.parser.skills))
+        n_activities = self.n_rows - n_skills
+        # `zip` stops on the (shorter) column list before advancing `values`,
+        # so each row consumes exactly its own slots.
+        values = iter(self.buffer.tolist())
+        skill_cols, activity_cols = self.parser.skill_cols, self.parser.activity_cols
+        self._skills = {
+            skill: dict(zip(skill_cols, values))
+            for skill in self.parser.skills[:n_skills]
+        }
+        self._activities = {
+            activity: dict(zip(activity_cols, values))
+            for activity in self.parser.activities[:n_activities]
+        }
+
+    @property
+    def skills(self) -> dict:
+        if self._skills is None:
+            self._build()
+        return self._skills
+
+    @property
+    def activities(self) -> dict:
+        if self._activities is None:
+            self._build()
+        return self._activities
+
+    def to_dict(self) -> dict:
+        """Build the nested `{"skills": ..., "activities": ...}` representation."""
+        return dict(skills=self.skills, activities=self.activities)
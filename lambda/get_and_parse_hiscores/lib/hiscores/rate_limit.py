@@ -0,0 +1,264 @@
+"""Adaptive token-bucket rate limiting for HiScores API calls."""
+import abc
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+logger = logging.getLogger()
+
+
+class TokenBucketBackend(abc.ABC):
+    """Shared state of a token bucket: its tokens and its refill rate.
+
+    Every fetcher sharing a backend draws from the same bucket, and rate
+    changes made by one fetcher apply to all of them. Both operations must be
+    atomic with respect to every other fetcher using the backend.
+
+    """
+
+    @abc.abstractmethod
+    def reserve(self, capacity: float, now: float) -> float:
+        """Refill the bucket up to `capacity` and take one token from it.
+
+        The bucket may go into debt, which reserves a token that has not been
+        refilled yet. Returns the seconds to wait before using the token.
+
+        """
+
+    @abc.abstractmethod
+    def update_rate(self, update: Callable[[float], float]) -> float:
+        """Replace the refill rate `r`, in tokens per second, with `update(r)`.
+
+        Returns the new rate.
+
+        """
+
+    @staticmethod
+    def _refill(
+        tokens: float, updated: float, rate: float, capacity: float, now: float
+    ) -> Tuple[float, float]:
+        """Take one token after refilling, returning the tokens left and the wait.
+
+        Examples:
+        >>> TokenBucketBackend._refill(0.0, 0.0, rate=2.0, capacity=5, now=1.0)
+        (1.0, 0.0)
+        >>> TokenBucketBackend._refill(0.0, 0.0, rate=2.0, capacity=5, now=0.0)
+        (-1.0, 0.5)
+
+        """
+        tokens = min(capacity, tokens + max(0.0, now - updated) * rate) - 1
+        return tokens, max(0.0, -tokens / rate)
+
+
+class InProcessBucketBackend(TokenBucketBackend):
+    """Bucket shared by the threads of one process.
+
+    Examples:
+    >>> backend = InProcessBucketBackend(rate=2.0, tokens=1.0, now=0.0)
+    >>> backend.reserve(capacity=1, now=0.0), backend.reserve(capacity=1, now=0.0)
+    (0.0, 0.5)
+
+    """
+
+    def __init__(self, rate: float, tokens: float, now: float):
+        self._rate = rate
+        self._tokens = tokens
+        self._updated = now
+        self._lock = threading.Lock()
+
+    def reserve(self, capacity: float, now: float) -> float:
+        with self._lock:
+            self._tokens, wait = self._refill(
+                self._tokens, self._updated, self._rate, capacity, now
+            )
+            self._updated = max(self._updated, now)
+            return wait
+
+    def update_rate(self, update: Callable[[float], float]) -> float:
+        with self._lock:
+            self._rate = update(self._rate)
+            return self._rate
+
+
+class SQLiteBucketBackend(TokenBucketBackend):
+    """Bucket shared by every process using the same SQLite database file.
+
+    A local stand-in for a distributed store; each operation runs in its own
+    write transaction, so processes never interleave their updates.
+
+    Examples:
+    >>> backend = SQLiteBucketBackend(":memory:", rate=2.0, tokens=1.0, now=0.0)
+    >>> backend.reserve(capacity=1, now=0.0), backend.reserve(capacity=1, now=0.0)
+    (0.0, 0.5)
+
+    """
+
+    def __init__(
+        self, path: str, rate: float, tokens: float, now: float, name: str = "hiscores"
+    ):
+        self.name = name
+        self._conn = sqlite3.connect(
+            path, timeout=30.0, isolation_level=None, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets "
+            "(name TEXT PRIMARY KEY, tokens REAL, updated REAL, rate REAL)"
+        )
+        self._conn.execute(
+            "INSERT OR IGNORE INTO buckets VALUES (?, ?, ?, ?)",
+            (name, tokens, now, rate),
+        )
+
+    def _transaction(self, update: Callable[[float, float, float], tuple]):
+        """Apply `update(tokens, updated, rate)` and store its new values."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                state = self._conn.execute(
+                    "SELECT tokens, updated, rate FROM buckets WHERE name = ?",
+                    (self.name,),
+                ).fetchone()
+                (tokens, updated, rate), result = update(*state)
+                self._conn.execute(
+                    "UPDATE buckets SET tokens = ?, updated = ?, rate = ? "
+                    "WHERE name = ?",
+                    (tokens, updated, rate, self.name),
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def reserve(self, capacity: float, now: float) -> float:
+        def update(tokens, updated, rate):
+            tokens, wait = self._refill(tokens, updated, rate, capacity, now)
+            return (tokens, max(updated, now), rate), wait
+
+        return self._transaction(update)
+
+    def update_rate(self, update: Callable[[float], float]) -> float:
+        def update_state(tokens, updated, rate):
+            rate = update(rate)
+            return (tokens, updated, rate), rate
+
+        return self._transaction(update_state)
+
+
+class RateLimiter(object):
+    """Token-bucket rate limiter that adapts its rate to the API's health.
+
+    Callers `acquire` a token before each request and report how it went with
+    `record`. The rate follows additive-increase/multiplicative-decrease: each
+    healthy response raises it by `increase` requests per second, up to
+    `max_rate`, and each slow or failed response multiplies it by `decrease`,
+    down to `min_rate`. Throughput thereby converges on the highest rate the
+    API serves without slowing down, rather than a fixed guess. Concurrent
+    requests tend to fail together, so the rate is decreased at most once per
+    `cooldown_secs`.
+
+    Examples:
+    >>> limiter = RateLimiter(rate=10.0, sleep=lambda secs: None)
+    >>> limiter.acquire()
+    0.0
+    >>> limiter.record(latency_secs=30.0, warn_secs=10)
+    5.0
+    >>> limiter.record(latency_secs=0.2, warn_secs=10)
+    5.1
+
+    """
+
+    def __init__(
+        self,
+        rate: float = 10.0,
+        capacity: Optional[float] = None,
+        min_rate: float = 1.0,
+        max_rate: float = 50.0,
+        increase: float = 0.1,
+        decrease: float = 0.5,
+        cooldown_secs: float = 1.0,
+        backend: Optional[TokenBucketBackend] = None,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        if not 0 < min_rate <= rate <= max_rate:
+            raise ValueError("Rates must satisfy 0 < min_rate <= rate <= max_rate.")
+        if not 0 < decrease < 1:
+            raise ValueError("The rate decrease factor must be between 0 and 1.")
+        self.capacity = rate if capacity is None else capacity
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown_secs = cooldown_secs
+        self._last_decrease = None
+        self._clock = clock
+        self._sleep = sleep
+        self._backend = backend or InProcessBucketBackend(
+            rate=rate, tokens=self.capacity, now=clock()
+        )
+
+    def acquire(self) -> float:
+        """Take a token, sleeping until it is available. Returns the seconds slept."""
+        wait = self._backend.reserve(self.capacity, now=self._clock())
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def record(self, latency_secs: float, warn_secs: float, ok: bool = True) -> float:
+        """Adapt the rate to a response. Returns the new rate.
+
+        A response is unhealthy if it failed (`ok=False`), e.g. it timed out, was
+        throttled or was an error page, or if it took longer than `warn_secs`.
+
+        """
+        if ok and latency_secs <= warn_secs:
+            return self._backend.update_rate(
+                lambda rate: round(min(self.max_rate, rate + self.increase), 6)
+            )
+        now = self._clock()
+        if (
+            self._last_decrease is not None
+            and now - self._last_decrease < self.cooldown_secs
+        ):
+            return self._backend.update_rate(lambda rate: rate)
+        self._last_decrease = now
+        rate = self._backend.update_rate(
+            lambda rate: max(self.min_rate, rate * self.decrease)
+        )
+        logger.warning(
+            f"Hiscores API is struggling ({latency_secs:.2f}s, ok={ok}); "
+            f"reducing request rate to {rate:.2f}/s."
+        )
+        return rate
+
+
+def get_rate_limiter(spec: str, **kwargs) -> RateLimiter:
+    """Build a rate limiter from a spec of the form `memory` or `sqlite:<path>`.
+
+    Additional keyword arguments are forwarded to `RateLimiter`.
+
+    Examples:
+    >>> get_rate_limiter("memory", rate=5.0).capacity
+    5.0
+    >>> get_rate_limiter("redis")
+    Traceback (most recent call last):
+    ...
+    ValueError: Unsupported rate limiter backend 'redis'.
+
+    """
+    backend, _, arg = spec.partition(":")
+    if backend == "memory":
+        return RateLimiter(**kwargs)
+    if backend == "sqlite":
+        rate = kwargs.get("rate", 10.0)
+        capacity = kwargs.get("capacity") or rate
+        clock = kwargs.get("clock", time.time)
+        return RateLimiter(
+            backend=SQLiteBucketBackend(arg, rate=rate, tokens=capacity, now=clock()),
+            **kwargs,
+        )
+    raise ValueError(f"Unsupported rate limiter backend '{spec}'.")
@@ -1,17 +1,21 @@
 """Module for interacting with OSRS APIs."""
 import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from typing import List
+from typing import Iterator, List, Optional, Tuple, Union
 from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPSConnection
+from urllib3.connectionpool import HTTPSConnectionPool
 
-from .constants import (
-    HISCORE_RESPONSE_ACTIVITY_COLS,
-    HISCORES_RESPONSE_ACTIVITIES,
-    HISCORES_RESPONSE_SKILL_COLS,
-    HISCORES_RESPONSE_SKILLS,
-)
+from .circuit_breaker import CircuitBreaker
+from .parser import HiscoresParser, InvalidSchemaError
+from .rate_limit import RateLimiter
 
 logger = logging.getLogger()
 
@@ -20,63 +24,132 @@ HISCORES_IRONMAN_API = (
     "https://secure.runescape.com/m=hiscore_oldschool_ironman/index_lite.ws"
 )
 
+DEFAULT_POOL_SIZE = 10
+
+PARSER = HiscoresParser()
+
 __all__ = [
     "InvalidSchemaError",
+    "HiscoresDownError",
+    "CircuitOpenError",
+    "DeadlineExceededError",
+    "CircuitBreaker",
+    "RateLimiter",
+    "get_session",
     "request_hiscores",
+    "request_hiscores_batch",
+    "iter_hiscores_batch",
     "sanitize_hiscores_stats",
     "process_hiscores_response",
 ]
 
 
-class InvalidSchemaError(Exception):
-    """Indicates the schema for parsing an RS API response line is invalid."""
-
-
 class HiscoresDownError(Exception):
     """Indicates an error connecting with the OSRS HiScores API."""
 
 
+class CircuitOpenError(HiscoresDownError):
+    """Indicates a call was not made because the circuit breaker is open."""
+
+
+class DeadlineExceededError(Exception):
+    """Indicates a call was not made, or was cut short, as its deadline passed."""
+
+
 def get_hiscores_api(player: str) -> str:
     if "iron" in player.lower():
         return HISCORES_IRONMAN_API
     return HISCORES_API
 
 
-def _parse_hiscores_response_line(line: str, schema: List[str]) -> dict:
-    """Parse a single line of a hiscores API response."""
-    split_line = line.split(",")
-    if len(schema) != len(split_line):
-        raise InvalidSchemaError(
-            f"Schema '{schema}' is invalid for line '{line}': must be same length."
+"""
+Pooled, keep-alive HTTP session shared across warm invocations.
+"""
+
+_timing = threading.local()
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    """HTTPS connection recording time spent on TCP+TLS handshakes."""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _timing.handshake_secs = getattr(_timing, "handshake_secs", 0.0) + (
+                time.perf_counter() - start
+            )
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """HTTP adapter whose HTTPS connections record handshake time."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = dict(
+            self.poolmanager.pool_classes_by_scheme,
+            https=_TimedHTTPSConnectionPool,
         )
-    return dict(zip(schema, map(int, split_line)))
 
 
-def _parse_skill_line(line: str) -> dict:
-    """Parse a CSV skill line from a hiscores response."""
-    return _parse_hiscores_response_line(line, HISCORES_RESPONSE_SKILL_COLS)
+def _create_session(pool_size: int) -> requests.Session:
+    """Create a session keeping up to `pool_size` connections alive per host."""
+    session = requests.Session()
+    adapter = _TimedHTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    return session
 
 
-def _parse_activity_line(line: str) -> dict:
-    """Parse a CSV activity line from a hiscores response."""
-    return _parse_hiscores_response_line(line, HISCORE_RESPONSE_ACTIVITY_COLS)
+def get_session(pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    """Get the module-level HTTP session, creating it on first use.
 
+    The session lives for the lifetime of the process, so connections to the
+    HiScores API are reused across warm Lambda invocations. `pool_size` only
+    takes effect when the session is created; it should be at least the number
+    of concurrent requests.
 
-def request_hiscores(
-    player: str, warn_secs: int = 10, timeout: float = 60.0, **kwargs
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _create_session(pool_size)
+        return _session
+
+
+def _request_hiscores_once(
+    session: requests.Session,
+    player: str,
+    warn_secs: int,
+    timeout: float,
+    **kwargs,
 ) -> requests.models.Response:
-    """Call hiscore_oldscool API to request stats for a given player."""
+    """Make a single request to the HiScores API."""
+    _timing.handshake_secs = 0.0
+    start = time.perf_counter()
     try:
-        response = requests.get(
+        response = session.get(
             get_hiscores_api(player=player),
             params={"player": player},
             timeout=timeout,
             **kwargs,
         )
-    except requests.exceptions.ReadTimeout as e:
+    except requests.exceptions.Timeout as e:
         raise HiscoresDownError(
             f"Timed out calling Hiscores API after {timeout} seconds."
         ) from e
+    total_secs = time.perf_counter() - start
+    response.timings = {
+        "handshake_secs": _timing.handshake_secs,
+        "transfer_secs": total_secs - _timing.handshake_secs,
+    }
+    logger.debug(f"Hiscores API timings for '{player}': {response.timings}")
 
     if response.elapsed > timedelta(seconds=warn_secs):
         logger.warning(
@@ -87,6 +160,108 @@ def request_hiscores(
     if "<!doctype html>" in response.text:
         raise HiscoresDownError(f"Hiscores API returned HTML response: {response.text}")
 
+    return response
+
+
+def _backoff_secs(attempt: int, backoff: float) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, backoff * 2**attempt)
+
+
+def request_hiscores(
+    player: str,
+    warn_secs: int = 10,
+    timeout: float = 60.0,
+    retries: int = 0,
+    backoff: float = 0.5,
+    session: Optional[requests.Session] = None,
+    rate_limiter: Optional[RateLimiter] = None,
+    circuit_breaker: Optional[CircuitBreaker] = None,
+    deadline: Optional[float] = None,
+    **kwargs,
+) -> requests.models.Response:
+    """Call hiscore_oldscool API to request stats for a given player.
+
+    Requests are made through `session`, defaulting to the shared session from
+    `get_session`. Timeouts, HTML responses and 5xx status codes are retried up to
+    `retries` times with jittered exponential backoff starting at `backoff`
+    seconds. The returned response carries a `timings` dict splitting wall time
+    into `handshake_secs` and `transfer_secs`.
+
+    If a `rate_limiter` is given, every attempt first takes a token from it and
+    then reports its latency and outcome back to it, so that the rate adapts.
+
+    If a `circuit_breaker` is given, every attempt reports to it whether the API
+    was up, and while it is open attempts fail fast with `CircuitOpenError`.
+    Timeouts, HTML responses and 5xx status codes count as the API being down.
+
+    If a `deadline` is given, as a `time.monotonic()` value, no attempt is made
+    past it and attempts are cut short at it, raising `DeadlineExceededError`.
+    Those are not reported to the rate limiter or circuit breaker.
+
+    """
+    session = session or get_session()
+    for attempt in range(retries + 1):
+        if deadline is not None and time.monotonic() >= deadline:
+            raise DeadlineExceededError(
+                f"Deadline passed; not calling Hiscores API for '{player}'."
+            )
+        if circuit_breaker is not None and not circuit_breaker.allow():
+            raise CircuitOpenError(
+                f"Circuit breaker is open; not calling Hiscores API for '{player}'."
+            )
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        attempt_timeout = timeout
+        if deadline is not None:
+            # waiting on the rate limiter may have used up the remaining time
+            attempt_timeout = min(timeout, deadline - time.monotonic())
+            if attempt_timeout <= 0:
+                raise DeadlineExceededError(
+                    f"Deadline passed; not calling Hiscores API for '{player}'."
+                )
+        start = time.perf_counter()
+        try:
+            response = _request_hiscores_once(
+                session, player, warn_secs=warn_secs, timeout=attempt_timeout, **kwargs
+            )
+        except HiscoresDownError as e:
+            if attempt_timeout < timeout and isinstance(
+                e.__cause__, requests.exceptions.Timeout
+            ):
+                raise DeadlineExceededError(
+                    f"Deadline passed calling Hiscores API for '{player}'."
+                ) from e
+            if rate_limiter is not None:
+                rate_limiter.record(time.perf_counter() - start, warn_secs, ok=False)
+            if circuit_breaker is not None:
+                circuit_breaker.record_failure()
+            if attempt == retries:
+                raise
+            logger.warning(f"Hiscores API unavailable for '{player}', retrying.")
+        else:
+            if rate_limiter is not None:
+                rate_limiter.record(
+                    time.perf_counter() - start,
+                    warn_secs,
+                    ok=response.status_code != 429 and response.status_code < 500,
+                )
+            if circuit_breaker is not None:
+                if response.status_code < 500:
+                    circuit_breaker.record_success()
+                else:
+                    circuit_breaker.record_failure()
+            if response.status_code < 500 or attempt == retries:
+                break
+            logger.warning(
+                f"Received status code {response.status_code} for '{player}', "
+                f"retrying."
+            )
+        delay = _backoff_secs(attempt, backoff)
+        if deadline is not None:
+            delay = min(delay, max(0.0, deadline - time.monotonic()))
+        time.sleep(delay)
+
     if response.status_code != 200:
         raise ValueError(
             f"Received status code {response.status_code} with reason "
@@ -95,49 +270,67 @@ def request_hiscores(
     return response
 
 
-def sanitize_hiscores_stats(text: str) -> dict:
-    """Sanitize hiscore_oldscool API result text.
+def _request_hiscores_or_error(
+    player: str, **kwargs
+) -> Union[requests.models.Response, Exception]:
+    """Call `request_hiscores`, returning rather than raising any exception."""
+    try:
+        return request_hiscores(player=player, **kwargs)
+    except Exception as e:
+        return e
 
-    API documentation:
-    https://runescape.wiki/w/Application_programming_interface#Hiscores_Lite_2
+
+def iter_hiscores_batch(
+    players: List[str], max_workers: int = 10, **kwargs
+) -> Iterator[Tuple[int, Union[requests.models.Response, Exception]]]:
+    """Request stats for several players concurrently, yielding the index in
+    `players` and the result of each request as soon as it completes.
+
+    Like `asyncio.as_completed`, results are yielded in the order they complete,
+    so they can be handled while the other requests are in flight. A failed
+    request does not interrupt the others: its exception is yielded in place of
+    its response. Additional keyword arguments, such as a `deadline`, are
+    forwarded to `request_hiscores`, so with a deadline every result is in by
+    about then: players not requested in time get a `DeadlineExceededError`.
 
     """
+    if not players:
+        return
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(players))) as executor:
+        futures = {
+            executor.submit(_request_hiscores_or_error, player, **kwargs): i
+            for i, player in enumerate(players)
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def request_hiscores_batch(
+    players: List[str], max_workers: int = 10, **kwargs
+) -> List[Union[requests.models.Response, Exception]]:
+    """Request stats for several players concurrently.
+
+    Like `asyncio.gather(..., return_exceptions=True)`, results are returned in
+    the same order as `players`, once every request completed. See
+    `iter_hiscores_batch` for how requests are made.
 
-    # split string by line
-    lines = text.strip().split("\n")
+    """
+    results: List[Union[requests.models.Response, Exception]] = [None] * len(
+        players
+    )
+    for i, result in iter_hiscores_batch(players, max_workers=max_workers, **kwargs):
+        results[i] = result
+    return results
 
-    if len(lines) != len(HISCORES_RESPONSE_SKILLS) + len(HISCORES_RESPONSE_ACTIVITIES):
-        logger.warning(
-            "HiScores response contains unexpected number of lines. Have the set of "
-            "skills or activities returned by the HiScores API changed recently? "
-            "Check https://runescape.wiki/w/Application_programming_interface#Old_School_Hiscores."  # noqa: E501
-        )
 
-    # skills are returned first
-    skill_lines = lines[: len(HISCORES_RESPONSE_SKILLS)]
-    # parse and label elements
-    try:
-        skill_dict = dict(
-            zip(HISCORES_RESPONSE_SKILLS, map(_parse_skill_line, skill_lines))
-        )
-    except InvalidSchemaError as e:
-        raise ValueError("Expected skill line of API result is malformatted.") from e
+def sanitize_hiscores_stats(text: str) -> dict:
+    """Sanitize hiscore_oldscool API result text.
 
-    # activities are returned second
-    activity_lines = lines[len(HISCORES_RESPONSE_SKILLS) :]
-    # parse and label elements
-    try:
-        activity_dict = dict(
-            zip(
-                HISCORES_RESPONSE_ACTIVITIES,
-                map(_parse_activity_line, activity_lines),
-            )
-        )
-    except InvalidSchemaError as e:
-        raise ValueError("Expected activity line of API result is malformatted.") from e
+    API documentation:
+    https://runescape.wiki/w/Application_programming_interface#Hiscores_Lite_2
 
-    # return all information
-    return dict(skills=skill_dict, activities=activity_dict)
+    """
+    return PARSER.parse(text).to_dict()
 
 
 def process_hiscores_response(response: requests.models.Response) -> dict:
@@ -0,0 +1,158 @@
+import get_and_parse_hiscores.lib.dynamo_writer.buffered as buffered
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+
+@pytest.fixture
+def table(mocker):
+    table = mocker.Mock()
+    table.name = "HiScores"
+    table.meta.client.batch_write_item.return_value = {"UnprocessedItems": {}}
+    return table
+
+
+def items(n):
+    return [{"player": "PlayerName", "timestamp": str(i)} for i in range(n)]
+
+
+def written_items(table):
+    return [
+        request["PutRequest"]["Item"]
+        for call in table.meta.client.batch_write_item.call_args_list
+        for request in call.kwargs["RequestItems"]["HiScores"]
+    ]
+
+
+def test_flush_size(table):
+    writer = buffered.BufferedBatchWriter(table, flush_size=3)
+    for item in items(7):
+        assert writer.put_item(item) == []
+    assert writer.api_calls == 2
+    assert writer.flush() == []
+    assert writer.api_calls == 3
+    assert written_items(table) == items(7)
+
+
+def test_flush_chunks_to_max_batch_size(table):
+    writer = buffered.BufferedBatchWriter(table, flush_size=100)
+    for item in items(60):
+        writer.put_item(item)
+    assert writer.api_calls == 0
+    writer.flush()
+    batch_sizes = [
+        len(call.kwargs["RequestItems"]["HiScores"])
+        for call in table.meta.client.batch_write_item.call_args_list
+    ]
+    assert batch_sizes == [25, 25, 10]
+
+
+def test_flush_interval(table):
+    now = [0.0]
+    writer = buffered.BufferedBatchWriter(
+        table, flush_interval=10.0, clock=lambda: now[0]
+    )
+    writer.put_item(items(1)[0])
+    now[0] = 5.0
+    writer.put_item(items(1)[0])
+    assert writer.api_calls == 0
+    now[0] = 10.0
+    writer.put_item(items(1)[0])
+    assert writer.api_calls == 1
+
+
+def test_flush_empty(table):
+    writer = buffered.BufferedBatchWriter(table)
+    assert writer.flush() == []
+    table.meta.client.batch_write_item.assert_not_called()
+
+
+def test_retries_unprocessed_items(table, mocker):
+    mocker.patch(f"{buffered.__name__}.time.sleep")
+    unprocessed = {"HiScores": [{"PutRequest": {"Item": items(1)[0]}}]}
+    table.meta.client.batch_write_item.side_effect = [
+        {"UnprocessedItems": unprocessed},
+        {"UnprocessedItems": {}},
+    ]
+    writer = buffered.BufferedBatchWriter(table)
+    writer.put_item(items(1)[0])
+    assert writer.flush() == []
+    assert writer.api_calls == 2
+
+
+def test_returns_unprocessed_items_after_retries(table, mocker, caplog):
+    mocker.patch(f"{buffered.__name__}.time.sleep")
+    unprocessed = {"HiScores": [{"PutRequest": {"Item": items(1)[0]}}]}
+    table.meta.client.batch_write_item.return_value = {"UnprocessedItems": unprocessed}
+    with buffered.BufferedBatchWriter(table, max_retries=2) as writer:
+        writer.put_item(items(1)[0])
+    assert writer.api_calls == 3
+    assert "Failed to write 1 items" in caplog.text
+
+
+def test_overwrite_by_pkeys(table):
+    writer = buffered.BufferedBatchWriter(
+        table, flush_size=3, overwrite_by_pkeys=("player", "timestamp")
+    )
+    first, second = items(2)
+    for item in (first, second, dict(first, xp=1), dict(second, xp=2)):
+        writer.put_item(item)
+    assert writer.api_calls == 0
+    writer.put_item(items(3)[2])
+    assert written_items(table) == [dict(first, xp=1), dict(second, xp=2), items(3)[2]]
+
+
+def test_returns_items_of_rejected_batches(table, caplog):
+    table.meta.client.batch_write_item.side_effect = [
+        ClientError({"Error": {"Code": "ValidationException"}}, "BatchWriteItem"),
+        {"UnprocessedItems": {}},
+    ]
+    writer = buffered.BufferedBatchWriter(table, flush_size=100)
+    for item in items(30):
+        writer.put_item(item)
+    assert writer.flush() == items(25)
+    assert writer.api_calls == 2
+    assert "Failed to write batch of 25 items" in caplog.text
+
+
+def test_retries_throttled_batches(table, mocker, caplog):
+    mocker.patch(f"{buffered.__name__}.time.sleep")
+    throttled = ClientError(
+        {"Error": {"Code": "ProvisionedThroughputExceededException"}},
+        "BatchWriteItem",
+    )
+    table.meta.client.batch_write_item.side_effect = [
+        throttled,
+        throttled,
+        {"UnprocessedItems": {}},
+    ]
+    writer = buffered.BufferedBatchWriter(table)
+    writer.put_item(items(1)[0])
+    assert writer.flush() == []
+    assert writer.api_calls == 3
+    assert "throttled, retrying" in caplog.text
+
+
+def test_returns_items_still_throttled_after_retries(table, mocker):
+    mocker.patch(f"{buffered.__name__}.time.sleep")
+    table.meta.client.batch_write_item.side_effect = ClientError(
+        {"Error": {"Code": "ThrottlingException"}}, "BatchWriteItem"
+    )
+    writer = buffered.BufferedBatchWriter(table, max_retries=2)
+    writer.put_item(items(1)[0])
+    assert writer.flush() == items(1)
+    assert writer.api_calls == 3
+
+
+def test_returns_items_of_unsent_batches(table):
+    table.meta.client.batch_write_item.side_effect = EndpointConnectionError(
+        endpoint_url="https://dynamodb.us-east-1.amazonaws.com"
+    )
+    writer = buffered.BufferedBatchWriter(table)
+    writer.put_item(items(1)[0])
+    assert writer.flush() == items(1)
+    assert writer.api_calls == 1
+
+
+def test_invalid_flush_size(table):
+    with pytest.raises(ValueError):
+        buffered.BufferedBatchWriter(table, flush_size=0)
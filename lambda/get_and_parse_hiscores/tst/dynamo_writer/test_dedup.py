@@ -0,0 +1,176 @@
+import copy
+
+import get_and_parse_hiscores.lib.dynamo_writer.dedup as dedup
+import pytest
+from hiscores_common.lib.snapshot.codec import encode_snapshot
+from hiscores_common.lib.snapshot.delta import BASE_ATTRIBUTE, apply_delta
+from hiscores_common.tst.snapshot.test_codec import snapshot
+
+
+def at(timestamp, item=None):
+    item = copy.deepcopy(item or snapshot())
+    item["timestamp"] = timestamp
+    return item
+
+
+def gain_xp(item, *skills):
+    for skill in skills:
+        item["skills"][skill]["xp"] += 100
+    return item
+
+
+def write(deduplicator, payload):
+    """Filter a payload and commit its state, as after a successful write."""
+    item = deduplicator.filter(payload)
+    deduplicator.commit(payload["player"])
+    return item
+
+
+@pytest.fixture
+def table(mocker):
+    table = mocker.Mock()
+    table.query.return_value = {"Items": []}
+    return table
+
+
+def test_full_mode(table):
+    deduplicator = dedup.IngestDeduplicator(table)
+    payload = at("2021-12-17 20:00:00")
+    assert write(deduplicator, payload) is payload
+    table.query.assert_not_called()
+
+
+def test_invalid_mode(table):
+    with pytest.raises(ValueError):
+        dedup.IngestDeduplicator(table, mode="sometimes")
+
+
+def test_skip_mode(table):
+    deduplicator = dedup.IngestDeduplicator(table, mode=dedup.SKIP_MODE)
+    first = at("2021-12-17 20:00:00")
+    assert write(deduplicator, first) is first
+    assert write(deduplicator, at("2021-12-17 20:30:00")) is None
+    changed = gain_xp(at("2021-12-17 21:00:00"), "Magic")
+    assert write(deduplicator, changed) is changed
+    assert write(deduplicator, gain_xp(at("2021-12-17 21:30:00"), "Magic")) is None
+    table.query.assert_called_once()
+
+
+def test_delta_mode(table):
+    deduplicator = dedup.IngestDeduplicator(table, mode=dedup.DELTA_MODE)
+    base = at("2021-12-17 20:00:00")
+    assert write(deduplicator, base) is base
+
+    marker = write(deduplicator, at("2021-12-17 20:30:00"))
+    assert marker == {
+        "player": "PlayerName",
+        "timestamp": "2021-12-17 20:30:00",
+        BASE_ATTRIBUTE: "2021-12-17 20:00:00",
+    }
+
+    changed = gain_xp(at("2021-12-17 21:00:00"), "Magic", "Overall")
+    delta = write(deduplicator, changed)
+    assert set(delta["skills"]) == {"Magic", "Overall"}
+    assert "activities" not in delta
+    assert apply_delta(base, delta) == changed
+
+
+def test_delta_mode_rebase(table):
+    deduplicator = dedup.IngestDeduplicator(
+        table, mode=dedup.DELTA_MODE, rebase_fraction=0.01
+    )
+    write(deduplicator, at("2021-12-17 20:00:00"))
+    changed = gain_xp(at("2021-12-17 21:00:00"), "Magic", "Overall", "Attack")
+    assert write(deduplicator, changed) is changed
+    marker = write(deduplicator, at("2021-12-17 21:30:00", changed))
+    assert marker[BASE_ATTRIBUTE] == "2021-12-17 21:00:00"
+
+
+def test_load_state_from_full_snapshot(table):
+    table.query.return_value = {"Items": [encode_snapshot(at("2021-12-17 20:00:00"))]}
+    deduplicator = dedup.IngestDeduplicator(table, mode=dedup.DELTA_MODE)
+    marker = write(deduplicator, at("2021-12-17 20:30:00"))
+    assert marker[BASE_ATTRIBUTE] == "2021-12-17 20:00:00"
+
+
+def test_load_state_from_delta(table):
+    base = at("2021-12-17 20:00:00")
+    latest = gain_xp(at("2021-12-17 20:30:00"), "Magic")
+    table.query.return_value = {
+        "Items": [
+            {
+                "player": "PlayerName",
+                "timestamp": latest["timestamp"],
+                BASE_ATTRIBUTE: base["timestamp"],
+                "skills": {"Magic": latest["skills"]["Magic"]},
+            }
+        ]
+    }
+    table.get_item.return_value = {"Item": base}
+
+    deduplicator = dedup.IngestDeduplicator(table, mode=dedup.SKIP_MODE)
+    assert write(deduplicator, at("2021-12-17 21:00:00", latest)) is None
+    table.get_item.assert_called_once_with(
+        Key={"player": "PlayerName", "timestamp": base["timestamp"]}
+    )
+
+
+def test_load_state_missing_base(table):
+    table.query.return_value = {
+        "Items": [
+            {
+                "player": "PlayerName",
+                "timestamp": "2021-12-17 20:30:00",
+                BASE_ATTRIBUTE: "2021-12-17 20:00:00",
+            }
+        ]
+    }
+    table.get_item.return_value = {}
+    deduplicator = dedup.IngestDeduplicator(table, mode=dedup.DELTA_MODE)
+    payload = at("2021-12-17 21:00:00")
+    assert write(deduplicator, payload) is payload
+
+
+def test_forget(table):
+    deduplicator = dedup.IngestDeduplicator(table, mode=dedup.SKIP_MODE)
+    write(deduplicator, at("2021-12-17 20:00:00"))
+    deduplicator.forget("PlayerName")
+    assert write(deduplicator, at("2021-12-17 20:30:00")) is not None
+    assert table.query.call_count == 2
+
+
+@pytest.mark.parametrize("mode", [dedup.SKIP_MODE, dedup.DELTA_MODE])
+def test_state_staged_until_commit(table, mode):
+    deduplicator = dedup.IngestDeduplicator(table, mode=mode)
+    first = at("2021-12-17 20:00:00")
+    assert deduplicator.filter(first) is first
+    # the first write has not succeeded yet, so the next snapshot is full too
+    second = at("2021-12-17 20:30:00")
+    assert deduplicator.filter(second) is second
+    deduplicator.commit("PlayerName")
+    # once committed, an unchanged snapshot is skipped or becomes a marker
+    third = at("2021-12-17 21:00:00")
+    assert write(deduplicator, third) is not third
+    table.query.assert_called_once()
+
+
+@pytest.mark.parametrize("mode", dedup.INGEST_MODES)
+def test_on_change(table, mocker, mode):
+    on_change = mocker.Mock()
+    deduplicator = dedup.IngestDeduplicator(table, mode=mode, on_change=on_change)
+    write(deduplicator, at("2021-12-17 20:00:00"))
+    write(deduplicator, at("2021-12-17 20:30:00"))
+    write(deduplicator, gain_xp(at("2021-12-17 21:00:00"), "Magic"))
+    assert on_change.call_args_list == [mocker.call("PlayerName")] * 2
+
+
+def test_on_change_after_commit(table, mocker):
+    on_change = mocker.Mock()
+    deduplicator = dedup.IngestDeduplicator(table, on_change=on_change)
+    deduplicator.filter(at("2021-12-17 20:00:00"))
+    on_change.assert_not_called()
+    deduplicator.forget("PlayerName")
+    deduplicator.commit("PlayerName")
+    on_change.assert_not_called()
+    write(deduplicator, at("2021-12-17 20:30:00"))
+    on_change.assert_called_once_with("PlayerName")
@@ -0,0 +1,194 @@
+from decimal import Decimal
+
+import get_and_parse_hiscores.lib.hiscores.circuit_breaker as circuit_breaker
+import pytest
+from botocore.exceptions import ClientError
+from hiscores_common.lib.table.keys import BREAKER_PARTITION
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def breaker_spec(request, tmp_path):
+    if request.param == "memory":
+        return "memory"
+    return f"sqlite:{tmp_path / 'breakers.db'}"
+
+
+def breaker(spec, clock, **kwargs):
+    kwargs = dict(failure_threshold=3, reset_secs=60, probe_timeout_secs=30, **kwargs)
+    return circuit_breaker.get_circuit_breaker(spec, clock=clock, **kwargs)
+
+
+def fail(breaker, times):
+    for _ in range(times):
+        breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures(breaker_spec, clock):
+    cb = breaker(breaker_spec, clock)
+    fail(cb, 2)
+    cb.record_success()
+    fail(cb, 2)
+    assert cb.state == circuit_breaker.CLOSED
+    assert cb.allow()
+    fail(cb, 1)
+    assert cb.state == circuit_breaker.OPEN
+    assert not cb.allow()
+    assert cb.metrics() == {
+        "state": "open",
+        "consecutive_failures": 3,
+        "trips": 1,
+        "rejected": 1,
+        "retry_after_secs": 60.0,
+    }
+
+
+def test_half_open_single_probe(breaker_spec, clock):
+    cb = breaker(breaker_spec, clock)
+    fail(cb, 3)
+    clock.now = 59.0
+    assert not cb.allow()
+    clock.now = 60.0
+    assert cb.state == circuit_breaker.HALF_OPEN
+    assert cb.allow()
+    assert not cb.allow()
+    # a lost probe is replaced once it times out
+    clock.now = 90.0
+    assert cb.allow()
+
+
+def test_probe_success_closes(breaker_spec, clock):
+    cb = breaker(breaker_spec, clock)
+    fail(cb, 3)
+    clock.now = 60.0
+    assert cb.allow()
+    cb.record_success()
+    assert cb.state == circuit_breaker.CLOSED
+    assert cb.retry_after() == 0.0
+    assert cb.metrics()["consecutive_failures"] == 0
+
+
+def test_probe_failure_reopens(breaker_spec, clock):
+    cb = breaker(breaker_spec, clock)
+    fail(cb, 3)
+    clock.now = 10.0
+    # late failures of calls made before opening do not extend the open state
+    fail(cb, 1)
+    assert cb.retry_after() == 50.0
+    clock.now = 60.0
+    assert cb.allow()
+    fail(cb, 1)
+    assert cb.state == circuit_breaker.OPEN
+    assert cb.retry_after() == 60.0
+    assert cb.metrics()["trips"] == 1
+
+
+def test_shared_sqlite_state(tmp_path, clock):
+    spec = f"sqlite:{tmp_path / 'breakers.db'}"
+    first, second = breaker(spec, clock), breaker(spec, clock)
+    fail(first, 3)
+    assert not second.allow()
+    clock.now = 60.0
+    assert second.allow()
+    assert not first.allow()
+
+
+def test_sqlite_transaction_rolls_back(tmp_path):
+    backend = circuit_breaker.SQLiteBreakerBackend(str(tmp_path / "breakers.db"))
+
+    def update(state):
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        backend.transact(update)
+    assert backend.load() == circuit_breaker.BreakerState()
+
+
+def test_invalid_threshold():
+    with pytest.raises(ValueError):
+        circuit_breaker.CircuitBreaker(failure_threshold=0)
+
+
+class FakeTable(object):
+    """Single-item table honouring the version condition of the backend."""
+
+    def __init__(self, conflicts=0):
+        self.item = None
+        self.conflicts = conflicts
+        self.reads = 0
+
+    def get_item(self, Key, ConsistentRead):
+        self.reads += 1
+        return {} if self.item is None else {"Item": dict(self.item)}
+
+    def put_item(self, Item, ConditionExpression, ExpressionAttributeValues):
+        if self.conflicts:
+            self.conflicts -= 1
+            error = {"Error": {"Code": "ConditionalCheckFailedException"}}
+            raise ClientError(error, "PutItem")
+        self.item = {
+            key: Decimal(str(value)) if isinstance(value, (int, float)) else value
+            for key, value in Item.items()
+        }
+
+
+def test_dynamo_backend(clock):
+    table = FakeTable(conflicts=1)
+    cb = breaker("dynamodb", clock, table=table)
+    fail(cb, 3)
+    assert table.item["player"] == BREAKER_PARTITION
+    assert table.item["version"] == 3
+    assert cb.state == circuit_breaker.OPEN
+    clock.now = 60.0
+    assert cb.allow()
+    cb.record_success()
+    assert table.item["openedAt"] is None
+    assert cb.metrics()["trips"] == 1
+
+
+def test_dynamo_backend_caches_loads():
+    table = FakeTable()
+    monotonic = FakeClock()
+    backend = circuit_breaker.DynamoBreakerBackend(table, clock=monotonic)
+    cb = circuit_breaker.CircuitBreaker(backend=backend)
+    for _ in range(10):
+        assert cb.allow()
+        cb.record_success()
+    monotonic.now = 1.0
+    assert cb.allow()
+    assert table.reads == 2
+
+
+def test_dynamo_backend_contended(clock):
+    backend = circuit_breaker.DynamoBreakerBackend(FakeTable(conflicts=20))
+    with pytest.raises(RuntimeError):
+        circuit_breaker.CircuitBreaker(backend=backend).record_failure()
+
+
+def test_dynamo_backend_raises_other_errors(mocker):
+    table = FakeTable()
+    mocker.patch.object(
+        table,
+        "put_item",
+        side_effect=ClientError({"Error": {"Code": "AccessDenied"}}, "PutItem"),
+    )
+    backend = circuit_breaker.DynamoBreakerBackend(table)
+    with pytest.raises(ClientError):
+        circuit_breaker.CircuitBreaker(backend=backend).record_failure()
+
+
+def test_dynamo_requires_table():
+    with pytest.raises(ValueError):
+        circuit_breaker.get_circuit_breaker("dynamodb")
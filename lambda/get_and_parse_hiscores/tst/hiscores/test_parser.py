@@ -0,0 +1,66 @@
+import get_and_parse_hiscores.lib.hiscores.parser as parser
+import pytest
+from get_and_parse_hiscores.tst.hiscores.test_rs_api import (
+    successful_parsed_response,
+    successful_response_text,
+)
+
+
+@pytest.fixture
+def hiscores_parser():
+    return parser.HiscoresParser()
+
+
+def test_parse_flat_buffer(hiscores_parser):
+    parsed = hiscores_parser.parse(successful_response_text())
+    assert len(parsed.buffer) == hiscores_parser.size
+    assert list(parsed.buffer) == [
+        int(value)
+        for line in successful_response_text().split("\n")
+        for value in line.split(",")
+    ]
+
+
+def test_parse_to_dict(hiscores_parser):
+    expected = successful_parsed_response("PlayerName")
+    expected.pop("player")
+    assert hiscores_parser.parse(successful_response_text()).to_dict() == expected
+
+
+def test_parse_into_preallocated_buffer(hiscores_parser):
+    buffer = hiscores_parser.new_buffer()
+    parsed = hiscores_parser.parse(successful_response_text(), out=buffer)
+    assert parsed.buffer is buffer
+    assert buffer[:3].tolist() == [417625, 1775, 51739960]
+
+
+def test_row(hiscores_parser):
+    parsed = hiscores_parser.parse(successful_response_text())
+    assert parsed.row("Overall") == {"rnk": 417625, "lvl": 1775, "xp": 51739960}
+    assert parsed.row("Zulrah") == {"rnk": 232831, "kc": 51}
+    with pytest.raises(KeyError):
+        parsed.row("Sailing")
+
+
+def test_parse_truncated_response(hiscores_parser, caplog):
+    text = "\n".join(successful_response_text().split("\n")[:25])
+    parsed = hiscores_parser.parse(text)
+    assert "unexpected number of lines" in caplog.text
+    assert parsed.activities == {"LeaguePoints": {"rnk": -1, "kc": -1}}
+    assert len(parsed.skills) == len(hiscores_parser.skills)
+    with pytest.raises(KeyError):
+        parsed.row("Zulrah")
+
+
+@pytest.mark.parametrize(
+    "old,new,kind",
+    [
+        ("417625,1775,51739960", "-1,-1", "skill"),
+        ("-1,-1", "417625,1775,51739960", "activity"),
+    ],
+)
+def test_parse_invalid_line(hiscores_parser, old, new, kind):
+    text = successful_response_text().replace(old, new)
+    with pytest.raises(ValueError, match=f"Expected {kind} line") as e:
+        hiscores_parser.parse(text)
+    assert isinstance(e.value.__cause__, parser.InvalidSchemaError)
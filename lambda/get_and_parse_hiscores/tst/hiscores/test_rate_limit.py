@@ -0,0 +1,116 @@
+import threading
+
+import get_and_parse_hiscores.lib.hiscores.rate_limit as rate_limit
+import pytest
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.now += secs
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def limiter_spec(request, tmp_path):
+    if request.param == "memory":
+        return "memory"
+    return f"sqlite:{tmp_path / 'buckets.db'}"
+
+
+def limiter(spec, clock, **kwargs):
+    return rate_limit.get_rate_limiter(
+        spec, clock=clock, sleep=clock.sleep, cooldown_secs=0.0, **kwargs
+    )
+
+
+def test_acquire_limits_rate(limiter_spec, clock):
+    rate_limiter = limiter(limiter_spec, clock, rate=5.0, capacity=2.0)
+    for _ in range(12):
+        rate_limiter.acquire()
+    # two tokens in the bucket, the other ten refill at 5 per second
+    assert clock.now == pytest.approx(2.0)
+
+
+def test_bucket_refills_up_to_capacity(limiter_spec, clock):
+    rate_limiter = limiter(limiter_spec, clock, rate=5.0, capacity=2.0)
+    clock.now = 100.0
+    assert [rate_limiter.acquire() for _ in range(3)] == [0.0, 0.0, 0.2]
+
+
+def test_record_adapts_rate(limiter_spec, clock):
+    rate_limiter = limiter(
+        limiter_spec, clock, rate=8.0, min_rate=1.0, max_rate=8.5, increase=0.25
+    )
+    assert rate_limiter.record(1.0, warn_secs=10) == 8.25
+    assert rate_limiter.record(1.0, warn_secs=10) == 8.5
+    assert rate_limiter.record(1.0, warn_secs=10) == 8.5
+    assert rate_limiter.record(11.0, warn_secs=10) == 4.25
+    assert rate_limiter.record(1.0, warn_secs=10, ok=False) == 2.125
+    assert rate_limiter.record(1.0, warn_secs=10, ok=False) == 1.0625
+    assert rate_limiter.record(1.0, warn_secs=10, ok=False) == 1.0
+
+
+def test_record_decreases_once_per_cooldown(clock):
+    rate_limiter = rate_limit.RateLimiter(rate=8.0, cooldown_secs=1.0, clock=clock)
+    assert [rate_limiter.record(30.0, warn_secs=10) for _ in range(3)] == [4.0] * 3
+    clock.now += 1.0
+    assert rate_limiter.record(30.0, warn_secs=10) == 2.0
+
+
+def test_sqlite_backend_shared(tmp_path, clock):
+    path = f"sqlite:{tmp_path / 'buckets.db'}"
+    first = limiter(path, clock, rate=4.0, capacity=1.0)
+    second = limiter(path, clock, rate=4.0, capacity=1.0)
+    assert first.acquire() == 0.0
+    assert second.acquire() == 0.25
+    second.record(30.0, warn_secs=10)
+    assert first.record(1.0, warn_secs=10) == 2.1
+
+
+def test_in_process_backend_thread_safe(clock):
+    rate_limiter = rate_limit.RateLimiter(
+        rate=10.0, capacity=1.0, clock=clock, sleep=lambda secs: None
+    )
+    waits = []
+    threads = [
+        threading.Thread(target=lambda: waits.append(rate_limiter.acquire()))
+        for _ in range(20)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # every thread reserved a distinct slot
+    assert sorted(waits) == pytest.approx([i / 10 for i in range(20)])
+
+
+def test_sqlite_transaction_rolls_back(tmp_path):
+    backend = rate_limit.SQLiteBucketBackend(
+        str(tmp_path / "buckets.db"), rate=2.0, tokens=1.0, now=0.0
+    )
+
+    def fail(rate):
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        backend.update_rate(fail)
+    assert backend.update_rate(lambda rate: rate) == 2.0
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [dict(rate=0.0, min_rate=0.0), dict(rate=100.0), dict(decrease=1.5)],
+)
+def test_invalid_parameters(kwargs):
+    with pytest.raises(ValueError):
+        rate_limit.RateLimiter(**kwargs)
@@ -1,5 +1,6 @@
 import datetime
 import inspect
+import threading
 from unittest import mock
 
 import get_and_parse_hiscores.lib.hiscores.rs_api as rs_api
@@ -271,7 +272,7 @@ def successful_parsed_response(player_name):
     ],
 )
 @mock.patch(
-    f"{rs_api.__name__}.requests.get",
+    f"{rs_api.__name__}.requests.Session.get",
     side_effect=MockRequestsGet(
         text=successful_response_text(),
         status_code=200,
@@ -317,7 +318,7 @@ def test_sanitize_hiscores_stats_invalid_activities_line():
 
 
 @mock.patch(
-    f"{rs_api.__name__}.requests.get",
+    f"{rs_api.__name__}.requests.Session.get",
     side_effect=requests.exceptions.ReadTimeout,
 )
 def test_request_hiscores_read_timeout(mock_get, player_name):
@@ -327,7 +328,7 @@ def test_request_hiscores_read_timeout(mock_get, player_name):
 
 
 @mock.patch(
-    f"{rs_api.__name__}.requests.get",
+    f"{rs_api.__name__}.requests.Session.get",
     side_effect=MockRequestsGet(
         text="<!doctype html> <body> API DOWN </body>",
         status_code=500,
@@ -342,7 +343,7 @@ def test_request_hiscores_down(mock_get, player_name):
 
 
 @mock.patch(
-    f"{rs_api.__name__}.requests.get",
+    f"{rs_api.__name__}.requests.Session.get",
     side_effect=MockRequestsGet(
         text="Resource not found",
         status_code=404,
@@ -354,3 +355,266 @@ def test_request_hiscores_error(mock_get, player_name):
     with pytest.raises(ValueError):
         rs_api.request_hiscores(player_name)
     mock_get.assert_called_once()
+
+
+def test_request_hiscores_batch(mocker):
+    players = ["ElderPlinius", "IronPlinius", "Brec"]
+    mock_get = mocker.patch(
+        f"{rs_api.__name__}.requests.Session.get",
+        side_effect=MockRequestsGet(
+            text=successful_response_text(),
+            status_code=200,
+            elapsed=1,
+            reason="OK",
+        ),
+    )
+
+    responses = rs_api.request_hiscores_batch(players, max_workers=2)
+    assert mock_get.call_count == len(players)
+    assert [
+        rs_api.process_hiscores_response(response)["player"] for response in responses
+    ] == players
+
+
+def test_request_hiscores_batch_partial_failure(mocker):
+    def mock_get(api, params, *args, **kwargs):
+        if params["player"] == "Brec":
+            raise requests.exceptions.ReadTimeout
+        return MockRequestsGet(
+            text=successful_response_text(),
+            status_code=200,
+            elapsed=1,
+            reason="OK",
+        )(api, params, *args, **kwargs)
+
+    mocker.patch(f"{rs_api.__name__}.requests.Session.get", side_effect=mock_get)
+
+    responses = rs_api.request_hiscores_batch(["ElderPlinius", "Brec", "Gooner1212"])
+    assert isinstance(responses[1], rs_api.HiscoresDownError)
+    assert isinstance(responses[0], requests.Response)
+    assert isinstance(responses[2], requests.Response)
+
+
+def test_request_hiscores_batch_empty():
+    assert rs_api.request_hiscores_batch([]) == []
+
+
+def test_iter_hiscores_batch_yields_as_completed(mocker):
+    # the first player is only answered once the second one was yielded
+    yielded = threading.Event()
+
+    def mock_request_hiscores(player, **kwargs):
+        if player == "ElderPlinius":
+            assert yielded.wait(timeout=5)
+        return player
+
+    mocker.patch(f"{rs_api.__name__}.request_hiscores", mock_request_hiscores)
+
+    results = rs_api.iter_hiscores_batch(["ElderPlinius", "Brec"])
+    assert next(results) == (1, "Brec")
+    yielded.set()
+    assert list(results) == [(0, "ElderPlinius")]
+
+
+def test_get_session_reused():
+    session = rs_api.get_session()
+    assert rs_api.get_session(pool_size=1) is session
+    adapter = session.get_adapter(rs_api.HISCORES_API)
+    assert adapter._pool_maxsize == rs_api.DEFAULT_POOL_SIZE
+    assert (
+        adapter.poolmanager.pool_classes_by_scheme["https"]
+        is rs_api._TimedHTTPSConnectionPool
+    )
+
+
+def test_timed_connection_records_handshake(mocker):
+    mocker.patch(f"{rs_api.__name__}.HTTPSConnection.connect")
+    rs_api._timing.handshake_secs = 0.0
+    rs_api._TimedHTTPSConnection("localhost").connect()
+    assert rs_api._timing.handshake_secs > 0.0
+
+
+@mock.patch(
+    f"{rs_api.__name__}.requests.Session.get",
+    side_effect=MockRequestsGet(
+        text=successful_response_text(),
+        status_code=200,
+        elapsed=1,
+        reason="OK",
+    ),
+)
+def test_request_hiscores_timings(mock_get, player_name):
+    response = rs_api.request_hiscores(player_name)
+    assert set(response.timings) == {"handshake_secs", "transfer_secs"}
+    assert response.timings["handshake_secs"] == 0.0
+
+
+def test_request_hiscores_retries_down(mocker, player_name):
+    mock_sleep = mocker.patch(f"{rs_api.__name__}.time.sleep")
+    mock_get = mocker.patch(
+        f"{rs_api.__name__}.requests.Session.get",
+        side_effect=[
+            requests.exceptions.ReadTimeout,
+            MockRequestsGet(
+                text="<!doctype html> <body> API DOWN </body>",
+                status_code=500,
+                elapsed=1,
+                reason="Internal Server Error",
+            )(rs_api.HISCORES_API, {"player": player_name}),
+            MockRequestsGet(
+                text=successful_response_text(),
+                status_code=200,
+                elapsed=1,
+                reason="OK",
+            )(rs_api.HISCORES_API, {"player": player_name}),
+        ],
+    )
+    response = rs_api.request_hiscores(player_name, retries=2, backoff=1.0)
+    assert response.status_code == 200
+    assert mock_get.call_count == 3
+    assert mock_sleep.call_count == 2
+    assert all(0 <= call.args[0] <= 2.0 for call in mock_sleep.call_args_list)
+
+
+@mock.patch(
+    f"{rs_api.__name__}.requests.Session.get",
+    side_effect=MockRequestsGet(
+        text="Service Unavailable",
+        status_code=503,
+        elapsed=1,
+        reason="Service Unavailable",
+    ),
+)
+def test_request_hiscores_retries_exhausted(mock_get, mocker, player_name):
+    mocker.patch(f"{rs_api.__name__}.time.sleep")
+    with pytest.raises(ValueError):
+        rs_api.request_hiscores(player_name, retries=2)
+    assert mock_get.call_count == 3
+
+
+@mock.patch(
+    f"{rs_api.__name__}.requests.Session.get",
+    side_effect=requests.exceptions.ReadTimeout,
+)
+def test_request_hiscores_retries_timeout_exhausted(mock_get, mocker, player_name):
+    mocker.patch(f"{rs_api.__name__}.time.sleep")
+    with pytest.raises(rs_api.HiscoresDownError):
+        rs_api.request_hiscores(player_name, retries=1)
+    assert mock_get.call_count == 2
+
+
+def test_request_hiscores_rate_limited(mocker, player_name):
+    mocker.patch(f"{rs_api.__name__}.time.sleep")
+    mocker.patch(
+        f"{rs_api.__name__}.requests.Session.get",
+        side_effect=[
+            requests.exceptions.ReadTimeout,
+            MockRequestsGet(
+                text="Too Many Requests",
+                status_code=429,
+                elapsed=1,
+                reason="Too Many Requests",
+            )(rs_api.HISCORES_API, {"player": player_name}),
+            MockRequestsGet(
+                text=successful_response_text(),
+                status_code=200,
+                elapsed=1,
+                reason="OK",
+            )(rs_api.HISCORES_API, {"player": player_name}),
+        ],
+    )
+    rate_limiter = mocker.Mock(spec=rs_api.RateLimiter)
+    with pytest.raises(ValueError):
+        rs_api.request_hiscores(player_name, retries=1, rate_limiter=rate_limiter)
+    rs_api.request_hiscores(player_name, rate_limiter=rate_limiter)
+    assert rate_limiter.acquire.call_count == 3
+    assert [call.kwargs.get("ok") for call in rate_limiter.record.call_args_list] == [
+        False,
+        False,
+        True,
+    ]
+
+
+def test_request_hiscores_circuit_breaker(mocker, player_name):
+    mocker.patch(f"{rs_api.__name__}.time.sleep")
+    mock_get = mocker.patch(
+        f"{rs_api.__name__}.requests.Session.get",
+        side_effect=[
+            requests.exceptions.ReadTimeout,
+            MockRequestsGet(
+                text="Service Unavailable",
+                status_code=503,
+                elapsed=1,
+                reason="Service Unavailable",
+            )(rs_api.HISCORES_API, {"player": player_name}),
+        ],
+    )
+    breaker = rs_api.CircuitBreaker(failure_threshold=2)
+    with pytest.raises(rs_api.CircuitOpenError):
+        rs_api.request_hiscores(player_name, retries=5, circuit_breaker=breaker)
+    assert mock_get.call_count == 2
+    assert breaker.metrics()["rejected"] == 1
+
+
+@mock.patch(
+    f"{rs_api.__name__}.requests.Session.get",
+    side_effect=MockRequestsGet(
+        text=successful_response_text(), status_code=200, elapsed=1, reason="OK"
+    ),
+)
+def test_request_hiscores_circuit_breaker_success(mock_get, mocker, player_name):
+    breaker = mocker.Mock(spec=rs_api.CircuitBreaker)
+    breaker.allow.return_value = True
+    rs_api.request_hiscores(player_name, circuit_breaker=breaker)
+    breaker.record_success.assert_called_once()
+
+
+def test_request_hiscores_deadline_passed(mocker, player_name):
+    mock_get = mocker.patch(f"{rs_api.__name__}.requests.Session.get")
+    breaker = mocker.Mock(spec=rs_api.CircuitBreaker)
+    with pytest.raises(rs_api.DeadlineExceededError):
+        rs_api.request_hiscores(
+            player_name, circuit_breaker=breaker, deadline=rs_api.time.monotonic()
+        )
+    mock_get.assert_not_called()
+    breaker.allow.assert_not_called()
+
+
+def test_request_hiscores_deadline_caps_timeout(mocker, player_name):
+    mocker.patch(f"{rs_api.__name__}.time.sleep")
+    mock_get = mocker.patch(
+        f"{rs_api.__name__}.requests.Session.get",
+        side_effect=requests.exceptions.ReadTimeout,
+    )
+    breaker = mocker.Mock(spec=rs_api.CircuitBreaker)
+    breaker.allow.return_value = True
+    with pytest.raises(rs_api.DeadlineExceededError):
+        rs_api.request_hiscores(
+            player_name,
+            timeout=15.0,
+            retries=2,
+            circuit_breaker=breaker,
+            deadline=rs_api.time.monotonic() + 5.0,
+        )
+    mock_get.assert_called_once()
+    assert 0 < mock_get.call_args.kwargs["timeout"] <= 5.0
+    # timing out at the deadline says nothing about the API being down
+    breaker.record_failure.assert_not_called()
+
+
+def test_request_hiscores_batch_deadline(mocker):
+    mocker.patch(
+        f"{rs_api.__name__}.requests.Session.get",
+        side_effect=MockRequestsGet(
+            text=successful_response_text(), status_code=200, elapsed=1, reason="OK"
+        ),
+    )
+    now = rs_api.time.monotonic()
+    mocker.patch(
+        f"{rs_api.__name__}.time.monotonic", side_effect=[now, now + 0.5, now + 1.0]
+    )
+    responses = rs_api.request_hiscores_batch(
+        ["ElderPlinius", "Brec"], max_workers=1, deadline=now + 1.0
+    )
+    assert isinstance(responses[0], requests.Response)
+    assert isinstance(responses[1], rs_api.DeadlineExceededError)
@@ -0,0 +1,224 @@
+"""Per-player activity statistics with pluggable storage backends.
+
+Ingest records a change whenever a player's snapshot differs from the last one
+stored; the orchestrator reads the statistics back to schedule polls.
+
+"""
+import abc
+import sqlite3
+import threading
+import time
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, NamedTuple, Optional
+
+from hiscores_common.lib.table.keys import ACTIVITY_PARTITION
+
+MAX_BATCH_GET_KEYS = 100
+"""BatchGetItem accepts at most 100 keys per call."""
+
+
+class ActivityStats(NamedTuple):
+    """Change history of a player, with times in epoch seconds."""
+
+    first_changed: float
+    """When a change was first recorded."""
+    last_changed: float
+    """When a change was last recorded."""
+    changes: int
+    """Number of changes recorded."""
+
+    @property
+    def mean_change_gap(self) -> Optional[float]:
+        """Average number of seconds between changes, if there were several.
+
+        Examples:
+        >>> ActivityStats(first_changed=0, last_changed=300, changes=4).mean_change_gap
+        100.0
+        >>> ActivityStats(first_changed=0, last_changed=0, changes=1).mean_change_gap
+
+        """
+        if self.changes < 2:
+            return None
+        return (self.last_changed - self.first_changed) / (self.changes - 1)
+
+
+class ActivityStore(abc.ABC):
+    """Storage for `ActivityStats`, keyed by player."""
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+
+    @abc.abstractmethod
+    def get_many(self, players: Iterable[str]) -> Dict[str, ActivityStats]:
+        """Get the stats of players; players without any are left out."""
+
+    @abc.abstractmethod
+    def record_change(self, player: str, when: Optional[float] = None):
+        """Record that a player's snapshot changed at `when`, by default now."""
+
+
+class InMemoryActivityStore(ActivityStore):
+    """Store kept in process memory, for tests and local runs.
+
+    Examples:
+    >>> store = InMemoryActivityStore()
+    >>> store.record_change("Brec", when=100)
+    >>> store.record_change("Brec", when=400)
+    >>> store.get_many(["Brec", "ElderPlinius"])
+    {'Brec': ActivityStats(first_changed=100, last_changed=400, changes=2)}
+
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        super().__init__(clock=clock)
+        self._stats: Dict[str, ActivityStats] = dict()
+        self._lock = threading.Lock()
+
+    def get_many(self, players: Iterable[str]) -> Dict[str, ActivityStats]:
+        return {
+            player: self._stats[player] for player in players if player in self._stats
+        }
+
+    def record_change(self, player: str, when: Optional[float] = None):
+        when = self._clock() if when is None else when
+        with self._lock:
+            stats = self._stats.get(player)
+            if stats is None:
+                self._stats[player] = ActivityStats(when, when, 1)
+            else:
+                self._stats[player] = ActivityStats(
+                    stats.first_changed, when, stats.changes + 1
+                )
+
+
+class SQLiteActivityStore(ActivityStore):
+    """Store backed by a SQLite database; a local stand-in for DynamoDB.
+
+    Examples:
+    >>> store = SQLiteActivityStore(":memory:")
+    >>> store.record_change("Brec", when=100)
+    >>> store.get_many(["Brec"])
+    {'Brec': ActivityStats(first_changed=100.0, last_changed=100.0, changes=1)}
+
+    """
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.time):
+        super().__init__(clock=clock)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS activity (name TEXT PRIMARY KEY, "
+            "first_changed REAL, last_changed REAL, changes INTEGER)"
+        )
+
+    def get_many(self, players: Iterable[str]) -> Dict[str, ActivityStats]:
+        players = list(players)
+        stats = dict()
+        for start in range(0, len(players), MAX_BATCH_GET_KEYS):
+            batch = players[start : start + MAX_BATCH_GET_KEYS]
+            rows = self._conn.execute(
+                "SELECT name, first_changed, last_changed, changes FROM activity "
+                f"WHERE name IN ({', '.join('?' * len(batch))})",
+                batch,
+            ).fetchall()
+            stats.update((row[0], ActivityStats(*row[1:])) for row in rows)
+        return stats
+
+    def record_change(self, player: str, when: Optional[float] = None):
+        when = self._clock() if when is None else when
+        with self._conn:
+            updated = self._conn.execute(
+                "UPDATE activity SET last_changed = ?, changes = changes + 1 "
+                "WHERE name = ?",
+                (when, player),
+            )
+            if not updated.rowcount:
+                self._conn.execute(
+                    "INSERT INTO activity VALUES (?, ?, ?, 1)", (player, when, when)
+                )
+
+
+class DynamoActivityStore(ActivityStore):
+    """Store backed by a single partition of the HiScores table.
+
+    Each player is an item with partition key `ACTIVITY_PARTITION` and the
+    player name as its sort key. Changes are recorded with a single atomic
+    UpdateItem, so concurrent ingest workers never lose a count.
+
+    """
+
+    def __init__(
+        self,
+        table,
+        partition: str = ACTIVITY_PARTITION,
+        clock: Callable[[], float] = time.time,
+        max_retries: int = 5,
+    ):
+        super().__init__(clock=clock)
+        self._table = table
+        self.partition = partition
+        self.max_retries = max_retries
+
+    def get_many(self, players: Iterable[str]) -> Dict[str, ActivityStats]:
+        players = list(dict.fromkeys(players))
+        stats = dict()
+        for start in range(0, len(players), MAX_BATCH_GET_KEYS):
+            keys = [
+                {"player": self.partition, "timestamp": player}
+                for player in players[start : start + MAX_BATCH_GET_KEYS]
+            ]
+            for _ in range(self.max_retries + 1):
+                response = self._table.meta.client.batch_get_item(
+                    RequestItems={self._table.name: {"Keys": keys}}
+                )
+                for item in response["Responses"].get(self._table.name, []):
+                    stats[item["timestamp"]] = ActivityStats(
+                        float(item["firstChanged"]),
+                        float(item["lastChanged"]),
+                        int(item["changes"]),
+                    )
+                keys = (
+                    response.get("UnprocessedKeys", {})
+                    .get(self._table.name, {})
+                    .get("Keys", [])
+                )
+                if not keys:
+                    break
+        return stats
+
+    def record_change(self, player: str, when: Optional[float] = None):
+        when = Decimal(str(self._clock() if when is None else when))
+        self._table.update_item(
+            Key={"player": self.partition, "timestamp": player},
+            UpdateExpression=(
+                "SET lastChanged = :when, "
+                "firstChanged = if_not_exists(firstChanged, :when) ADD changes :one"
+            ),
+            ExpressionAttributeValues={":when": when, ":one": 1},
+        )
+
+
+def get_activity_store(spec: str, table=None) -> Optional[ActivityStore]:
+    """Build a store from a spec of the form `none`, `memory`, `sqlite:<path>` or
+    `dynamodb`. The `none` spec disables activity tracking.
+
+    Examples:
+    >>> get_activity_store("none") is None
+    True
+    >>> get_activity_store("memcached")
+    Traceback (most recent call last):
+    ...
+    ValueError: Unsupported activity store 'memcached'.
+
+    """
+    backend, _, arg = spec.partition(":")
+    if backend == "none":
+        return None
+    if backend == "memory":
+        return InMemoryActivityStore()
+    if backend == "sqlite":
+        return SQLiteActivityStore(arg)
+    if backend == "dynamodb":
+        if table is None:
+            raise ValueError("The dynamodb activity store requires a table.")
+        return DynamoActivityStore(table)
+    raise ValueError(f"Unsupported activity store '{spec}'.")
@@ -0,0 +1,156 @@
+"""Compact packed-integer storage format for HiScores snapshots.
+
+A packed snapshot stores its skills and activities in a single binary
+attribute instead of a nested map. The attribute is one version byte followed
+by a zlib-compressed array of little-endian int64 values: for each row of
+`HISCORES_RESPONSE_ROWS`, in order, the skill columns or activity columns of
+that row. Most activities are unranked (-1), so the array compresses well.
+
+"""
+import base64
+import sys
+import zlib
+from array import array
+from typing import Dict, List, Tuple
+
+from .constants import (
+    HISCORE_RESPONSE_ACTIVITY_COLS,
+    HISCORES_RESPONSE_ACTIVITIES,
+    HISCORES_RESPONSE_SKILL_COLS,
+    HISCORES_RESPONSE_SKILLS,
+)
+
+PACKED_ATTRIBUTE = "packed"
+CODEC_VERSION = 1
+
+NESTED_FORMAT = "nested"
+PACKED_FORMAT = "packed"
+STORAGE_FORMATS = (NESTED_FORMAT, PACKED_FORMAT)
+
+# Layout of each codec version: (skills, activities, skill cols, activity cols).
+# Never modify a released layout; add a new version instead.
+LAYOUTS: Dict[int, Tuple[List[str], List[str], List[str], List[str]]] = {
+    1: (
+        list(HISCORES_RESPONSE_SKILLS),
+        list(HISCORES_RESPONSE_ACTIVITIES),
+        list(HISCORES_RESPONSE_SKILL_COLS),
+        list(HISCORE_RESPONSE_ACTIVITY_COLS),
+    ),
+}
+
+
+def _to_bytes(value) -> bytes:
+    """Get raw bytes from any of the forms DynamoDB hands back binary data in.
+
+    Stream images hold base64 strings, while boto3 resources return
+    `boto3.dynamodb.types.Binary` wrappers.
+
+    """
+    if isinstance(value, str):
+        return base64.b64decode(value)
+    return bytes(getattr(value, "value", value))
+
+
+def encode_snapshot(item: dict, version: int = CODEC_VERSION) -> dict:
+    """Replace the `skills` and `activities` maps of an item with a packed blob.
+
+    Raises:
+        ValueError: if the item is missing a row or column of the layout.
+
+    Examples:
+    >>> item = {"player": "PlayerName", "skills": {}, "activities": {}}
+    >>> encode_snapshot(item)
+    Traceback (most recent call last):
+    ...
+    ValueError: Snapshot is missing skill 'Overall' for codec version 1.
+
+    """
+    skills, activities, skill_cols, activity_cols = LAYOUTS[version]
+    values = array("q")
+    for key, kind, rows, cols in [
+        ("skills", "skill", skills, skill_cols),
+        ("activities", "activity", activities, activity_cols),
+    ]:
+        section = item.get(key, {})
+        for row in rows:
+            try:
+                values.extend(section[row][col] for col in cols)
+            except KeyError:
+                raise ValueError(
+                    f"Snapshot is missing {kind} '{row}' for codec version {version}."
+                )
+
+    encoded = {k: v for k, v in item.items() if k not in ("skills", "activities")}
+    encoded[PACKED_ATTRIBUTE] = bytes([version]) + zlib.compress(
+        _little_endian(values).tobytes()
+    )
+    return encoded
+
+
+def _little_endian(values: array) -> array:
+    """Convert native int64s to little-endian (or back) on big-endian hosts."""
+    if sys.byteorder == "big":  # pragma: no cover
+        values = array("q", values)
+        values.byteswap()
+    return values
+
+
+def is_packed(item: dict) -> bool:
+    """Whether an item stores its stats in packed format."""
+    return item is not None and PACKED_ATTRIBUTE in item
+
+
+def layout_leaves(version: int) -> List[Tuple[str, str, str]]:
+    """Get the path of each packed value of a codec version, in order."""
+    skills, activities, skill_cols, activity_cols = LAYOUTS[version]
+    return [("skills", skill, col) for skill in skills for col in skill_cols] + [
+        ("activities", activity, col)
+        for activity in activities
+        for col in activity_cols
+    ]
+
+
+def unpack_values(packed) -> Tuple[int, List[int]]:
+    """Get the codec version and the values of a packed attribute, in the
+    order of `layout_leaves(version)`.
+
+    Examples:
+    >>> item = {"skills": {}, "activities": {}}
+    >>> for group, row, col in layout_leaves(1):
+    ...     item[group].setdefault(row, {})[col] = 7
+    >>> version, values = unpack_values(encode_snapshot(item)[PACKED_ATTRIBUTE])
+    >>> version, len(values) == len(layout_leaves(1)), set(values)
+    (1, True, {7})
+
+    """
+    data = _to_bytes(packed)
+    version = data[0]
+    if version not in LAYOUTS:
+        raise ValueError(f"Unsupported packed snapshot version: {version}.")
+    values = array("q")
+    values.frombytes(zlib.decompress(data[1:]))
+    return version, _little_endian(values).tolist()
+
+
+def decode_snapshot(item: dict) -> dict:
+    """Expand a packed item back into `skills` and `activities` maps.
+
+    Items that are not packed are returned unchanged.
+
+    Examples:
+    >>> decode_snapshot({"player": "PlayerName"})
+    {'player': 'PlayerName'}
+
+    """
+    if not is_packed(item):
+        return item
+    version, values = unpack_values(item[PACKED_ATTRIBUTE])
+    skills, activities, skill_cols, activity_cols = LAYOUTS[version]
+    values = iter(values)
+
+    decoded = {k: v for k, v in item.items() if k != PACKED_ATTRIBUTE}
+    decoded["skills"] = {skill: dict(zip(skill_cols, values)) for skill in skills}
+    decoded["activities"] = {
+        activity: dict(zip(activity_cols, values)) for activity in activities
+    }
+    return decoded
@@ -0,0 +1,104 @@
+"""Delta encoding of HiScores snapshots against a full base snapshot.
+
+A delta item stores only the skill and activity rows that differ from a full
+base snapshot, plus the base's timestamp under `BASE_ATTRIBUTE`. A delta with
+no changed rows is a "no-change" marker. Deltas always reference a full
+snapshot, never another delta, so any snapshot can be rebuilt from at most two
+items.
+
+"""
+import hashlib
+import json
+from typing import Optional
+
+BASE_ATTRIBUTE = "base"
+STAT_ATTRIBUTES = ("skills", "activities")
+
+
+def fingerprint(item: dict) -> str:
+    """Hash the stats of a full snapshot, ignoring player and timestamp.
+
+    Examples:
+    >>> a = {"timestamp": "a", "skills": {"Overall": {"xp": 1}}}
+    >>> b = {"timestamp": "b", "skills": {"Overall": {"xp": 1}}}
+    >>> fingerprint(a) == fingerprint(b)
+    True
+
+    """
+    stats = {key: item.get(key, {}) for key in STAT_ATTRIBUTES}
+    encoded = json.dumps(stats, sort_keys=True, default=int).encode()
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def is_delta(item: Optional[dict]) -> bool:
+    """Whether an item is a delta (or no-change marker) rather than a snapshot."""
+    return item is not None and BASE_ATTRIBUTE in item
+
+
+def changed_rows(base: dict, new: dict) -> dict:
+    """Get the rows of `new` whose values differ from `base`.
+
+    Examples:
+    >>> base = {"skills": {"Attack": {"xp": 1}, "Magic": {"xp": 2}}}
+    >>> new = {"skills": {"Attack": {"xp": 1}, "Magic": {"xp": 5}}}
+    >>> changed_rows(base, new)
+    {'skills': {'Magic': {'xp': 5}}, 'activities': {}}
+
+    """
+    return {
+        key: {
+            row: cols
+            for row, cols in new.get(key, {}).items()
+            if base.get(key, {}).get(row) != cols
+        }
+        for key in STAT_ATTRIBUTES
+    }
+
+
+def count_rows(item: dict) -> int:
+    """Count the skill and activity rows of an item."""
+    return sum(len(item.get(key, {})) for key in STAT_ATTRIBUTES)
+
+
+def make_delta(base: dict, new: dict) -> dict:
+    """Build a delta item storing only the rows of `new` that changed.
+
+    Empty sections are omitted, so an unchanged snapshot yields a marker
+    holding nothing but its key and base reference.
+
+    Examples:
+    >>> base = {"player": "P", "timestamp": "t0", "skills": {"Magic": {"xp": 2}}}
+    >>> new = {"player": "P", "timestamp": "t1", "skills": {"Magic": {"xp": 2}}}
+    >>> make_delta(base, new)
+    {'player': 'P', 'timestamp': 't1', 'base': 't0'}
+
+    """
+    delta = {
+        "player": new["player"],
+        "timestamp": new["timestamp"],
+        BASE_ATTRIBUTE: base["timestamp"],
+    }
+    for key, rows in changed_rows(base, new).items():
+        if rows:
+            delta[key] = rows
+    return delta
+
+
+def apply_delta(base: dict, delta: dict) -> dict:
+    """Rebuild a full snapshot from its base and a delta.
+
+    Attributes of the delta other than the stats (e.g. `divisor`) are kept,
+    and the base reference is dropped.
+
+    Examples:
+    >>> base = {"player": "P", "timestamp": "t0", "skills": {"Magic": {"xp": 2}}}
+    >>> delta = {"player": "P", "timestamp": "t1", "base": "t0"}
+    >>> apply_delta(base, delta)
+    {'player': 'P', 'timestamp': 't1', 'skills': {'Magic': {'xp': 2}}}
+
+    """
+    result = {k: v for k, v in delta.items() if k != BASE_ATTRIBUTE}
+    for key in STAT_ATTRIBUTES:
+        if key in base or key in delta:
+            result[key] = dict(base.get(key, {}), **delta.get(key, {}))
+    return result
@@ -0,0 +1,158 @@
+"""Atomic, server-side increments of rollup rows.
+
+DynamoDB only allows `ADD` on top-level attributes, so rollup rows written this
+way keep each `skills.*.*` and `activities.*.*` leaf in a flat attribute named
+by its dotted path, e.g. `skills.Magic.xp`. `merge_flat_leaves` folds these
+back into the nested maps that readers expect.
+
+"""
+from typing import Dict, List, Tuple
+
+from .constants import (
+    HISCORE_RESPONSE_ACTIVITY_COLS,
+    HISCORES_RESPONSE_ACTIVITIES,
+    HISCORES_RESPONSE_SKILL_COLS,
+    HISCORES_RESPONSE_SKILLS,
+)
+
+DIVISOR_ATTRIBUTE = "divisor"
+WATERMARK_ATTRIBUTE = "through"
+"""Sort key of the last row or snapshot added to a rollup row."""
+
+ROLLUP_LEAVES: List[Tuple[str, str, str]] = [
+    ("skills", skill, col)
+    for skill in HISCORES_RESPONSE_SKILLS
+    for col in HISCORES_RESPONSE_SKILL_COLS
+] + [
+    ("activities", activity, col)
+    for activity in HISCORES_RESPONSE_ACTIVITIES
+    for col in HISCORE_RESPONSE_ACTIVITY_COLS
+]
+"""Path of every leaf of a rollup row, generated from the response schema."""
+
+
+def flat_name(group: str, row: str, col: str) -> str:
+    """Get the flat attribute name of a leaf.
+
+    Examples:
+    >>> flat_name("skills", "Magic", "xp")
+    'skills.Magic.xp'
+
+    """
+    return f"{group}.{row}.{col}"
+
+
+def _compile_update_expression() -> Tuple[str, Dict[str, str]]:
+    """Build the update expression and attribute names shared by every update.
+
+    Placeholders are short so that the expression stays well under the 4 KB
+    limit on expression strings.
+
+    """
+    names = {"#d": DIVISOR_ATTRIBUTE}
+    actions = ["#d :d"]
+    for i, leaf in enumerate(ROLLUP_LEAVES):
+        names[f"#{i}"] = flat_name(*leaf)
+        actions.append(f"#{i} :{i}")
+    return "ADD " + ", ".join(actions), names
+
+
+UPDATE_EXPRESSION, EXPRESSION_ATTRIBUTE_NAMES = _compile_update_expression()
+
+
+def build_add_update(
+    row: dict, divisor: int = 1, watermark: str = None, after: str = None
+) -> dict:
+    """Get the UpdateItem arguments adding a nested row to a rollup row.
+
+    If a `watermark` is given, the update also records it and only applies if
+    the rollup row's watermark is older, so that each row is added only once to
+    rollups derived from rows sorted by it. If `row` folds several rows, `after`
+    is the watermark of the first of them, which the stored one must be older
+    than, while `watermark` is that of the last.
+
+    Returns:
+        dict: `UpdateExpression`, `ExpressionAttributeNames` and
+        `ExpressionAttributeValues` keyword arguments, and a
+        `ConditionExpression` if a `watermark` is given.
+
+    Raises:
+        ValueError: if `row` lacks a leaf of the schema.
+
+    Examples:
+    >>> row = {"skills": {}, "activities": {}}
+    >>> for group, name, col in ROLLUP_LEAVES:
+    ...     row[group].setdefault(name, {})[col] = 1
+    >>> update = build_add_update(row, divisor=2)
+    >>> update["UpdateExpression"][:24]
+    'ADD #d :d, #0 :0, #1 :1,'
+    >>> update["ExpressionAttributeNames"]["#0"]
+    'skills.Overall.rnk'
+    >>> build_add_update(row, watermark="Daily#2021-12-17")["ConditionExpression"]
+    'attribute_not_exists(#w) OR #w < :w'
+    >>> build_add_update(row, watermark="b", after="a")["ConditionExpression"]
+    'attribute_not_exists(#w) OR #w < :a'
+    >>> build_add_update({"skills": {}})
+    Traceback (most recent call last):
+    ...
+    ValueError: Row is missing rollup leaf 'Overall' of the schema.
+
+    """
+    values = {":d": divisor}
+    try:
+        for i, (group, name, col) in enumerate(ROLLUP_LEAVES):
+            values[f":{i}"] = row[group][name][col]
+    except KeyError as e:
+        raise ValueError(f"Row is missing rollup leaf {e} of the schema.") from e
+    if watermark is None:
+        return dict(
+            UpdateExpression=UPDATE_EXPRESSION,
+            ExpressionAttributeNames=EXPRESSION_ATTRIBUTE_NAMES,
+            ExpressionAttributeValues=values,
+        )
+    values[":w"] = watermark
+    condition = "attribute_not_exists(#w) OR #w < :w"
+    if after is not None and after != watermark:
+        values[":a"] = after
+        condition = "attribute_not_exists(#w) OR #w < :a"
+    return dict(
+        UpdateExpression=f"{UPDATE_EXPRESSION} SET #w = :w",
+        ExpressionAttributeNames=dict(
+            EXPRESSION_ATTRIBUTE_NAMES, **{"#w": WATERMARK_ATTRIBUTE}
+        ),
+        ExpressionAttributeValues=values,
+        ConditionExpression=condition,
+    )
+
+
+def merge_flat_leaves(item: dict) -> dict:
+    """Fold flat leaf attributes of a rollup row into its nested maps.
+
+    Rows written by both atomic and read-modify-write aggregation may hold a
+    leaf in both forms; as both are sums, they are added.
+
+    Examples:
+    >>> merge_flat_leaves(
+    ...     {"skills.Magic.xp": 5, "skills": {"Magic": {"xp": 2}}, "divisor": 2}
+    ... )
+    {'skills': {'Magic': {'xp': 7}}, 'divisor': 2}
+    >>> merge_flat_leaves({"activities.Zulrah.kc": 3})
+    {'activities': {'Zulrah': {'kc': 3}}}
+
+    """
+    if not any("." in key for key in item):
+        return item
+    result = dict()
+    flat = list()
+    for key, value in item.items():
+        if "." in key:
+            flat.append((key, value))
+        elif isinstance(value, dict):
+            result[key] = {row: dict(cols) for row, cols in value.items()}
+        else:
+            result[key] = value
+    for key, value in flat:
+        group, row, col = key.split(".")
+        cols = result.setdefault(group, dict()).setdefault(row, dict())
+        cols[col] = cols.get(col, 0) + value
+    return result
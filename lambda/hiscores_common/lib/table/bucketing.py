@@ -0,0 +1,146 @@
+"""Parsing and bucketing of table timestamps without `strptime`.
+
+Timestamps, dates, months and years in the table and in queries have fixed
+widths, so their format is told by their length and checked once against a
+pattern, and their fields are sliced out rather than parsed. The labels of
+hour, day, month and year buckets are then prefixes of a raw timestamp, and
+week labels, which need the date, are cached per day.
+
+"""
+import re
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Iterable
+
+TIMESTAMP_FMT = "%Y-%m-%d %H:%M:%S"
+DATE_FMT = "%Y-%m-%d"
+MONTH_FMT = "%Y-%m"
+YEAR_FMT = "%Y"
+
+FORMATS = {19: TIMESTAMP_FMT, 10: DATE_FMT, 7: MONTH_FMT, 4: YEAR_FMT}
+"""Supported formats by the length of the strings they produce."""
+
+_PATTERNS = {
+    fmt: re.compile(pattern, re.ASCII)
+    for fmt, pattern in {
+        TIMESTAMP_FMT: r"\d{4}-\d\d-\d\d (?:[01]\d|2[0-3]):[0-5]\d:[0-5]\d",
+        DATE_FMT: r"\d{4}-\d\d-\d\d",
+        MONTH_FMT: r"\d{4}-(?:0[1-9]|1[0-2])",
+        YEAR_FMT: r"\d{4}",
+    }.items()
+}
+
+
+@lru_cache(maxsize=4096)
+def _date(day: str) -> date:
+    """Get the date of a `YYYY-mm-dd` string, raising `ValueError` for days
+    that do not exist. Cached, as many timestamps share few days."""
+    return date(int(day[:4]), int(day[5:7]), int(day[8:10]))
+
+
+def parse(value: str, formats: Iterable[str] = (TIMESTAMP_FMT, DATE_FMT, MONTH_FMT)):
+    """Parse a string of any of `formats`, as `datetime.strptime` would,
+    except that every field must be zero-padded.
+
+    Raises:
+        ValueError: if `value` has none of `formats`.
+
+    Examples:
+    >>> parse("2021-12-17 20:41:59")
+    datetime.datetime(2021, 12, 17, 20, 41, 59)
+    >>> parse("2021-12")
+    datetime.datetime(2021, 12, 1, 0, 0)
+    >>> parse("2021-02-30")
+    Traceback (most recent call last):
+    ...
+    ValueError: day is out of range for month
+    >>> parse("2021", formats=[DATE_FMT])
+    Traceback (most recent call last):
+    ...
+    ValueError: '2021' does not match any of ['%Y-%m-%d'].
+
+    """
+    fmt = FORMATS.get(len(value))
+    if fmt is None or fmt not in formats or not _PATTERNS[fmt].fullmatch(value):
+        raise ValueError(f"'{value}' does not match any of {list(formats)}.")
+    if fmt == YEAR_FMT:
+        return datetime(int(value), 1, 1)
+    if fmt == MONTH_FMT:
+        return datetime(int(value[:4]), int(value[5:7]), 1)
+    day = _date(value[:10])
+    if fmt == DATE_FMT:
+        return datetime(day.year, day.month, day.day)
+    return datetime(
+        day.year,
+        day.month,
+        day.day,
+        int(value[11:13]),
+        int(value[14:16]),
+        int(value[17:19]),
+    )
+
+
+def validate_timestamp(timestamp: str) -> str:
+    """Check that a raw snapshot timestamp is a valid `TIMESTAMP_FMT` string.
+
+    Examples:
+    >>> validate_timestamp("2021-12-17 20:41:59")
+    '2021-12-17 20:41:59'
+    >>> validate_timestamp("2021-12-17T20:41:59")
+    Traceback (most recent call last):
+    ...
+    ValueError: '2021-12-17T20:41:59' is not a valid timestamp.
+
+    """
+    if len(timestamp) != 19 or not _PATTERNS[TIMESTAMP_FMT].fullmatch(timestamp):
+        raise ValueError(f"'{timestamp}' is not a valid timestamp.")
+    _date(timestamp[:10])
+    return timestamp
+
+
+def hour_label(timestamp: str) -> str:
+    """Get the hour of a valid timestamp, as `%Y-%m-%d %H:00:00`."""
+    return timestamp[:13] + ":00:00"
+
+
+def day_label(timestamp: str) -> str:
+    """Get the day of a valid timestamp, as `%Y-%m-%d`."""
+    return timestamp[:10]
+
+
+@lru_cache(maxsize=4096)
+def _week_of(day: str) -> str:
+    start = _date(day)
+    return (start - timedelta(days=start.weekday())).isoformat()
+
+
+def week_label(timestamp: str) -> str:
+    """Get the Monday starting the week of a valid timestamp, as `%Y-%m-%d`.
+
+    Examples:
+    >>> week_label("2022-01-02 20:41:59")
+    '2021-12-27'
+
+    """
+    return _week_of(timestamp[:10])
+
+
+def month_label(timestamp: str) -> str:
+    """Get the month of a valid timestamp, as `%Y-%m`."""
+    return timestamp[:7]
+
+
+def year_label(timestamp: str) -> str:
+    """Get the year of a valid timestamp, as `%Y`."""
+    return timestamp[:4]
+
+
+def format_timestamp(dt: datetime) -> str:
+    """Format a datetime as a `TIMESTAMP_FMT` string, without `strftime`.
+
+    Examples:
+    >>> format_timestamp(datetime(2021, 12, 17, 20, 41, 59, 123))
+    '2021-12-17 20:41:59'
+
+    """
+    return dt.isoformat(" ", "seconds")
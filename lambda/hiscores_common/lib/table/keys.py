@@ -0,0 +1,21 @@
+"""Reserved keys of the HiScores table."""
+
+REGISTRY_PARTITION = "Registry#players"
+"""Partition key holding the player registry, one item per tracked player."""
+
+ACTIVITY_PARTITION = "Activity#players"
+"""Partition key holding per-player activity statistics for scheduling."""
+
+BREAKER_PARTITION = "Breaker#hiscores"
+"""Partition key holding the shared state of HiScores API circuit breakers."""
+
+QUERY_CACHE_PARTITION = "Cache#queries"
+"""Partition key holding cached responses of the query API."""
+
+RESERVED_PARTITIONS = (
+    REGISTRY_PARTITION,
+    ACTIVITY_PARTITION,
+    BREAKER_PARTITION,
+    QUERY_CACHE_PARTITION,
+)
+"""Partitions that hold bookkeeping rather than HiScores snapshots."""
@@ -0,0 +1,138 @@
+"""Rollup tiers of the HiScores table.
+
+Each tier aggregates raw snapshots into buckets of a fixed calendar period,
+stored under the snapshot's player at the sort key `<sentinel><bucket>`.
+
+"""
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, NamedTuple
+
+from .bucketing import (
+    TIMESTAMP_FMT,
+    day_label,
+    format_timestamp,
+    hour_label,
+    month_label,
+    parse,
+    validate_timestamp,
+    week_label,
+    year_label,
+)
+
+
+class RollupTier(NamedTuple):
+    """A rollup tier and how to bucket timestamps into it."""
+
+    name: str
+    sentinel: str
+    """Prefix of the sort keys of the tier's rows."""
+    period_secs: int
+    """Nominal length of a bucket, used to estimate the rows a range spans."""
+    fmt: str
+    """Format of bucket labels, which is applied to the start of the bucket."""
+    label_timestamp: Callable[[str], str]
+    """Label of the bucket containing a valid raw timestamp."""
+
+    def label(self, dt: datetime) -> str:
+        """Get the label of the bucket containing `dt`."""
+        return self.label_timestamp(format_timestamp(dt))
+
+    def key(self, dt: datetime) -> str:
+        """Get the sort key of the bucket containing `dt`.
+
+        Examples:
+        >>> TIERS["weekly"].key(datetime(2021, 12, 17, 20, 41, 59))
+        'Weekly#2021-12-13'
+
+        """
+        return self.sentinel + self.label(dt)
+
+    def timestamp_key(self, timestamp: str) -> str:
+        """Get the sort key of the bucket containing a raw snapshot timestamp.
+
+        Examples:
+        >>> TIERS["hourly"].timestamp_key("2021-12-17 20:41:59")
+        'Hourly#2021-12-17 20:00:00'
+
+        """
+        return self.sentinel + self.label_timestamp(validate_timestamp(timestamp))
+
+    def bucket_key(self, timestamp: str) -> str:
+        """Get the sort key of the bucket containing a raw snapshot timestamp
+        that was already checked with `validate_timestamp`."""
+        return self.sentinel + self.label_timestamp(timestamp)
+
+    def bucket_start(self, key: str) -> datetime:
+        """Get the start of the bucket with sort key `key`.
+
+        Examples:
+        >>> TIERS["monthly"].bucket_start("Monthly#2021-12")
+        datetime.datetime(2021, 12, 1, 0, 0)
+
+        """
+        return parse(key[len(self.sentinel) :], (self.fmt,))
+
+
+HOURLY = RollupTier("hourly", "Hourly#", 3600, TIMESTAMP_FMT, hour_label)
+DAILY = RollupTier("daily", "Daily#", 86400, "%Y-%m-%d", day_label)
+WEEKLY = RollupTier("weekly", "Weekly#", 7 * 86400, "%Y-%m-%d", week_label)
+MONTHLY = RollupTier("monthly", "Monthly#", 30 * 86400, "%Y-%m", month_label)
+YEARLY = RollupTier("yearly", "Yearly#", 365 * 86400, "%Y", year_label)
+
+TIERS = {tier.name: tier for tier in (HOURLY, DAILY, WEEKLY, MONTHLY, YEARLY)}
+"""Every supported tier by name, from finest to coarsest."""
+
+ROLLUP_SENTINELS = tuple(tier.sentinel for tier in TIERS.values())
+"""Sort key prefixes of rollup rows, as opposed to raw snapshots."""
+
+DEFAULT_TIERS = "daily,monthly"
+
+NESTED_TIERS = {
+    "daily": ("hourly",),
+    "weekly": ("daily", "hourly"),
+    "monthly": ("daily", "hourly"),
+    "yearly": ("monthly", "daily", "hourly"),
+}
+"""Finer tiers whose buckets each lie within one bucket of a tier, coarsest
+first. Weeks do not lie within months or years."""
+
+
+def parse_tiers(spec: str) -> List[RollupTier]:
+    """Get the tiers named in a comma-separated spec, from finest to coarsest.
+
+    Examples:
+    >>> [tier.name for tier in parse_tiers("monthly, hourly")]
+    ['hourly', 'monthly']
+    >>> parse_tiers("daily,fortnightly")
+    Traceback (most recent call last):
+    ...
+    ValueError: Unsupported rollup tier 'fortnightly'.
+
+    """
+    names = {name.strip() for name in spec.split(",") if name.strip()}
+    for name in names:
+        if name not in TIERS:
+            raise ValueError(f"Unsupported rollup tier '{name}'.")
+    return [tier for tier in TIERS.values() if tier.name in names]
+
+
+def derivation_sources(tiers: Iterable[RollupTier]) -> Dict[str, RollupTier]:
+    """Get the tier each of `tiers` can be derived from, by name.
+
+    A tier is derived from the coarsest of the other tiers whose buckets nest
+    within its own. Tiers with no such tier are aggregated from raw snapshots.
+
+    Examples:
+    >>> sources = derivation_sources(parse_tiers("daily,weekly,monthly,yearly"))
+    >>> {name: source.name for name, source in sources.items()}
+    {'weekly': 'daily', 'monthly': 'daily', 'yearly': 'monthly'}
+
+    """
+    names = {tier.name for tier in tiers}
+    sources = dict()
+    for name in names:
+        for source in NESTED_TIERS.get(name, ()):
+            if source in names:
+                sources[name] = TIERS[source]
+                break
+    return {name: sources[name] for name in TIERS if name in sources}
@@ -0,0 +1,83 @@
+from decimal import Decimal
+
+import hiscores_common.lib.activity.store as store
+import pytest
+from hiscores_common.lib.table.keys import ACTIVITY_PARTITION
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def activity_store(request, tmp_path):
+    if request.param == "memory":
+        return store.InMemoryActivityStore(clock=lambda: 1000.0)
+    return store.SQLiteActivityStore(
+        str(tmp_path / "activity.db"), clock=lambda: 1000.0
+    )
+
+
+def test_record_change(activity_store):
+    activity_store.record_change("Brec", when=100.0)
+    activity_store.record_change("Brec", when=400.0)
+    activity_store.record_change("Brec")
+    activity_store.record_change("ElderPlinius", when=200.0)
+    assert activity_store.get_many(["Brec", "ElderPlinius", "IronPlinius"]) == {
+        "Brec": store.ActivityStats(100.0, 1000.0, 3),
+        "ElderPlinius": store.ActivityStats(200.0, 200.0, 1),
+    }
+    assert activity_store.get_many(["Brec"])["Brec"].mean_change_gap == 450.0
+
+
+def test_sqlite_get_many_in_batches(tmp_path):
+    activity_store = store.SQLiteActivityStore(str(tmp_path / "activity.db"))
+    players = [f"Player{i:03d}" for i in range(250)]
+    for player in players:
+        activity_store.record_change(player, when=1.0)
+    assert len(activity_store.get_many(players)) == 250
+
+
+@pytest.fixture
+def table(mocker):
+    table = mocker.Mock()
+    table.name = "HiScores"
+    return table
+
+
+def test_dynamo_get_many(table):
+    players = [f"Player{i:03d}" for i in range(150)]
+    item = {"firstChanged": Decimal("1"), "lastChanged": Decimal("2"), "changes": 2}
+    unprocessed = {"player": ACTIVITY_PARTITION, "timestamp": "Player001"}
+    table.meta.client.batch_get_item.side_effect = [
+        {
+            "Responses": {"HiScores": [dict(item, timestamp="Player000")]},
+            "UnprocessedKeys": {"HiScores": {"Keys": [unprocessed]}},
+        },
+        {"Responses": {"HiScores": [dict(item, timestamp="Player001")]}},
+        {"Responses": {"HiScores": [dict(item, timestamp="Player100")]}},
+    ]
+    stats = store.DynamoActivityStore(table).get_many(players + ["Player000"])
+    assert stats == {
+        player: store.ActivityStats(1.0, 2.0, 2)
+        for player in ["Player000", "Player001", "Player100"]
+    }
+    calls = table.meta.client.batch_get_item.call_args_list
+    assert [len(call.kwargs["RequestItems"]["HiScores"]["Keys"]) for call in calls] == [
+        100,
+        1,
+        50,
+    ]
+
+
+def test_dynamo_record_change(table):
+    store.DynamoActivityStore(table, clock=lambda: 1.5).record_change("Brec")
+    kwargs = table.update_item.call_args.kwargs
+    assert kwargs["Key"] == {"player": ACTIVITY_PARTITION, "timestamp": "Brec"}
+    assert kwargs["ExpressionAttributeValues"] == {":when": Decimal("1.5"), ":one": 1}
+
+
+def test_get_activity_store(table, tmp_path):
+    assert isinstance(store.get_activity_store("memory"), store.InMemoryActivityStore)
+    sqlite_store = store.get_activity_store(f"sqlite:{tmp_path / 'activity.db'}")
+    assert isinstance(sqlite_store, store.SQLiteActivityStore)
+    dynamo_store = store.get_activity_store("dynamodb", table=table)
+    assert isinstance(dynamo_store, store.DynamoActivityStore)
+    with pytest.raises(ValueError):
+        store.get_activity_store("dynamodb")
@@ -0,0 +1,64 @@
+import base64
+
+import hiscores_common.lib.snapshot.codec as codec
+import pytest
+from hiscores_common.lib.snapshot.constants import HISCORES_RESPONSE_ROWS
+
+
+def snapshot():
+    return {
+        "player": "PlayerName",
+        "timestamp": "2021-12-17 20:41:59",
+        "skills": {
+            skill: {"rnk": i, "lvl": 99, "xp": 13034431 + i}
+            for i, skill in enumerate(codec.LAYOUTS[1][0])
+        },
+        "activities": {
+            activity: {"rnk": -1, "kc": -1} for activity in codec.LAYOUTS[1][1]
+        },
+    }
+
+
+def test_layout_matches_response_rows():
+    skills, activities, _, _ = codec.LAYOUTS[codec.CODEC_VERSION]
+    assert skills + activities == HISCORES_RESPONSE_ROWS
+
+
+def test_encode_snapshot():
+    encoded = codec.encode_snapshot(snapshot())
+    assert set(encoded) == {"player", "timestamp", codec.PACKED_ATTRIBUTE}
+    assert encoded[codec.PACKED_ATTRIBUTE][0] == codec.CODEC_VERSION
+    assert codec.is_packed(encoded)
+    assert not codec.is_packed(snapshot())
+    assert not codec.is_packed(None)
+
+
+def test_encode_snapshot_smaller():
+    encoded = codec.encode_snapshot(snapshot())
+    assert len(encoded[codec.PACKED_ATTRIBUTE]) * 4 < len(str(snapshot()))
+
+
+def test_encode_snapshot_missing_activity():
+    item = snapshot()
+    del item["activities"]["Zulrah"]
+    with pytest.raises(ValueError, match="activity 'Zulrah'"):
+        codec.encode_snapshot(item)
+
+
+@pytest.mark.parametrize(
+    "wrap",
+    [
+        lambda data: data,
+        lambda data: base64.b64encode(data).decode(),
+        lambda data: type("Binary", (), {"value": data})(),
+    ],
+)
+def test_decode_snapshot_round_trip(wrap):
+    encoded = codec.encode_snapshot(snapshot())
+    encoded[codec.PACKED_ATTRIBUTE] = wrap(encoded[codec.PACKED_ATTRIBUTE])
+    assert codec.decode_snapshot(encoded) == snapshot()
+
+
+def test_decode_snapshot_unsupported_version():
+    with pytest.raises(ValueError):
+        codec.decode_snapshot({codec.PACKED_ATTRIBUTE: b"\xff"})
@@ -0,0 +1,65 @@
+import hiscores_common.lib.snapshot.rollup as rollup
+import pytest
+from hiscores_common.tst.snapshot.test_codec import snapshot
+
+
+def apply_add(item, update):
+    """Apply an `ADD` update expression to an item, as DynamoDB would."""
+    names = update["ExpressionAttributeNames"]
+    values = update["ExpressionAttributeValues"]
+    for action in update["UpdateExpression"][len("ADD ") :].split(", "):
+        name, value = action.split()
+        item[names[name]] = item.get(names[name], 0) + values[value]
+    return item
+
+
+def test_update_expression_fits_limit():
+    assert len(rollup.UPDATE_EXPRESSION.encode("utf-8")) < 4096
+
+
+def test_update_covers_every_leaf():
+    names = rollup.EXPRESSION_ATTRIBUTE_NAMES
+    assert len(names) == len(rollup.ROLLUP_LEAVES) + 1
+    assert len(set(names.values())) == len(names)
+    assert set(snapshot()["skills"]) == {
+        name for group, name, _ in rollup.ROLLUP_LEAVES if group == "skills"
+    }
+    update = rollup.build_add_update(snapshot(), divisor=3)
+    placeholders = update["UpdateExpression"].replace(",", "").split()
+    assert set(update["ExpressionAttributeValues"]) == {
+        value for value in placeholders if value[0] == ":"
+    }
+
+
+def test_build_add_update_missing_leaf():
+    row = snapshot()
+    del row["activities"]
+    with pytest.raises(ValueError):
+        rollup.build_add_update(row)
+
+
+def test_merge_flat_leaves_round_trip():
+    item = {"player": "PlayerName", "timestamp": "Daily#2021-12-17"}
+    for _ in range(2):
+        apply_add(item, rollup.build_add_update(snapshot()))
+    merged = rollup.merge_flat_leaves(item)
+    expected = snapshot()
+    for group in ("skills", "activities"):
+        for cols in expected[group].values():
+            for col in cols:
+                cols[col] *= 2
+    assert merged == dict(expected, timestamp="Daily#2021-12-17", divisor=2)
+
+
+def test_merge_flat_leaves_nested_only():
+    item = snapshot()
+    assert rollup.merge_flat_leaves(item) is item
+
+
+def test_build_add_update_watermark():
+    update = rollup.build_add_update(snapshot(), watermark="Daily#2021-12-17")
+    assert update["UpdateExpression"].startswith(rollup.UPDATE_EXPRESSION)
+    assert update["UpdateExpression"].endswith(" SET #w = :w")
+    assert update["ExpressionAttributeNames"]["#w"] == rollup.WATERMARK_ATTRIBUTE
+    assert update["ExpressionAttributeValues"][":w"] == "Daily#2021-12-17"
+    assert "#w" not in rollup.EXPRESSION_ATTRIBUTE_NAMES
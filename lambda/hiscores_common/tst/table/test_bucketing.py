@@ -0,0 +1,76 @@
+import random
+from datetime import datetime, timedelta
+
+import hiscores_common.lib.table.bucketing as bucketing
+import pytest
+
+FORMATS = [
+    bucketing.TIMESTAMP_FMT,
+    bucketing.DATE_FMT,
+    bucketing.MONTH_FMT,
+    bucketing.YEAR_FMT,
+]
+
+
+def random_times(n=500, seed=0):
+    rng = random.Random(seed)
+    start = datetime(1999, 1, 1)
+    return [
+        start + timedelta(seconds=rng.randrange(40 * 365 * 86400)) for _ in range(n)
+    ]
+
+
+def test_labels_match_strftime():
+    for dt in random_times():
+        timestamp = dt.strftime(bucketing.TIMESTAMP_FMT)
+        week = dt - timedelta(days=dt.weekday())
+        assert bucketing.validate_timestamp(timestamp) == timestamp
+        assert bucketing.hour_label(timestamp) == dt.strftime("%Y-%m-%d %H:00:00")
+        assert bucketing.day_label(timestamp) == dt.strftime("%Y-%m-%d")
+        assert bucketing.week_label(timestamp) == week.strftime("%Y-%m-%d")
+        assert bucketing.month_label(timestamp) == dt.strftime("%Y-%m")
+        assert bucketing.year_label(timestamp) == dt.strftime("%Y")
+        assert bucketing.format_timestamp(dt) == timestamp
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_parse_matches_strptime(fmt):
+    for dt in random_times():
+        value = dt.strftime(fmt)
+        assert bucketing.parse(value, FORMATS) == datetime.strptime(value, fmt)
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "",
+        "2021-12-17 24:00:00",
+        "2021-12-17 20:60:00",
+        "2021-02-29 20:00:00",
+        "2021-13-01",
+        "2021-00",
+        "2021-12-17T20:41:59",
+        "21-12-17",
+        "abcd",
+    ],
+)
+def test_parse_rejects_what_strptime_rejects(value):
+    for fmt in FORMATS:
+        with pytest.raises(ValueError):
+            datetime.strptime(value, fmt)
+    with pytest.raises(ValueError):
+        bucketing.parse(value, FORMATS)
+    with pytest.raises(ValueError):
+        bucketing.validate_timestamp(value)
+
+
+def test_parse_requires_zero_padding():
+    # unlike strptime
+    assert datetime.strptime("2021-12-1", bucketing.DATE_FMT)
+    with pytest.raises(ValueError):
+        bucketing.parse("2021-12-1")
+
+
+def test_parse_only_given_formats():
+    with pytest.raises(ValueError):
+        bucketing.parse("2021-12-17 20:41:59", [bucketing.DATE_FMT])
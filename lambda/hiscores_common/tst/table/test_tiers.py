@@ -0,0 +1,66 @@
+from datetime import datetime
+
+import hiscores_common.lib.table.tiers as tiers
+import pytest
+
+
+@pytest.mark.parametrize(
+    "name,expected",
+    [
+        ("hourly", "Hourly#2021-12-17 20:00:00"),
+        ("daily", "Daily#2021-12-17"),
+        ("weekly", "Weekly#2021-12-13"),
+        ("monthly", "Monthly#2021-12"),
+        ("yearly", "Yearly#2021"),
+    ],
+)
+def test_timestamp_key(name, expected):
+    assert tiers.TIERS[name].timestamp_key("2021-12-17 20:41:59") == expected
+
+
+def test_weekly_key_spans_years():
+    assert tiers.WEEKLY.key(datetime(2022, 1, 2)) == "Weekly#2021-12-27"
+    assert tiers.WEEKLY.key(datetime(2022, 1, 3)) == "Weekly#2022-01-03"
+
+
+def test_keys_sort_chronologically():
+    times = [datetime(2021, 12, 31, 23), datetime(2022, 1, 1), datetime(2022, 2, 1)]
+    for tier in tiers.TIERS.values():
+        keys = [tier.key(dt) for dt in times]
+        assert keys == sorted(keys)
+
+
+def test_tiers_ordered_finest_first():
+    periods = [tier.period_secs for tier in tiers.TIERS.values()]
+    assert periods == sorted(periods)
+    assert len(set(tiers.ROLLUP_SENTINELS)) == len(tiers.TIERS)
+
+
+def test_parse_tiers_default():
+    assert tiers.parse_tiers(tiers.DEFAULT_TIERS) == [tiers.DAILY, tiers.MONTHLY]
+    assert tiers.parse_tiers("") == []
+
+
+def test_bucket_start_round_trips():
+    dt = datetime(2022, 1, 2, 20, 41, 59)
+    for tier in tiers.TIERS.values():
+        start = tier.bucket_start(tier.key(dt))
+        assert start <= dt
+        assert tier.key(start) == tier.key(dt)
+
+
+@pytest.mark.parametrize(
+    "spec,expected",
+    [
+        ("daily,monthly", {"monthly": "daily"}),
+        ("hourly,weekly,yearly", {"weekly": "hourly", "yearly": "hourly"}),
+        ("weekly,monthly", {}),
+        (
+            "hourly,daily,monthly,yearly",
+            {"daily": "hourly", "monthly": "daily", "yearly": "monthly"},
+        ),
+    ],
+)
+def test_derivation_sources(spec, expected):
+    sources = tiers.derivation_sources(tiers.parse_tiers(spec))
+    assert {name: source.name for name, source in sources.items()} == expected
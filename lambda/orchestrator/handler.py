@@ -3,31 +3,119 @@ import logging
 import os
 
 import boto3
+from hiscores_common.lib.activity.store import get_activity_store
+from orchestrator.lib.fan_out.dispatcher import (
+    MAX_BATCH_ENTRIES,
+    DispatchError,
+    build_messages,
+    chunk,
+    send_messages,
+)
+from orchestrator.lib.registry.backends import get_registry
+from orchestrator.lib.schedule.adaptive import AdaptiveScheduler, parse_hours
 
 sqs = boto3.client("sqs")
 
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
+PLAYERS_PER_MESSAGE = int(os.environ.get("PLAYERS_PER_MESSAGE", "10"))
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "16"))
+SEGMENT_SIZE = int(os.environ.get("SEGMENT_SIZE", "5000"))
+PLAYER_REGISTRY = os.environ.get("PLAYER_REGISTRY", "file:orchestrator/players.txt")
+ACTIVITY_STORE = os.environ.get("ACTIVITY_STORE", "none")
+POLL_INTERVAL_MINUTES = float(os.environ.get("POLL_INTERVAL_MINUTES", "30"))
+DORMANT_AFTER_HOURS = float(os.environ.get("DORMANT_AFTER_HOURS", "24"))
+MAX_STALENESS_HOURS = float(os.environ.get("MAX_STALENESS_HOURS", "24"))
+# cron hours (UTC) the orchestrator is triggered in, e.g. 0-2,7-23
+ACTIVE_HOURS = parse_hours(os.environ.get("ACTIVE_HOURS", "*"))
+
+table = None
+if "HISCORES_TABLE_NAME" in os.environ:
+    table = boto3.resource("dynamodb").Table(os.environ["HISCORES_TABLE_NAME"])
+registry = get_registry(PLAYER_REGISTRY, table=table)
+
+# without an activity store every player is polled every cycle
+scheduler = None
+activity_store = get_activity_store(ACTIVITY_STORE, table=table)
+if activity_store is not None:
+    scheduler = AdaptiveScheduler(
+        activity_store,
+        cycle_secs=POLL_INTERVAL_MINUTES * 60,
+        dormant_after_secs=DORMANT_AFTER_HOURS * 60 * 60,
+        max_staleness_secs=MAX_STALENESS_HOURS * 60 * 60,
+        active_hours=ACTIVE_HOURS,
+    )
+
+
+def send_or_hand_off(bodies):
+    """Send messages to the GetAndParse queue, handing any that could not be sent
+    to the segments queue, so that only they are sent again rather than every
+    message of the segment."""
+    try:
+        send_messages(
+            sqs, os.environ["GET_AND_PARSE_QUEUE_URL"], bodies, max_workers=MAX_WORKERS
+        )
+    except DispatchError as e:
+        logger.warning(f"Handing {len(e.bodies)} unsent messages to the segments queue")
+        send_messages(
+            sqs,
+            os.environ["SEGMENTS_QUEUE_URL"],
+            [
+                json.dumps({"bodies": batch})
+                for batch in chunk(e.bodies, MAX_BATCH_ENTRIES)
+            ],
+            max_workers=MAX_WORKERS,
+        )
+
+
+def dispatch_segment(cursor, limit):
+    """Send messages for the players of one segment of the roster that are due."""
+    players = registry.list_players(cursor=cursor, limit=limit).players
+    if scheduler is not None:
+        players = scheduler.due_players(players)
+    player_list = [player.replace(" ", "-") for player in players]
+
+    # send {"players": [...]} messages to SQS
+    logger.info(f"Sending messages for {len(player_list)} players")
+    logger.debug(f"Sending messages for players: {player_list}")
+    send_or_hand_off(build_messages(player_list, PLAYERS_PER_MESSAGE))
+    return player_list
+
 
 def handler(event, context):
-    with open("orchestrator/players.txt") as players_file:
-        player_list = [
-            line.strip().replace(" ", "-") for line in players_file.readlines()
-        ]
-
-    # send {"player": player} n times to SQS
-    logger.info(f"Sending messages for players: {player_list}")
-    sqs.send_message_batch(
-        QueueUrl=os.environ["GET_AND_PARSE_QUEUE_URL"],
-        Entries=[
-            dict(
-                Id=f"get_and_parse_for_{player}",
-                MessageBody=json.dumps({"player": player}),
-            )
-            for player in player_list
+    """Kick off HiScores tracking for every player in the registry.
+
+    The roster is split into segments of `SEGMENT_SIZE` players. This invocation
+    dispatches the first segment itself and hands the cursors of the others to
+    the segments queue, whose messages invoke this function again to dispatch
+    each remaining segment in parallel. Messages of a segment that could not be
+    sent are handed to the segments queue on their own, to be sent again.
+
+    """
+    if "Records" in event:
+        for record in event["Records"]:
+            segment = json.loads(record["body"])
+            if "bodies" in segment:
+                logger.info(f"Resending {len(segment['bodies'])} messages")
+                send_or_hand_off(segment["bodies"])
+                continue
+            logger.info(f"Dispatching segment {segment}")
+            dispatch_segment(segment["cursor"], segment["limit"])
+        return
+
+    cursors = registry.segment_cursors(SEGMENT_SIZE)
+    logger.info(f"Splitting roster into {len(cursors)} segments")
+    send_messages(
+        sqs,
+        os.environ["SEGMENTS_QUEUE_URL"],
+        [
+            json.dumps({"cursor": cursor, "limit": SEGMENT_SIZE})
+            for cursor in cursors[1:]
         ],
+        max_workers=MAX_WORKERS,
     )
+    player_list = dispatch_segment(cursors[0], SEGMENT_SIZE)
 
     return {
         "statusCode": 200,
@@ -0,0 +1,139 @@
+"""Dispatch players to the GetAndParse queue in valid, concurrent SQS batches."""
+import json
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List
+
+logger = logging.getLogger()
+
+MAX_BATCH_ENTRIES = 10
+"""SendMessageBatch accepts at most 10 entries per call."""
+
+
+class DispatchError(Exception):
+    """Indicates some messages could not be sent after retrying.
+
+    The bodies of those messages are kept in `bodies`, so that only they need
+    to be sent again.
+
+    """
+
+    def __init__(self, message: str, bodies: List[str]):
+        super().__init__(message)
+        self.bodies = bodies
+
+
+def chunk(items: Iterable, size: int) -> Iterator[list]:
+    """Split items into lists of at most `size` items.
+
+    Examples:
+    >>> list(chunk(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+
+    """
+    if size < 1:
+        raise ValueError(f"Chunk size must be positive, got {size}.")
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def build_messages(players: Iterable[str], players_per_message: int) -> List[str]:
+    """Pack players into message bodies of the form `{"players": [...]}`.
+
+    Examples:
+    >>> build_messages(["a", "b", "c"], players_per_message=2)
+    ['{"players": ["a", "b"]}', '{"players": ["c"]}']
+
+    """
+    return [
+        json.dumps({"players": players})
+        for players in chunk(players, players_per_message)
+    ]
+
+
+def _send_batch(
+    sqs, queue_url: str, bodies: List[str], max_retries: int, backoff: float
+) -> List[str]:
+    """Send one batch of bodies, retrying failed entries.
+
+    Entry ids are batch indices, so they are always valid SQS ids regardless of
+    the characters in player names. Returns the bodies that still failed.
+
+    """
+    entries = [dict(Id=str(i), MessageBody=body) for i, body in enumerate(bodies)]
+    for attempt in range(max_retries + 1):
+        if attempt:
+            time.sleep(random.uniform(0, backoff * 2**attempt))
+        try:
+            response = sqs.send_message_batch(QueueUrl=queue_url, Entries=entries)
+        except Exception:
+            logger.exception(f"Failed to send batch of {len(entries)} messages.")
+            continue
+        failed_ids = {failure["Id"] for failure in response.get("Failed", [])}
+        entries = [entry for entry in entries if entry["Id"] in failed_ids]
+        if not entries:
+            return []
+        logger.warning(f"{len(entries)} messages failed to send: {failed_ids}")
+    return [entry["MessageBody"] for entry in entries]
+
+
+def send_messages(
+    sqs,
+    queue_url: str,
+    bodies: List[str],
+    max_workers: int = 16,
+    max_retries: int = 3,
+    backoff: float = 0.1,
+) -> int:
+    """Send message bodies to a queue in concurrent batches.
+
+    Returns:
+        int: number of messages sent.
+
+    Raises:
+        DispatchError: if any message could not be sent after retrying.
+
+    """
+    batches = list(chunk(bodies, MAX_BATCH_ENTRIES))
+    if not batches:
+        return 0
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+        failed = [
+            body
+            for batch_failures in executor.map(
+                lambda batch: _send_batch(
+                    sqs, queue_url, batch, max_retries=max_retries, backoff=backoff
+                ),
+                batches,
+            )
+            for body in batch_failures
+        ]
+    if failed:
+        raise DispatchError(f"Failed to send {len(failed)} messages: {failed}", failed)
+    logger.info(f"Sent {len(bodies)} messages in {len(batches)} batches.")
+    return len(bodies)
+
+
+def dispatch(
+    sqs,
+    queue_url: str,
+    players: Iterable[str],
+    players_per_message: int = 10,
+    **kwargs,
+) -> int:
+    """Send players to a queue, several per message and in concurrent batches.
+
+    Additional keyword arguments are forwarded to `send_messages`.
+
+    """
+    return send_messages(
+        sqs, queue_url, build_messages(players, players_per_message), **kwargs
+    )
@@ -0,0 +1,206 @@
+"""Player registry with pluggable storage backends and cursor-based paging."""
+import abc
+import logging
+import sqlite3
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+from boto3.dynamodb.conditions import Key
+from hiscores_common.lib.table.keys import REGISTRY_PARTITION
+
+logger = logging.getLogger()
+
+
+class Page(NamedTuple):
+    """A page of players, and the cursor to the next page if there is one."""
+
+    players: List[str]
+    next_cursor: Optional[str]
+
+
+class PlayerRegistry(abc.ABC):
+    """Roster of tracked players.
+
+    Players are enumerated in pages. Cursors are opaque strings that can be
+    handed to other processes, so the roster can be split into segments that
+    are enumerated independently.
+
+    """
+
+    @abc.abstractmethod
+    def list_players(self, cursor: Optional[str] = None, limit: int = 1000) -> Page:
+        """Get up to `limit` players, starting from `cursor`."""
+
+    @abc.abstractmethod
+    def add_players(self, players: Iterable[str]):
+        """Start tracking players."""
+
+    @abc.abstractmethod
+    def remove_players(self, players: Iterable[str]):
+        """Stop tracking players."""
+
+    def iter_pages(
+        self, page_size: int = 1000, cursor: Optional[str] = None
+    ) -> Iterator[Page]:
+        """Iterate over pages of players, starting from `cursor`."""
+        while True:
+            page = self.list_players(cursor=cursor, limit=page_size)
+            yield page
+            if page.next_cursor is None:
+                return
+            cursor = page.next_cursor
+
+    def segment_cursors(self, segment_size: int) -> List[Optional[str]]:
+        """Get the starting cursor of every segment of `segment_size` players."""
+        cursors = [None]
+        for page in self.iter_pages(page_size=segment_size):
+            if page.next_cursor is not None:
+                cursors.append(page.next_cursor)
+        return cursors
+
+
+class FilePlayerRegistry(PlayerRegistry):
+    """Registry backed by a text file with one player per line.
+
+    Cursors are line offsets. This is the original `players.txt` roster.
+
+    Examples:
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile("w", suffix=".txt") as f:
+    ...     _ = f.write("ElderPlinius\\nBrec\\n\\nIronPlinius\\n")
+    ...     f.flush()
+    ...     FilePlayerRegistry(f.name).list_players(limit=2)
+    Page(players=['ElderPlinius', 'Brec'], next_cursor='2')
+
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _read(self) -> List[str]:
+        with open(self.path) as players_file:
+            return [line.strip() for line in players_file if line.strip()]
+
+    def list_players(self, cursor: Optional[str] = None, limit: int = 1000) -> Page:
+        players = self._read()
+        start = int(cursor or 0)
+        end = start + limit
+        return Page(players[start:end], str(end) if end < len(players) else None)
+
+    def add_players(self, players: Iterable[str]):
+        existing = set(self._read())
+        with open(self.path, "a") as players_file:
+            for player in players:
+                if player not in existing:
+                    players_file.write(f"{player}\n")
+                    existing.add(player)
+
+    def remove_players(self, players: Iterable[str]):
+        removed = set(players)
+        remaining = [player for player in self._read() if player not in removed]
+        with open(self.path, "w") as players_file:
+            players_file.writelines(f"{player}\n" for player in remaining)
+
+
+class SQLitePlayerRegistry(PlayerRegistry):
+    """Registry backed by a SQLite database; a local stand-in for DynamoDB.
+
+    Cursors are the last player name of the previous page.
+
+    Examples:
+    >>> registry = SQLitePlayerRegistry(":memory:")
+    >>> registry.add_players(["Brec", "ElderPlinius", "IronPlinius"])
+    >>> registry.list_players(limit=2)
+    Page(players=['Brec', 'ElderPlinius'], next_cursor='ElderPlinius')
+
+    """
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS players (name TEXT PRIMARY KEY)")
+
+    def list_players(self, cursor: Optional[str] = None, limit: int = 1000) -> Page:
+        rows = self._conn.execute(
+            "SELECT name FROM players WHERE name > ? ORDER BY name LIMIT ?",
+            (cursor or "", limit + 1),
+        ).fetchall()
+        players = [name for (name,) in rows[:limit]]
+        return Page(players, players[-1] if len(rows) > limit else None)
+
+    def add_players(self, players: Iterable[str]):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO players (name) VALUES (?)",
+                [(player,) for player in players],
+            )
+
+    def remove_players(self, players: Iterable[str]):
+        with self._conn:
+            self._conn.executemany(
+                "DELETE FROM players WHERE name = ?", [(player,) for player in players]
+            )
+
+
+class DynamoPlayerRegistry(PlayerRegistry):
+    """Registry backed by a single partition of the HiScores table.
+
+    Each player is an item with partition key `REGISTRY_PARTITION` and the
+    player name as its sort key. Cursors are the last player name of the
+    previous page.
+
+    """
+
+    def __init__(self, table, partition: str = REGISTRY_PARTITION):
+        self._table = table
+        self.partition = partition
+
+    def list_players(self, cursor: Optional[str] = None, limit: int = 1000) -> Page:
+        kwargs = dict(
+            KeyConditionExpression=Key("player").eq(self.partition),
+            ProjectionExpression="#t",
+            ExpressionAttributeNames={"#t": "timestamp"},
+            Limit=limit,
+        )
+        if cursor is not None:
+            kwargs["ExclusiveStartKey"] = {
+                "player": self.partition,
+                "timestamp": cursor,
+            }
+        response = self._table.query(**kwargs)
+        players = [item["timestamp"] for item in response["Items"]]
+        last_key = response.get("LastEvaluatedKey")
+        return Page(players, last_key["timestamp"] if last_key else None)
+
+    def add_players(self, players: Iterable[str]):
+        with self._table.batch_writer() as batch:
+            for player in players:
+                batch.put_item(Item={"player": self.partition, "timestamp": player})
+
+    def remove_players(self, players: Iterable[str]):
+        with self._table.batch_writer() as batch:
+            for player in players:
+                batch.delete_item(Key={"player": self.partition, "timestamp": player})
+
+
+def get_registry(spec: str, table=None) -> PlayerRegistry:
+    """Build a registry from a spec of the form `file:<path>`, `sqlite:<path>`
+    or `dynamodb`.
+
+    Examples:
+    >>> get_registry("file:orchestrator/players.txt").path
+    'orchestrator/players.txt'
+    >>> get_registry("memcached")
+    Traceback (most recent call last):
+    ...
+    ValueError: Unsupported player registry 'memcached'.
+
+    """
+    backend, _, arg = spec.partition(":")
+    if backend == "file":
+        return FilePlayerRegistry(arg)
+    if backend == "sqlite":
+        return SQLitePlayerRegistry(arg)
+    if backend == "dynamodb":
+        if table is None:
+            raise ValueError("The dynamodb player registry requires a table.")
+        return DynamoPlayerRegistry(table)
+    raise ValueError(f"Unsupported player registry '{spec}'.")
@@ -0,0 +1,187 @@
+"""Adaptive polling schedule: poll active players every cycle, back off on the rest."""
+import bisect
+import logging
+import math
+import time
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional
+
+from hiscores_common.lib.activity.store import ActivityStats, ActivityStore
+
+logger = logging.getLogger()
+
+DAY_SECS = 24 * 60 * 60
+
+
+def parse_hours(spec: str) -> List[int]:
+    """Parse the hour field of a cron expression, such as `0-2,7-23`.
+
+    Examples:
+    >>> parse_hours("0-2,7-9")
+    [0, 1, 2, 7, 8, 9]
+    >>> parse_hours("*") == list(range(24))
+    True
+    >>> parse_hours("7-25")
+    Traceback (most recent call last):
+    ...
+    ValueError: Invalid hours '7-25'.
+
+    """
+    hours = set()
+    for part in spec.split(","):
+        part = "0-23" if part.strip() == "*" else part
+        low, _, high = part.partition("-")
+        try:
+            low, high = int(low), int(high or low)
+        except ValueError:
+            raise ValueError(f"Invalid hours '{spec}'.")
+        if not 0 <= low <= high <= 23:
+            raise ValueError(f"Invalid hours '{spec}'.")
+        hours.update(range(low, high + 1))
+    return sorted(hours)
+
+
+class AdaptiveScheduler(object):
+    """Decide which players are due for a poll in the current cycle.
+
+    Time is split into cycles of `cycle_secs`, the orchestrator's trigger
+    interval. A player is active while the time since its last change is shorter
+    than `dormant_after_secs`, or than its own average gap between changes if
+    that is longer. Active players, and players with no recorded change yet, are
+    polled every cycle. Dormant players are polled every 2, 4, 8, ... cycles as
+    their idle time doubles, up to at most `max_staleness_secs` between polls.
+
+    Periods are powers of two and each player is polled when the cycle index
+    matches a fixed phase derived from its name. This needs no record of past
+    polls, spreads dormant players evenly over cycles, and still guarantees the
+    staleness bound when a player's period changes.
+
+    If the orchestrator only runs in some `active_hours` of the (UTC) day,
+    cycles are indexed by the orchestrator's runs, so that no poll falls in the
+    hours it does not run, and the longest period is the one whose runs are
+    never further apart than `max_staleness_secs`, even across those hours.
+
+    Examples:
+    >>> from hiscores_common.lib.activity.store import InMemoryActivityStore
+    >>> store = InMemoryActivityStore()
+    >>> store.record_change("Brec", when=0)
+    >>> scheduler = AdaptiveScheduler(
+    ...     store, cycle_secs=60, dormant_after_secs=600, max_staleness_secs=480
+    ... )
+    >>> scheduler.period(store.get_many(["Brec"])["Brec"], now=300)
+    1
+    >>> scheduler.period(store.get_many(["Brec"])["Brec"], now=6000)
+    8
+
+    """
+
+    def __init__(
+        self,
+        store: ActivityStore,
+        cycle_secs: float = 30 * 60,
+        dormant_after_secs: float = 24 * 60 * 60,
+        max_staleness_secs: float = 24 * 60 * 60,
+        active_hours: Optional[Iterable[int]] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        if cycle_secs <= 0 or dormant_after_secs <= 0:
+            raise ValueError("Cycle and dormancy durations must be positive.")
+        if max_staleness_secs < cycle_secs:
+            raise ValueError("Maximum staleness must be at least one cycle.")
+        self._store = store
+        self.cycle_secs = cycle_secs
+        self.dormant_after_secs = dormant_after_secs
+        self._clock = clock
+        self._active_cycles = None
+        if active_hours is None:
+            # largest power of two number of cycles within the staleness bound
+            self.max_period = 2 ** int(math.log2(max_staleness_secs // cycle_secs))
+            return
+
+        if DAY_SECS % cycle_secs:
+            raise ValueError("Cycles must divide a day to run in active hours.")
+        active_hours = set(active_hours)
+        self._active_cycles = [
+            cycle
+            for cycle in range(int(DAY_SECS // cycle_secs))
+            if int(cycle * cycle_secs // 3600) in active_hours
+        ]
+        if not self._active_cycles:
+            raise ValueError("The orchestrator must run in at least one hour.")
+        self.max_period = 1
+        while self.longest_gap(2 * self.max_period) <= max_staleness_secs:
+            self.max_period *= 2
+
+    def _start(self, index: int) -> float:
+        """Get the start time of the cycle with an index among active cycles."""
+        day, i = divmod(index, len(self._active_cycles))
+        return day * DAY_SECS + self._active_cycles[i] * self.cycle_secs
+
+    def longest_gap(self, period: int) -> float:
+        """Get the longest time, in seconds, between polls `period` cycles apart.
+
+        Examples:
+        >>> scheduler = AdaptiveScheduler(None, cycle_secs=3600, active_hours=[0, 1])
+        >>> scheduler.longest_gap(1) / 3600
+        23.0
+        >>> scheduler.max_period
+        2
+
+        """
+        if self._active_cycles is None:
+            return period * self.cycle_secs
+        return max(
+            self._start(index + period) - self._start(index)
+            for index in range(len(self._active_cycles))
+        )
+
+    def cycle_index(self, now: float) -> int:
+        """Get the index of the cycle at `now`, counting active cycles only.
+
+        Outside of active hours, it is the index of the next active cycle.
+
+        """
+        cycle = int(now // self.cycle_secs)
+        if self._active_cycles is None:
+            return cycle
+        day, cycle = divmod(cycle, int(DAY_SECS // self.cycle_secs))
+        return day * len(self._active_cycles) + bisect.bisect_left(
+            self._active_cycles, cycle
+        )
+
+    def period(self, stats: Optional[ActivityStats], now: float) -> int:
+        """Get the number of cycles between polls of a player."""
+        if stats is None:
+            return 1
+        threshold = max(self.dormant_after_secs, stats.mean_change_gap or 0)
+        idle = now - stats.last_changed
+        if idle < threshold:
+            return 1
+        return min(2 ** (int(math.log2(idle / threshold)) + 1), self.max_period)
+
+    @staticmethod
+    def phase(player: str, period: int) -> int:
+        """Get the cycle offset, within `period`, at which a player is polled.
+
+        Examples:
+        >>> AdaptiveScheduler.phase("Brec", 1)
+        0
+
+        """
+        return zlib.crc32(player.encode("utf-8")) % period
+
+    def due_players(self, players: List[str], now: Optional[float] = None) -> List[str]:
+        """Filter players down to those due for a poll in the current cycle."""
+        now = self._clock() if now is None else now
+        cycle = self.cycle_index(now)
+        stats: Dict[str, ActivityStats] = self._store.get_many(players)
+        due = list()
+        for player in players:
+            period = self.period(stats.get(player), now)
+            if cycle % period == self.phase(player, period):
+                due.append(player)
+        logger.info(
+            f"{len(due)} of {len(players)} players are due in cycle {cycle}; "
+            f"{len(stats)} have activity statistics."
+        )
+        return due
@@ -0,0 +1,72 @@
+import json
+
+import orchestrator.lib.fan_out.dispatcher as dispatcher
+import pytest
+
+
+@pytest.fixture
+def sqs(mocker):
+    sqs = mocker.Mock()
+    sqs.send_message_batch.return_value = {"Successful": [], "Failed": []}
+    return sqs
+
+
+def sent_players(sqs):
+    return [
+        player
+        for call in sqs.send_message_batch.call_args_list
+        for entry in call.kwargs["Entries"]
+        for player in json.loads(entry["MessageBody"])["players"]
+    ]
+
+
+def test_dispatch_chunks_batches(sqs):
+    players = [f"Player{i}" for i in range(1000)]
+    sent = dispatcher.dispatch(sqs, "queue", players, players_per_message=7)
+    assert sent == 143
+    assert sqs.send_message_batch.call_count == 15
+    assert all(
+        len(call.kwargs["Entries"]) <= dispatcher.MAX_BATCH_ENTRIES
+        for call in sqs.send_message_batch.call_args_list
+    )
+    assert sorted(sent_players(sqs)) == sorted(players)
+
+
+def test_dispatch_ids_valid_for_any_player_name(sqs):
+    dispatcher.dispatch(sqs, "queue", ["Elder Plinius!", "Zezima?"], 1)
+    (call,) = sqs.send_message_batch.call_args_list
+    assert [entry["Id"] for entry in call.kwargs["Entries"]] == ["0", "1"]
+
+
+def test_dispatch_empty(sqs):
+    assert dispatcher.dispatch(sqs, "queue", []) == 0
+    sqs.send_message_batch.assert_not_called()
+
+
+def test_dispatch_retries_failed_entries(sqs, mocker):
+    mocker.patch(f"{dispatcher.__name__}.time.sleep")
+    sqs.send_message_batch.side_effect = [
+        {"Failed": [{"Id": "1", "SenderFault": False}]},
+        ConnectionError,
+        {"Failed": []},
+    ]
+    dispatcher.dispatch(sqs, "queue", ["a", "b", "c"], players_per_message=2)
+    retried = sqs.send_message_batch.call_args_list[-1].kwargs["Entries"]
+    assert retried == [{"Id": "1", "MessageBody": '{"players": ["c"]}'}]
+
+
+def test_dispatch_raises_after_retries(sqs, mocker):
+    mocker.patch(f"{dispatcher.__name__}.time.sleep")
+    sqs.send_message_batch.return_value = {"Failed": [{"Id": "0"}]}
+    with pytest.raises(dispatcher.DispatchError) as e:
+        dispatcher.dispatch(
+            sqs, "queue", ["a", "b"], players_per_message=1, max_retries=2
+        )
+    assert sqs.send_message_batch.call_count == 3
+    # only the message that failed is left to send again
+    assert e.value.bodies == ['{"players": ["a"]}']
+
+
+def test_chunk_invalid_size():
+    with pytest.raises(ValueError):
+        list(dispatcher.chunk([1], 0))
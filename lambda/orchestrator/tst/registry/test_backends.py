@@ -0,0 +1,98 @@
+import orchestrator.lib.registry.backends as backends
+import pytest
+
+
+def players(n):
+    return [f"Player{i:03d}" for i in range(n)]
+
+
+@pytest.fixture(params=["file", "sqlite"])
+def registry(request, tmp_path):
+    if request.param == "file":
+        path = tmp_path / "players.txt"
+        path.write_text("")
+        return backends.FilePlayerRegistry(str(path))
+    return backends.SQLitePlayerRegistry(str(tmp_path / "players.db"))
+
+
+def test_add_and_list_players(registry):
+    registry.add_players(players(5))
+    registry.add_players(["Player000"])
+    assert registry.list_players().players == players(5)
+
+
+def test_remove_players(registry):
+    registry.add_players(players(5))
+    registry.remove_players(["Player001", "Player003"])
+    assert registry.list_players().players == ["Player000", "Player002", "Player004"]
+
+
+def test_iter_pages(registry):
+    registry.add_players(players(25))
+    pages = list(registry.iter_pages(page_size=10))
+    assert [len(page.players) for page in pages] == [10, 10, 5]
+    assert [p for page in pages for p in page.players] == players(25)
+    assert pages[-1].next_cursor is None
+
+
+def test_segment_cursors(registry):
+    registry.add_players(players(25))
+    cursors = registry.segment_cursors(segment_size=10)
+    assert len(cursors) == 3
+    segments = [registry.list_players(cursor, limit=10).players for cursor in cursors]
+    assert [p for segment in segments for p in segment] == players(25)
+
+
+def test_segment_cursors_empty(registry):
+    assert registry.segment_cursors(segment_size=10) == [None]
+
+
+def test_dynamo_registry(mocker):
+    table = mocker.MagicMock()
+    table.query.side_effect = [
+        {
+            "Items": [{"timestamp": "Brec"}, {"timestamp": "ElderPlinius"}],
+            "LastEvaluatedKey": {
+                "player": backends.REGISTRY_PARTITION,
+                "timestamp": "ElderPlinius",
+            },
+        },
+        {"Items": [{"timestamp": "IronPlinius"}]},
+    ]
+    registry = backends.DynamoPlayerRegistry(table)
+    pages = list(registry.iter_pages(page_size=2))
+    assert pages == [
+        backends.Page(["Brec", "ElderPlinius"], "ElderPlinius"),
+        backends.Page(["IronPlinius"], None),
+    ]
+    assert table.query.call_args.kwargs["ExclusiveStartKey"] == {
+        "player": backends.REGISTRY_PARTITION,
+        "timestamp": "ElderPlinius",
+    }
+
+    batch = table.batch_writer.return_value.__enter__.return_value
+    registry.add_players(["Zezima"])
+    batch.put_item.assert_called_once_with(
+        Item={"player": backends.REGISTRY_PARTITION, "timestamp": "Zezima"}
+    )
+    registry.remove_players(["Zezima"])
+    batch.delete_item.assert_called_once_with(
+        Key={"player": backends.REGISTRY_PARTITION, "timestamp": "Zezima"}
+    )
+
+
+@pytest.mark.parametrize(
+    "spec,cls",
+    [
+        ("file:players.txt", backends.FilePlayerRegistry),
+        ("sqlite::memory:", backends.SQLitePlayerRegistry),
+        ("dynamodb", backends.DynamoPlayerRegistry),
+    ],
+)
+def test_get_registry(spec, cls):
+    assert isinstance(backends.get_registry(spec, table=object()), cls)
+
+
+def test_get_registry_dynamodb_requires_table():
+    with pytest.raises(ValueError):
+        backends.get_registry("dynamodb")
@@ -0,0 +1,138 @@
+import orchestrator.lib.schedule.adaptive as adaptive
+import pytest
+from hiscores_common.lib.activity.store import ActivityStats, InMemoryActivityStore
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+
+def players(n):
+    return [f"Player{i:03d}" for i in range(n)]
+
+
+@pytest.fixture
+def store():
+    return InMemoryActivityStore()
+
+
+@pytest.fixture
+def scheduler(store):
+    return adaptive.AdaptiveScheduler(
+        store, cycle_secs=HOUR, dormant_after_secs=DAY, max_staleness_secs=20 * HOUR
+    )
+
+
+def test_invalid_durations(store):
+    with pytest.raises(ValueError):
+        adaptive.AdaptiveScheduler(store, cycle_secs=0)
+    with pytest.raises(ValueError):
+        adaptive.AdaptiveScheduler(store, cycle_secs=HOUR, max_staleness_secs=60)
+
+
+def test_max_period_is_power_of_two(scheduler):
+    assert scheduler.max_period == 16
+
+
+@pytest.mark.parametrize(
+    "idle, period",
+    [(0, 1), (DAY - 1, 1), (DAY, 2), (2 * DAY, 4), (4 * DAY, 8), (100 * DAY, 16)],
+)
+def test_period_backs_off_exponentially(scheduler, idle, period):
+    stats = ActivityStats(first_changed=0, last_changed=0, changes=1)
+    assert scheduler.period(stats, now=idle) == period
+
+
+def test_period_unknown_player(scheduler):
+    assert scheduler.period(None, now=DAY) == 1
+
+
+def test_period_respects_change_frequency(scheduler):
+    # changes every 3 days on average, so 2 idle days is still active
+    stats = ActivityStats(first_changed=0, last_changed=9 * DAY, changes=4)
+    assert scheduler.period(stats, now=11 * DAY) == 1
+    assert scheduler.period(stats, now=12 * DAY) == 2
+
+
+def test_due_players_active_every_cycle(scheduler, store):
+    for player in players(20):
+        store.record_change(player, when=0)
+    for cycle in range(10):
+        assert scheduler.due_players(players(20), now=cycle * HOUR) == players(20)
+
+
+def test_due_players_dormant_spread_over_cycles(scheduler, store):
+    for player in players(200):
+        store.record_change(player, when=0)
+    now = 30 * DAY
+    due = [scheduler.due_players(players(200), now=now + c * HOUR) for c in range(16)]
+    assert sorted(p for cycle in due for p in cycle) == players(200)
+    assert max(len(cycle) for cycle in due) < 40
+
+
+def test_due_players_staleness_bound_as_period_grows(scheduler, store):
+    store.record_change("Brec", when=0)
+    polls = [
+        cycle
+        for cycle in range(24, 24 * 40)
+        if scheduler.due_players(["Brec"], now=cycle * HOUR)
+    ]
+    gaps = [later - earlier for earlier, later in zip(polls, polls[1:])]
+    assert max(gaps) <= scheduler.max_period
+    assert gaps[-1] == scheduler.max_period
+
+
+def test_due_players_uses_clock(store):
+    scheduler = adaptive.AdaptiveScheduler(store, clock=lambda: 0.0)
+    assert scheduler.due_players(["Brec"]) == ["Brec"]
+
+
+def cron_firings(days, hours="0-2,7-23"):
+    """Get the times the orchestrator runs at over some days, every 30 minutes of
+    `hours`, each a little after its trigger, as segments are dispatched later."""
+    return [
+        day * DAY + hour * HOUR + minute * 60 + 90
+        for day in range(days)
+        for hour in adaptive.parse_hours(hours)
+        for minute in (0, 30)
+    ]
+
+
+@pytest.fixture
+def cron_scheduler(store):
+    return adaptive.AdaptiveScheduler(
+        store,
+        cycle_secs=HOUR / 2,
+        dormant_after_secs=DAY,
+        max_staleness_secs=DAY,
+        active_hours=adaptive.parse_hours("0-2,7-23"),
+    )
+
+
+def test_max_period_spans_inactive_hours(cron_scheduler):
+    # 32 runs take 20 hours when they span the 4.5 hours without a run
+    assert cron_scheduler.max_period == 32
+    assert cron_scheduler.longest_gap(32) == 20 * HOUR
+    assert cron_scheduler.longest_gap(64) > DAY
+
+
+def test_due_players_staleness_bound_with_cron_firings(cron_scheduler, store):
+    for player in players(100):
+        store.record_change(player, when=-100 * DAY)
+    polls = {player: [] for player in players(100)}
+    for now in cron_firings(days=4):
+        for player in cron_scheduler.due_players(players(100), now=now):
+            polls[player].append(now)
+    gaps = [
+        later - earlier
+        for times in polls.values()
+        for earlier, later in zip(times, times[1:])
+    ]
+    assert all(len(times) >= 4 for times in polls.values())
+    assert max(gaps) <= DAY
+
+
+def test_invalid_active_hours(store):
+    with pytest.raises(ValueError):
+        adaptive.AdaptiveScheduler(store, cycle_secs=7 * HOUR, active_hours=[0])
+    with pytest.raises(ValueError):
+        adaptive.AdaptiveScheduler(store, cycle_secs=HOUR, active_hours=[])
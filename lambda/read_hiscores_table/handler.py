@@ -1,21 +1,40 @@
 import json
 import logging
 import os
+from datetime import datetime, timedelta
+from typing import Iterator
 
 import boto3
 from boto3.dynamodb.conditions import Key
+from hiscores_common.lib.table.tiers import (
+    DEFAULT_TIERS,
+    derivation_sources,
+    parse_tiers,
+)
+from read_hiscores_table.lib.aggregation_queryer.cache import get_query_cache
 from read_hiscores_table.lib.aggregation_queryer.legacy import (
     format_legacy_response,
     parse_query_str,
 )
+from read_hiscores_table.lib.aggregation_queryer.pagination import iter_segments
+from read_hiscores_table.lib.aggregation_queryer.projection import projection, select
 from read_hiscores_table.lib.aggregation_queryer.util import (
     DATE_FMT,
+    LEVEL_TIERS,
     MONTH_FMT,
     TIMESTAMP_FMT,
+    AggregationLevel,
     CustomEncoder,
+    complete_rollups,
+    dump_json,
     get_query_boundaries,
     infer_aggregation_level,
     lint_items,
+    parse_time,
+    range_closed,
+    resolve_deltas,
+    split_key_range,
+    to_columns,
     valid_datetime,
 )
 
@@ -24,14 +43,95 @@ logger.setLevel(logging.INFO)
 
 ddb = boto3.resource("dynamodb")
 table = ddb.Table(os.environ["HISCORES_TABLE_NAME"])
+# rollup tiers maintained by the aggregator, and the most rows to read per query
+ROLLUP_TIERS = parse_tiers(os.environ.get("ROLLUP_TIERS", DEFAULT_TIERS))
+TARGET_POINTS = int(os.environ.get("TARGET_POINTS", "100"))
+POLL_INTERVAL_MINUTES = float(os.environ.get("POLL_INTERVAL_MINUTES", "30"))
+# derived tiers lag behind their sources with the aggregator's hierarchical strategy
+ROLLUP_STRATEGY = os.environ.get("ROLLUP_STRATEGY", "direct")
+SOURCES = derivation_sources(ROLLUP_TIERS) if ROLLUP_STRATEGY == "hierarchical" else {}
+# wide ranges are read as up to QUERY_CONCURRENCY concurrent sub-ranges of about
+# QUERY_SEGMENT_ROWS rows each
+QUERY_SEGMENT_ROWS = int(os.environ.get("QUERY_SEGMENT_ROWS", "200"))
+QUERY_CONCURRENCY = int(os.environ.get("QUERY_CONCURRENCY", "8"))
+# responses are cached in-process (memory), also in a shared backend
+# (sqlite:<path> or dynamodb), or not at all (none)
+QUERY_CACHE = os.environ.get("QUERY_CACHE", "memory")
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "256"))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(32 * 2**20)))
+# responses including a bucket that may still change expire after CACHE_TTL_SECS;
+# a bucket may change until CACHE_SETTLE_SECS after it ends, as writes lag
+CACHE_TTL_SECS = float(os.environ.get("CACHE_TTL_SECS", "60"))
+CACHE_SETTLE_SECS = float(os.environ.get("CACHE_SETTLE_SECS", "900"))
+
+# v0 responds with a list of rows, or with an array per leaf (columnar)
+RESPONSE_FORMATS = ("rows", "columnar")
+
+# Created at import so cached responses are kept across warm invocations
+query_cache = get_query_cache(
+    QUERY_CACHE, table=table, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES
+)
+
+
+def plan_query(start_time, end_time):
+    """Get the aggregation level and the sort key boundaries of a query.
+
+    Raises:
+        TypeError: if `start_time` and `end_time` formats do not match.
+
+    """
+    aggregation_level = infer_aggregation_level(
+        start_time,
+        end_time,
+        tiers=ROLLUP_TIERS,
+        target_points=TARGET_POINTS,
+        raw_period_secs=POLL_INTERVAL_MINUTES * 60,
+    )
+    return aggregation_level, get_query_boundaries(
+        start_time, end_time, aggregation_level
+    )
+
+
+def cached_body(path, player, start_time, end_time, build_body, **params):
+    """Get a response body from the query cache, or build and cache it.
+
+    Bodies are keyed on the path, the player, the normalized query boundaries
+    and any other `params`. Bodies whose rows are all final are cached until
+    evicted, and the others for `CACHE_TTL_SECS`.
 
+    """
+    if query_cache is None:
+        return build_body()
+    try:
+        aggregation_level, (low, high) = plan_query(start_time, end_time)
+    except (TypeError, ValueError):
+        return build_body()
+    key = json.dumps(
+        [path, player, aggregation_level.name, low, high, params], sort_keys=True
+    )
+    now = datetime.now() - timedelta(seconds=CACHE_SETTLE_SECS)
+    ttl_secs = None if range_closed(high, aggregation_level, now) else CACHE_TTL_SECS
+    body = query_cache.get_or_build(key, build_body, ttl_secs)
+    logger.info(
+        f"Query cache: {query_cache.hits} hits, {query_cache.misses} misses, "
+        f"{len(query_cache.local)} entries."
+    )
+    return body
+
+
+def run_table_query(player, start_time, end_time, selection=None, limit=None):
+    """Query HiScores table for a player, start time, and end time.
 
-def run_table_query(player, start_time, end_time, skills=None, category=None):
-    """Query HiScores table for a player, start time, and end time."""
+    Every page of the range is read, or only its first `limit` rows. Rows are
+    read, resolved and linted lazily, a page at a time, as the returned
+    iterator is consumed, so a whole range is never held in memory at once.
+    Only the leaves of `selection` (see `projection.select`) are read and
+    returned.
+
+    """
 
     try:
-        aggregation_level = infer_aggregation_level(start_time, end_time)
-        query_boundaries = get_query_boundaries(start_time, end_time, aggregation_level)
+        aggregation_level, query_boundaries = plan_query(start_time, end_time)
     except TypeError:
         return {
             "statusCode": 400,
@@ -47,30 +147,58 @@ def run_table_query(player, start_time, end_time, skills=None, category=None):
         f"Retrieving HiScores data for player '{player}' between "
         f"{query_boundaries[0]} and {query_boundaries[1]}"
     )
-    if skills and category:
-        logger.info(f"Limiting query to category '{category}' and skills {skills}")
-        response = table.query(
-            KeyConditionExpression=Key("player").eq(player)
-            & Key("timestamp").between(*query_boundaries),
-            ProjectionExpression=",".join(
-                ["player", "#t", "divisor"]
-                + [f"skills.{skill}.{category}" for skill in skills]
-            ),
-            ExpressionAttributeNames={"#t": "timestamp"},
+    # raw snapshots hold no flat leaves, which only atomic rollups write
+    read_kwargs = projection(selection, flat=aggregation_level != AggregationLevel.NONE)
+    if selection is not None:
+        logger.info(
+            f"Limiting query to {len(selection['skills'])} skills and "
+            f"{len(selection['activities'])} activities."
         )
-    else:
-        response = table.query(
+
+    def query_page(low, high, **kwargs):
+        return table.query(
             KeyConditionExpression=Key("player").eq(player)
-            & Key("timestamp").between(*query_boundaries),
+            & Key("timestamp").between(low, high),
+            **read_kwargs,
+            **kwargs,
         )
 
-    items = response["Items"]
-    logger.info(f"Received items: {items}")
+    def iter_rows(low, high, limit=None):
+        segments = split_key_range(
+            low,
+            high,
+            raw_period_secs=POLL_INTERVAL_MINUTES * 60,
+            rows_per_segment=QUERY_SEGMENT_ROWS,
+            max_segments=QUERY_CONCURRENCY,
+        )
+        pages = iter_segments(
+            query_page, segments, limit=limit, max_workers=QUERY_CONCURRENCY
+        )
+        for page in pages:
+            logger.debug(f"Received page of {len(page)} items.")
+            yield from page
+
+    items = iter_rows(*query_boundaries, limit=limit)
 
-    linted_items = lint_items(items, aggregation_level)
-    logger.info(f"Linted items: {linted_items}")
+    if aggregation_level in LEVEL_TIERS and SOURCES:
+        items = complete_rollups(
+            list(items),
+            LEVEL_TIERS[aggregation_level],
+            SOURCES,
+            parse_time(start_time),
+            parse_time(end_time),
+            query_rows=lambda low, high: list(iter_rows(low, high)),
+        )
 
-    return linted_items
+    if aggregation_level == AggregationLevel.NONE:
+        items = resolve_deltas(
+            items,
+            get_base=lambda timestamp: table.get_item(
+                Key={"player": player, "timestamp": timestamp}, **read_kwargs
+            ).get("Item"),
+        )
+
+    return lint_items(items, aggregation_level, selection)
 
 
 def handle_v0(event, context):
@@ -136,11 +264,53 @@ def handle_v0(event, context):
         }
     end_time = params["endTime"]
 
-    query_response = run_table_query(player, start_time, end_time)
+    try:
+        selection = select(
+            **{
+                name: [value for value in params[name].split(",") if value]
+                for name in ("skills", "activities", "fields")
+                if params.get(name) is not None
+            }
+        )
+    except ValueError as e:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"status": 400, "body": str(e)}),
+        }
+
+    response_format = params.get("format") or "rows"
+    if response_format not in RESPONSE_FORMATS:
+        return {
+            "statusCode": 400,
+            "body": json.dumps(
+                {
+                    "status": 400,
+                    "body": f"'format' param must be one of {list(RESPONSE_FORMATS)}.",
+                }
+            ),
+        }
+
+    def build_body():
+        rows = run_table_query(player, start_time, end_time, selection=selection)
+        # anything but an iterator of rows is an error response
+        if response_format == "columnar" and isinstance(rows, Iterator):
+            rows = to_columns(rows, selection)
+        return dump_json(rows, cls=CustomEncoder)
+
+    body = cached_body(
+        "v0",
+        player,
+        start_time,
+        end_time,
+        build_body,
+        selection=selection,
+        format=response_format,
+    )
+    logger.info(f"Responding with {len(body)} characters.")
 
     return {
         "statusCode": 200,
-        "body": json.dumps(query_response, cls=CustomEncoder),
+        "body": body,
     }
 
 
@@ -164,23 +334,37 @@ def handle_legacy(event, context):
     parsed_fields = parse_query_str(original_sql)
     logger.info(f"Parsed fields: {parsed_fields}")
 
-    query_result = run_table_query(
-        parsed_fields["player"],
-        parsed_fields["start_time"],
-        parsed_fields["end_time"],
-        category=parsed_fields["category"],
+    selection = select(
         skills=parsed_fields["skills"],
+        activities=[],
+        fields=[parsed_fields["category"]],
     )
 
-    logger.info(f"Received query result: {query_result}")
-    formatted_query_result = format_legacy_response(
-        query_result, parsed_fields["skills"], parsed_fields["category"]
-    )
+    def build_body():
+        query_result = run_table_query(
+            parsed_fields["player"],
+            parsed_fields["start_time"],
+            parsed_fields["end_time"],
+            selection=selection,
+        )
+
+        formatted_query_result = format_legacy_response(
+            query_result, parsed_fields["skills"], parsed_fields["category"]
+        )
+
+        logger.info(f"Formatted query result: '{formatted_query_result}'")
+        return json.dumps(formatted_query_result, cls=CustomEncoder)
 
-    logger.info(f"Formatted query result: '{formatted_query_result}'")
     return {
         "statusCode": 200,
-        "body": json.dumps(formatted_query_result, cls=CustomEncoder),
+        "body": cached_body(
+            "legacy",
+            parsed_fields["player"],
+            parsed_fields["start_time"],
+            parsed_fields["end_time"],
+            build_body,
+            selection=selection,
+        ),
         "headers": {
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Methods": "GET",
@@ -0,0 +1,271 @@
+"""Read-through cache of query API responses.
+
+Encoded responses are kept in an in-process LRU that survives warm invocations,
+in front of an optional backend shared by every container. Entries expire after
+a TTL given when they are stored, or never, for responses that cannot change.
+
+"""
+import abc
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Callable, NamedTuple, Optional
+
+from hiscores_common.lib.table.keys import QUERY_CACHE_PARTITION
+
+logger = logging.getLogger()
+
+CLOSED_TTL_SECS = 24 * 60 * 60
+"""How long shared backends keep entries that never expire, so that the
+entries of players or queries no longer asked for are eventually removed."""
+
+
+class CacheEntry(NamedTuple):
+    """A cached response, with its expiry in epoch seconds."""
+
+    value: str
+    expires_at: Optional[float] = None
+    """When the entry expires, or `None` if it never does."""
+
+
+class CacheBackend(abc.ABC):
+    """Storage of cache entries by key."""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Get the entry of a key, or `None`; it may have expired."""
+
+    @abc.abstractmethod
+    def set(self, key: str, entry: CacheEntry):
+        """Store the entry of a key, replacing any other."""
+
+
+class LRUCacheBackend(CacheBackend):
+    """Entries of one process, evicting the least recently used beyond
+    `max_entries` entries or `max_bytes` characters of values.
+
+    Examples:
+    >>> cache = LRUCacheBackend(max_entries=2)
+    >>> for key in "abc":
+    ...     cache.set(key, CacheEntry(key.upper()))
+    >>> cache.get("a"), cache.get("c")
+    (None, CacheEntry(value='C', expires_at=None))
+
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 32 * 2**20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry):
+        if len(entry.value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key).value)
+            self._entries[key] = entry
+            self.size += len(entry.value)
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self.size -= len(self._entries.popitem(last=False)[1].value)
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Entries shared by every process using the same SQLite database file.
+
+    A local stand-in for a distributed store.
+
+    """
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(
+            path, timeout=30.0, isolation_level=None, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+        )
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        return None if row is None else CacheEntry(*row)
+
+    def set(self, key: str, entry: CacheEntry):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, *entry)
+            )
+
+
+class DynamoCacheBackend(CacheBackend):
+    """Entries shared by every container through items of the HiScores table.
+
+    Keys are hashed into sort keys of `QUERY_CACHE_PARTITION`. Values too large
+    for an item are not stored. Expired items are ignored, and removed by
+    DynamoDB if time to live is enabled on the `expiresAt` attribute. Entries
+    that never expire are stored for `closed_ttl_secs`, so the table does not
+    grow with every query ever made.
+
+    """
+
+    def __init__(
+        self,
+        table,
+        max_bytes: int = 350_000,
+        closed_ttl_secs: float = CLOSED_TTL_SECS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._table = table
+        self.max_bytes = max_bytes
+        self.closed_ttl_secs = closed_ttl_secs
+        self._clock = clock
+
+    @staticmethod
+    def _key(key: str) -> dict:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return {"player": QUERY_CACHE_PARTITION, "timestamp": digest}
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        item = self._table.get_item(Key=self._key(key)).get("Item")
+        if item is None:
+            return None
+        expires_at = item.get("expiresAt")
+        return CacheEntry(
+            item["value"], None if expires_at is None else float(expires_at)
+        )
+
+    def set(self, key: str, entry: CacheEntry):
+        if len(entry.value.encode()) > self.max_bytes:
+            return
+        expires_at = entry.expires_at
+        if expires_at is None:
+            expires_at = self._clock() + self.closed_ttl_secs
+        item = dict(
+            self._key(key), value=entry.value, expiresAt=Decimal(int(expires_at) + 1)
+        )
+        self._table.put_item(Item=item)
+
+
+class QueryCache(object):
+    """Read-through cache of responses, in an in-process LRU in front of an
+    optional shared backend.
+
+    Entries read from the shared backend are copied into the LRU, with the
+    same expiry. Failures of the shared backend are logged and treated as
+    misses, so they never fail a request.
+
+    Examples:
+    >>> cache = QueryCache(clock=lambda: 0)
+    >>> cache.get_or_build("key", lambda: "built", ttl_secs=60)
+    'built'
+    >>> cache.get_or_build("key", lambda: "rebuilt", ttl_secs=60)
+    'built'
+    >>> cache.hits, cache.misses
+    (1, 1)
+
+    """
+
+    def __init__(
+        self,
+        local: Optional[LRUCacheBackend] = None,
+        shared: Optional[CacheBackend] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.local = LRUCacheBackend() if local is None else local
+        self.shared = shared
+        self._clock = clock
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, entry: Optional[CacheEntry]) -> bool:
+        return entry is not None and (
+            entry.expires_at is None or entry.expires_at > self._clock()
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        """Get the cached value of a key, unless it is missing or expired."""
+        entry = self.local.get(key)
+        if not self._fresh(entry) and self.shared is not None:
+            try:
+                entry = self.shared.get(key)
+            except Exception:
+                logger.exception("Failed to read from the shared query cache.")
+                entry = None
+            if self._fresh(entry):
+                self.local.set(key, entry)
+        return entry.value if self._fresh(entry) else None
+
+    def set(self, key: str, value: str, ttl_secs: Optional[float] = None):
+        """Cache the value of a key for `ttl_secs`, or until it is evicted."""
+        expires_at = None if ttl_secs is None else self._clock() + ttl_secs
+        entry = CacheEntry(value, expires_at)
+        self.local.set(key, entry)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, entry)
+            except Exception:
+                logger.exception("Failed to write to the shared query cache.")
+
+    def get_or_build(
+        self, key: str, build: Callable[[], str], ttl_secs: Optional[float] = None
+    ) -> str:
+        """Get the cached value of a key, or build and cache it."""
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = build()
+        self.set(key, value, ttl_secs)
+        return value
+
+
+def get_query_cache(spec: str, table=None, **kwargs) -> Optional[QueryCache]:
+    """Build a query cache from a spec of the form `none`, `memory`,
+    `sqlite:<path>` or `dynamodb`.
+
+    Every cache but `none` keeps an in-process LRU, built with the additional
+    keyword arguments; the others add a shared backend behind it.
+
+    Examples:
+    >>> get_query_cache("none")
+    >>> get_query_cache("memory", max_entries=3).local.max_entries
+    3
+    >>> get_query_cache("redis")
+    Traceback (most recent call last):
+    ...
+    ValueError: Unsupported query cache backend 'redis'.
+
+    """
+    backend, _, arg = spec.partition(":")
+    if backend == "none":
+        return None
+    if backend == "memory":
+        return QueryCache(LRUCacheBackend(**kwargs))
+    if backend == "sqlite":
+        return QueryCache(LRUCacheBackend(**kwargs), SQLiteCacheBackend(arg))
+    if backend == "dynamodb":
+        if table is None:
+            raise ValueError("The dynamodb query cache requires a table.")
+        return QueryCache(LRUCacheBackend(**kwargs), DynamoCacheBackend(table))
+    raise ValueError(f"Unsupported query cache backend '{spec}'.")
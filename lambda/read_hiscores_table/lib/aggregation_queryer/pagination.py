@@ -0,0 +1,152 @@
+"""Complete reads of ranges of a player's rows, across pages and sub-ranges.
+
+A single `Query` returns at most 1 MB of items, and a `LastEvaluatedKey` to
+continue from. Ranges are read to completion, or up to a limit, and wide ranges
+are split into sub-ranges of sort keys (see `util.split_key_range`) that are
+read concurrently and merged back in order. Pages are yielded as they arrive,
+so a reader that handles them one at a time holds at most a page per range
+being read.
+
+"""
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+SORT_KEY = "timestamp"
+
+
+def iter_pages(
+    query: Callable[..., dict], limit: Optional[int] = None
+) -> Iterator[List[dict]]:
+    """Get the pages of a query, following `LastEvaluatedKey`, up to its first
+    `limit` items.
+
+    Args:
+        query (Callable): Get one page of the query, given any of `Limit` and
+            `ExclusiveStartKey`.
+        limit (int): Most items to get.
+
+    Examples:
+    >>> pages = {None: {"Items": [1, 2], "LastEvaluatedKey": 2}, 2: {"Items": [3]}}
+    >>> list(iter_pages(lambda ExclusiveStartKey=None, **kwargs: pages[ExclusiveStartKey]))
+    [[1, 2], [3]]
+
+    """  # noqa: E501
+    count = 0
+    kwargs = dict()
+    while limit is None or count < limit:
+        if limit is not None:
+            kwargs["Limit"] = limit - count
+        response = query(**kwargs)
+        page = (
+            response["Items"] if limit is None else response["Items"][: limit - count]
+        )
+        count += len(page)
+        yield page
+        if "LastEvaluatedKey" not in response:
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def query_all(query: Callable[..., dict], limit: Optional[int] = None) -> List[dict]:
+    """Get every item of a query, or only its first `limit` items, as read by
+    `iter_pages`."""
+    return [item for page in iter_pages(query, limit) for item in page]
+
+
+def iter_segments(
+    query: Callable[..., dict],
+    segments: Sequence[Tuple[str, str]],
+    limit: Optional[int] = None,
+    max_workers: int = 1,
+) -> Iterator[List[dict]]:
+    """Get the pages of consecutive, inclusive ranges of sort keys, in order.
+
+    Adjacent ranges share their boundary key, whose items are only kept in the
+    later range. With a `limit`, ranges are read one after another until it is
+    reached. Otherwise up to `max_workers` pages are read at once: the next page
+    of the range being yielded, and the first pages of the ranges after it.
+
+    Args:
+        query (Callable): Get one page of a range, given its low and high sort
+            keys, and any of `Limit` and `ExclusiveStartKey`.
+        segments (list): Low and high sort keys of each range, in order.
+        limit (int): Most items to get.
+        max_workers (int): Most pages to read at once.
+
+    Examples:
+    >>> items = [{"timestamp": t} for t in "abcde"]
+    >>> query = lambda low, high, **kwargs: {
+    ...     "Items": [item for item in items if low <= item["timestamp"] <= high]
+    ... }
+    >>> list(iter_segments(query, [("a", "c"), ("c", "e")], max_workers=2))
+    [[{'timestamp': 'a'}, {'timestamp': 'b'}], [{'timestamp': 'c'}, {'timestamp': 'd'}, {'timestamp': 'e'}]]
+
+    """  # noqa: E501
+
+    def trim(i, items):
+        if i == len(segments) - 1:
+            return items
+        return [item for item in items if item[SORT_KEY] != segments[i][1]]
+
+    if limit is not None or max_workers <= 1 or len(segments) <= 1:
+        count = 0
+        for i, (low, high) in enumerate(segments):
+            remaining = None if limit is None else limit - count
+            if remaining == 0:
+                return
+            for page in iter_pages(functools.partial(query, low, high), remaining):
+                page = trim(i, page)[:remaining]
+                count += len(page)
+                if remaining is not None:
+                    remaining -= len(page)
+                yield page
+        return
+
+    def read_page(i, **kwargs):
+        response = query(*segments[i], **kwargs)
+        return trim(i, response["Items"]), response.get("LastEvaluatedKey")
+
+    with ThreadPoolExecutor(max_workers) as pool:
+        firsts = {
+            i: pool.submit(read_page, i) for i in range(min(max_workers, len(segments)))
+        }
+        for i in range(len(segments)):
+            future = firsts.pop(i)
+            if (
+                i + max_workers - 1 < len(segments)
+                and i + max_workers - 1 not in firsts
+            ):
+                firsts[i + max_workers - 1] = pool.submit(
+                    read_page, i + max_workers - 1
+                )
+            while future is not None:
+                page, last_key = future.result()
+                future = None
+                if last_key is not None:
+                    future = pool.submit(read_page, i, ExclusiveStartKey=last_key)
+                yield page
+
+
+def query_segments(
+    query: Callable[..., dict],
+    segments: Sequence[Tuple[str, str]],
+    limit: Optional[int] = None,
+    max_workers: int = 1,
+) -> List[dict]:
+    """Get every item of consecutive, inclusive ranges of sort keys, in order,
+    as read by `iter_segments`.
+
+    Examples:
+    >>> items = [{"timestamp": t} for t in "abcde"]
+    >>> query = lambda low, high, **kwargs: {
+    ...     "Items": [item for item in items if low <= item["timestamp"] <= high]
+    ... }
+    >>> [item["timestamp"] for item in query_segments(query, [("a", "c"), ("c", "e")])]
+    ['a', 'b', 'c', 'd', 'e']
+    >>> len(query_segments(query, [("a", "c"), ("c", "e")], limit=4))
+    4
+
+    """  # noqa: E501
+    pages = iter_segments(query, segments, limit=limit, max_workers=max_workers)
+    return [item for page in pages for item in page]
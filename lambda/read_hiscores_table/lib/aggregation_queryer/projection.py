@@ -0,0 +1,198 @@
+"""Selections of the skills, activities and fields of query responses.
+
+A selection is pushed down into table reads as a `ProjectionExpression`, so
+only the selected leaves of nested and flat (atomically updated) items are
+read, and items are trimmed to it while linted, as packed items and delta bases
+still hold every leaf.
+
+Selections map each stats attribute to the selected rows and, for each row,
+the selected columns, all in schema order so that equal selections are equal.
+
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from hiscores_common.lib.snapshot.codec import PACKED_ATTRIBUTE
+from hiscores_common.lib.snapshot.constants import (
+    HISCORE_RESPONSE_ACTIVITY_COLS,
+    HISCORES_RESPONSE_ACTIVITIES,
+    HISCORES_RESPONSE_SKILL_COLS,
+    HISCORES_RESPONSE_SKILLS,
+)
+from hiscores_common.lib.snapshot.delta import BASE_ATTRIBUTE
+from hiscores_common.lib.snapshot.rollup import (
+    DIVISOR_ATTRIBUTE,
+    WATERMARK_ATTRIBUTE,
+    flat_name,
+)
+
+Selection = Dict[str, Dict[str, Tuple[str, ...]]]
+
+SCHEMA = {
+    "skills": (HISCORES_RESPONSE_SKILLS, HISCORES_RESPONSE_SKILL_COLS),
+    "activities": (HISCORES_RESPONSE_ACTIVITIES, HISCORE_RESPONSE_ACTIVITY_COLS),
+}
+"""Rows and columns of each stats attribute."""
+
+KEPT_ATTRIBUTES = (
+    "player",
+    DIVISOR_ATTRIBUTE,
+    WATERMARK_ATTRIBUTE,
+    PACKED_ATTRIBUTE,
+    BASE_ATTRIBUTE,
+)
+"""Attributes read with any selection, besides `timestamp`."""
+
+SELECT_ALL: Selection = {
+    attribute: {row: tuple(cols) for row in rows}
+    for attribute, (rows, cols) in SCHEMA.items()
+}
+"""Selection of every leaf."""
+
+
+def _check(kind: str, names: Iterable[str], known: Iterable[str]):
+    unknown = sorted(set(names) - set(known))
+    if unknown:
+        raise ValueError(f"Unknown {kind} {unknown}.")
+
+
+def select(
+    skills: Optional[Iterable[str]] = None,
+    activities: Optional[Iterable[str]] = None,
+    fields: Optional[Iterable[str]] = None,
+) -> Optional[Selection]:
+    """Select skills, activities and fields of responses.
+
+    Given neither `skills` nor `activities`, every skill and activity is
+    selected; given either, only the rows given. Every field of the selected
+    rows is selected unless `fields` are given.
+
+    Args:
+        skills (list): Names of skills, or `None`.
+        activities (list): Names of activities, or `None`.
+        fields (list): Columns, such as `xp` or `kc`, or `None`.
+
+    Returns:
+        dict: The selection, or `None` if it selects every leaf.
+
+    Raises:
+        ValueError: if a skill, activity or field does not exist.
+
+    Examples:
+    >>> select(skills=["Magic"], fields=["xp", "kc"])
+    {'skills': {'Magic': ('xp',)}, 'activities': {}}
+    >>> select(fields=["kc"])["activities"]["Zulrah"]
+    ('kc',)
+    >>> select()
+    >>> select(skills=["Sorcery"])
+    Traceback (most recent call last):
+    ...
+    ValueError: Unknown skills ['Sorcery'].
+
+    """
+    if skills is None and activities is None and fields is None:
+        return None
+    every_row = skills is None and activities is None
+    if fields is not None:
+        fields = set(fields)
+        _check("fields", fields, {col for _, cols in SCHEMA.values() for col in cols})
+    selection = dict()
+    for attribute, names in (("skills", skills), ("activities", activities)):
+        rows, cols = SCHEMA[attribute]
+        names = set(rows if every_row else names or ())
+        _check(attribute, names, rows)
+        selected = tuple(col for col in cols if fields is None or col in fields)
+        selection[attribute] = {
+            row: selected for row in rows if selected and row in names
+        }
+    return None if selection == SELECT_ALL else selection
+
+
+def selected_leaves(selection: Optional[Selection]) -> List[Tuple[str, str, str]]:
+    """Get the paths of the leaves of a selection, or of every leaf, in order.
+
+    Examples:
+    >>> selected_leaves({"skills": {"Magic": ("lvl", "xp")}, "activities": {}})
+    [('skills', 'Magic', 'lvl'), ('skills', 'Magic', 'xp')]
+    >>> len(selected_leaves(None))
+    236
+
+    """
+    return [
+        (attribute, row, col)
+        for attribute, rows in (SELECT_ALL if selection is None else selection).items()
+        for row, cols in rows.items()
+        for col in cols
+    ]
+
+
+def projection(selection: Optional[Selection], flat: bool = True) -> dict:
+    """Build the keyword arguments projecting table reads onto a selection.
+
+    Every name is substituted by a placeholder, as some, such as `base`, are
+    reserved words. Rows whose columns are all selected are read whole. With
+    `flat`, the flat leaves of atomically updated rollups are read too.
+
+    Examples:
+    >>> kwargs = projection({"skills": {"Magic": ("xp",)}, "activities": {}})
+    >>> kwargs["ProjectionExpression"]
+    '#k0,#k1,#k2,#k3,#k4,#t,#a0.#r0.#c0,#f0'
+    >>> kwargs["ExpressionAttributeNames"]["#f0"]
+    'skills.Magic.xp'
+    >>> projection(None)
+    {}
+
+    """
+    if selection is None:
+        return dict()
+    names = {"#t": "timestamp"}
+    placeholders = {prefix: dict() for prefix in "karcf"}
+
+    def placeholder(prefix, name):
+        by_name = placeholders[prefix]
+        if name not in by_name:
+            by_name[name] = f"#{prefix}{len(by_name)}"
+            names[by_name[name]] = name
+        return by_name[name]
+
+    kept = [placeholder("k", name) for name in KEPT_ATTRIBUTES]
+    nested, flats = [], []
+    for attribute, rows in selection.items():
+        all_cols = tuple(SCHEMA[attribute][1])
+        for row, cols in rows.items():
+            path = f"{placeholder('a', attribute)}.{placeholder('r', row)}"
+            if cols == all_cols:
+                nested.append(path)
+            else:
+                nested.extend(f"{path}.{placeholder('c', col)}" for col in cols)
+            if flat:
+                flats.extend(
+                    placeholder("f", flat_name(attribute, row, col)) for col in cols
+                )
+    return dict(
+        ProjectionExpression=",".join([*kept, "#t", *nested, *flats]),
+        ExpressionAttributeNames=names,
+    )
+
+
+def trim_item(item: dict, selection: Optional[Selection]) -> dict:
+    """Trim the nested stats of an item to a selection, in place, dropping
+    attributes left without rows.
+
+    Examples:
+    >>> item = {"timestamp": "t", "skills": {"Magic": {"rnk": 1, "xp": 2}}}
+    >>> trim_item(item, {"skills": {"Magic": ("xp",)}, "activities": {}})
+    {'timestamp': 't', 'skills': {'Magic': {'xp': 2}}}
+
+    """
+    if selection is None:
+        return item
+    for attribute, rows in selection.items():
+        stats = item.pop(attribute, None) or dict()
+        trimmed = {
+            row: {col: stats[row][col] for col in cols if col in stats[row]}
+            for row, cols in rows.items()
+            if row in stats
+        }
+        if trimmed:
+            item[attribute] = trimmed
+    return item
@@ -1,19 +1,65 @@
 import decimal
 import enum
+import io
 import json
-from datetime import datetime
+import logging
+import math
+from typing import Iterator
 
-DAILY_SENTINEL = "Daily#"
-MONTHLY_SENTINEL = "Monthly#"
-TIMESTAMP_FMT = "%Y-%m-%d %H:%M:%S"
-DATE_FMT = "%Y-%m-%d"
-MONTH_FMT = MONTH = "%Y-%m"
+from hiscores_common.lib.snapshot.codec import decode_snapshot
+from hiscores_common.lib.snapshot.delta import BASE_ATTRIBUTE, apply_delta, is_delta
+from hiscores_common.lib.snapshot.rollup import (
+    WATERMARK_ATTRIBUTE,
+    flat_name,
+    merge_flat_leaves,
+)
+from hiscores_common.lib.table.bucketing import (
+    DATE_FMT,
+    MONTH_FMT,
+    TIMESTAMP_FMT,
+    format_timestamp,
+    parse,
+)
+from hiscores_common.lib.table.tiers import (
+    DAILY,
+    HOURLY,
+    MONTHLY,
+    TIERS,
+    WEEKLY,
+    YEARLY,
+)
+from read_hiscores_table.lib.aggregation_queryer.projection import (
+    selected_leaves,
+    trim_item,
+)
+
+logger = logging.getLogger()
+
+HOURLY_SENTINEL = HOURLY.sentinel
+DAILY_SENTINEL = DAILY.sentinel
+WEEKLY_SENTINEL = WEEKLY.sentinel
+MONTHLY_SENTINEL = MONTHLY.sentinel
+YEARLY_SENTINEL = YEARLY.sentinel
+MONTH = MONTH_FMT
 
 
 class AggregationLevel(enum.Enum):
     NONE = 0
     DAILY = 1
     MONTHLY = 2
+    HOURLY = 3
+    WEEKLY = 4
+    YEARLY = 5
+
+
+LEVEL_TIERS = {
+    AggregationLevel.HOURLY: HOURLY,
+    AggregationLevel.DAILY: DAILY,
+    AggregationLevel.WEEKLY: WEEKLY,
+    AggregationLevel.MONTHLY: MONTHLY,
+    AggregationLevel.YEARLY: YEARLY,
+}
+"""Rollup tier read for each aggregation level, from finest to coarsest."""
 
 
 class CustomEncoder(json.JSONEncoder):
@@ -28,34 +74,85 @@ class CustomEncoder(json.JSONEncoder):
 
 
 def valid_datetime(date_string, format):
-    """Check if a string is a valid datetime."""
+    """Check if a string is a valid datetime.
+
+    Examples:
+    >>> valid_datetime("2021-12-17", DATE_FMT)
+    datetime.datetime(2021, 12, 17, 0, 0)
+    >>> valid_datetime("2021-12-17", MONTH_FMT)
+
+    """
     try:
-        return datetime.strptime(date_string, format)
+        return parse(date_string, (format,))
     except ValueError:
         return None
 
 
 def convert_timestamp(timestamp, fmts):
     """Convert a timestamp to an aggregation boundary."""
-    for fmt in fmts:
-        dt = valid_datetime(timestamp, fmt)
-        if dt is not None:
-            return dt.strftime(fmts[-1])
-    raise ValueError(f"Timestamp {timestamp} must be one of {fmts}")
+    try:
+        dt = parse(timestamp, fmts)
+    except ValueError:
+        raise ValueError(f"Timestamp {timestamp} must be one of {fmts}")
+    return dt.strftime(fmts[-1])
 
 
-def timestamp_to_date(timestamp):
-    """Parse a date from a timestamp."""
-    return convert_timestamp(timestamp, [TIMESTAMP_FMT, DATE_FMT])
+def plan_aggregation_level(
+    span_secs,
+    tiers=(DAILY, MONTHLY),
+    target_points=100,
+    raw_period_secs=1800,
+    overshoot_cost=2.0,
+):
+    """Pick the aggregation level whose row count for a range is nearest
+    `target_points`, among raw rows and the available tiers.
 
+    Row counts are compared by their log ratio to the target, so that reading
+    twice as many rows is as far as reading half as many, except that reading
+    too many rows costs `overshoot_cost` times as much. Ties go to the finer
+    level.
 
-def timestamp_to_month(timestamp):
-    """Parse a month from a timestamp."""
-    return convert_timestamp(timestamp, [TIMESTAMP_FMT, DATE_FMT, MONTH_FMT])
+    Args:
+        span_secs (float): Length of the queried range.
+        tiers (Iterable[RollupTier]): Rollup tiers maintained by the aggregator.
+        target_points (int): Number of rows per player to aim for.
+        raw_period_secs (float): Interval between raw snapshots of a player.
+        overshoot_cost (float): Weight of reading too many rows rather than
+            too few.
 
+    Examples:
+    >>> plan_aggregation_level(3 * 86400)
+    <AggregationLevel.NONE: 0>
+    >>> plan_aggregation_level(14 * 86400)
+    <AggregationLevel.DAILY: 1>
+    >>> plan_aggregation_level(3 * 86400, tiers=LEVEL_TIERS.values())
+    <AggregationLevel.HOURLY: 3>
+    >>> plan_aggregation_level(5 * 365 * 86400, tiers=[], target_points=10)
+    <AggregationLevel.NONE: 0>
+
+    """
+    tiers = list(tiers)
+    candidates = [(AggregationLevel.NONE, raw_period_secs)] + [
+        (level, tier.period_secs)
+        for level, tier in LEVEL_TIERS.items()
+        if tier in tiers
+    ]
 
-def infer_aggregation_level(start_time, end_time):
-    """Infer an aggregation level from startTime and endTime parameters"""
+    def distance(candidate):
+        points = max(span_secs, 1) / candidate[1]
+        ratio = math.log(points / target_points)
+        return ratio * overshoot_cost if ratio > 0 else -ratio
+
+    # `min` keeps the first, finest, of equally near levels
+    return min(candidates, key=distance)[0]
+
+
+def infer_aggregation_level(start_time, end_time, **kwargs):
+    """Infer an aggregation level from startTime and endTime parameters.
+
+    Keyword arguments are forwarded to `plan_aggregation_level`.
+
+    """
     # If dates aren't specified, use MONTHLY aggregation
     if valid_datetime(start_time, MONTH_FMT) and valid_datetime(end_time, MONTH_FMT):
         return AggregationLevel.MONTHLY
@@ -64,37 +161,102 @@ def infer_aggregation_level(start_time, end_time):
     if valid_datetime(start_time, DATE_FMT) and valid_datetime(end_time, DATE_FMT):
         return AggregationLevel.DAILY
 
-    # If times are > 6 months apart, use MONTHLY aggregation
+    # else, keep the number of rows read near a target
     start_dt = valid_datetime(start_time, TIMESTAMP_FMT)
     end_dt = valid_datetime(end_time, TIMESTAMP_FMT)
-    if (end_dt - start_dt).days >= 180:
-        return AggregationLevel.MONTHLY
+    return plan_aggregation_level((end_dt - start_dt).total_seconds(), **kwargs)
 
-    # If times are > 1 week apart, use DAILY aggregation
-    if (end_dt - start_dt).days >= 7:
-        return AggregationLevel.DAILY
 
-    # else, use NONE aggregation
-    return AggregationLevel.NONE
+def parse_time(timestamp):
+    """Parse a timestamp, date or month.
+
+    Examples:
+    >>> parse_time("2021-12")
+    datetime.datetime(2021, 12, 1, 0, 0)
+
+    """
+    try:
+        return parse(timestamp, (TIMESTAMP_FMT, DATE_FMT, MONTH_FMT))
+    except ValueError:
+        raise ValueError(f"Timestamp {timestamp} must be a timestamp, date or month.")
 
 
 def get_query_boundaries(start_time, end_time, aggregation_level=AggregationLevel.NONE):
-    """Get start and end sort keys for table query."""
+    """Get start and end sort keys for table query.
+
+    Examples:
+    >>> get_query_boundaries(
+    ...     "2021-12-17 20:41:59", "2022-01-03", AggregationLevel.WEEKLY
+    ... )
+    ('Weekly#2021-12-13', 'Weekly#2022-01-03')
+
+    """
 
     if aggregation_level == AggregationLevel.NONE:
         return start_time, end_time
-    elif aggregation_level == AggregationLevel.DAILY:
-        return (
-            f"{DAILY_SENTINEL}{timestamp_to_date(start_time)}",
-            f"{DAILY_SENTINEL}{timestamp_to_date(end_time)}",
-        )
-    elif aggregation_level == AggregationLevel.MONTHLY:
-        return (
-            f"{MONTHLY_SENTINEL}{timestamp_to_month(start_time)}",
-            f"{MONTHLY_SENTINEL}{timestamp_to_month(end_time)}",
-        )
-    else:
+    if aggregation_level not in LEVEL_TIERS:
         raise ValueError(f"Unsupported aggregation_level '{aggregation_level}.")
+    tier = LEVEL_TIERS[aggregation_level]
+    return tier.key(parse_time(start_time)), tier.key(parse_time(end_time))
+
+
+def range_closed(high, aggregation_level, now):
+    """Whether every row up to the sort key `high` is final at `now`.
+
+    Raw rows never change once written, and a rollup row changes until its
+    bucket ends.
+
+    Examples:
+    >>> from datetime import datetime
+    >>> now = datetime(2021, 12, 17, 20, 41, 59)
+    >>> range_closed("Daily#2021-12-16", AggregationLevel.DAILY, now)
+    True
+    >>> range_closed("Monthly#2021-12", AggregationLevel.MONTHLY, now)
+    False
+    >>> range_closed("2021-12-17", AggregationLevel.NONE, now)
+    True
+
+    """
+    if aggregation_level == AggregationLevel.NONE:
+        return format_timestamp(now) > high
+    if aggregation_level not in LEVEL_TIERS:
+        raise ValueError(f"Unsupported aggregation_level '{aggregation_level}.")
+    return LEVEL_TIERS[aggregation_level].key(now) > high
+
+
+def split_key_range(low, high, raw_period_secs, rows_per_segment, max_segments):
+    """Split an inclusive range of sort keys into consecutive sub-ranges of
+    about `rows_per_segment` rows each, and at most `max_segments` of them.
+
+    Rollup keys hold a row per bucket of their tier, and raw timestamps a row
+    per `raw_period_secs`. Adjacent sub-ranges share their boundary key, which
+    belongs to the later one. Ranges of keys that are not times, or too short
+    to split, are returned whole.
+
+    Examples:
+    >>> split_key_range("Daily#2021-01-01", "Daily#2021-12-31", 1800, 100, 3)
+    [('Daily#2021-01-01', 'Daily#2021-05-02'), ('Daily#2021-05-02', 'Daily#2021-08-31'), ('Daily#2021-08-31', 'Daily#2021-12-31')]
+    >>> split_key_range("2021-12-17", "2021-12-18", 1800, 24, 8)
+    [('2021-12-17', '2021-12-17 12:00:00'), ('2021-12-17 12:00:00', '2021-12-18')]
+
+    """  # noqa: E501
+    tier = next((t for t in TIERS.values() if low.startswith(t.sentinel)), None)
+    try:
+        if tier is None:
+            start, end, key = parse_time(low), parse_time(high), format_timestamp
+        else:
+            start, end, key = tier.bucket_start(low), tier.bucket_start(high), tier.key
+    except ValueError:
+        return [(low, high)]
+    period_secs = raw_period_secs if tier is None else tier.period_secs
+    rows = (end - start).total_seconds() / period_secs
+    count = min(max_segments, math.ceil(rows / rows_per_segment))
+    if count <= 1:
+        return [(low, high)]
+    step = (end - start) / count
+    points = sorted({key(start + i * step) for i in range(1, count)})
+    bounds = [low] + [point for point in points if low < point < high] + [high]
+    return list(zip(bounds, bounds[1:]))
 
 
 def normalize_nested_dict(d, denom):
@@ -115,24 +277,213 @@ def normalize_nested_dict(d, denom):
     return result
 
 
-def lint_items(items, aggregation_level):
-    """Lint items returned from HiScores Table Query."""
-    result = list()
+def resolve_deltas(items, get_base):
+    """Rebuild full snapshots from delta items, lazily, in order.
+
+    Deltas reference the latest full snapshot written before them, so only the
+    latest base is kept: the last full snapshot among `items`, or else the last
+    one fetched with `get_base(timestamp)`. Deltas whose base cannot be fetched,
+    as `get_base` returns `None`, are logged and skipped.
+
+    Examples:
+    >>> items = [
+    ...     {"timestamp": "t0", "skills": {"Magic": {"xp": 2}}},
+    ...     {"timestamp": "t1", "base": "t0", "skills": {"Magic": {"xp": 3}}},
+    ...     {"timestamp": "t2", "base": "t0"},
+    ... ]
+    >>> list(resolve_deltas(items, get_base=None))
+    [{'timestamp': 't0', 'skills': {'Magic': {'xp': 2}}}, {'timestamp': 't1', 'skills': {'Magic': {'xp': 3}}}, {'timestamp': 't2', 'skills': {'Magic': {'xp': 2}}}]
+
+    """  # noqa: E501
+    base_timestamp, base = None, None
     for item in items:
-        if aggregation_level == AggregationLevel.NONE:
-            # If no aggregation, no action needed
-            pass
-        elif aggregation_level in [AggregationLevel.DAILY, AggregationLevel.MONTHLY]:
-            item["timestamp"] = item["timestamp"].split("#")[1]
-            divisor = item.pop("divisor")
-            if "skills" in item:
-                item["skills"] = normalize_nested_dict(item["skills"], divisor)
-            if "activities" in item:
-                item["activities"] = normalize_nested_dict(item["activities"], divisor)
+        item = decode_snapshot(item)
+        if not is_delta(item):
+            base_timestamp, base = item["timestamp"], item
         else:
-            raise ValueError(f"Unsupported aggregation_level '{aggregation_level}.")
+            if item[BASE_ATTRIBUTE] != base_timestamp:
+                base_timestamp = item[BASE_ATTRIBUTE]
+                base = get_base(base_timestamp)
+                base = None if base is None else decode_snapshot(base)
+            if base is None:
+                logger.warning(
+                    f"Skipping delta '{item['timestamp']}' of missing base "
+                    f"'{base_timestamp}'."
+                )
+                continue
+            item = apply_delta(base, item)
+        yield item
+
 
-        item["aggregationLevel"] = aggregation_level
-        result.append(item)
+def add_nested_dicts(a, b):
+    """Add the numbers of two nested dicts, treating missing keys as zero.
 
+    Examples:
+    >>> add_nested_dicts({"a": 1, "b": {"c": 2}}, {"b": {"c": 3, "d": 4}})
+    {'a': 1, 'b': {'c': 5, 'd': 4}}
+
+    """
+    result = dict(a)
+    for key, value in b.items():
+        if isinstance(value, dict):
+            result[key] = add_nested_dicts(result.get(key, dict()), value)
+        else:
+            result[key] = result.get(key, 0) + value
     return result
+
+
+def complete_rollups(items, tier, sources, start, end, query_rows, _is_new=None):
+    """Add rows of finer tiers that are not rolled up yet to rows of `tier`.
+
+    With hierarchical rollups, a row is only added to the rows derived from it
+    once it is final, so the latest derived rows lag behind. The rows of the
+    source tier newer than the latest watermark among `items` are fetched with
+    `query_rows(low_key, high_key)`, completed in turn if the source is
+    itself derived, and added in.
+
+    Args:
+        items (list): Rows of `tier` between `start` and `end`.
+        tier (RollupTier): Tier of `items`.
+        sources (dict): Tier each derived tier is derived from, by name.
+        start (datetime): Start of the queried range.
+        end (datetime): End of the queried range.
+        query_rows (Callable): Get the rows between two sort keys, inclusive.
+
+    Returns:
+        list: Completed rows of `tier`, sorted by timestamp.
+
+    """
+    source = sources.get(tier.name)
+    if source is None:
+        return items
+    items = [merge_flat_leaves(item) for item in items]
+    watermark = max((item.get(WATERMARK_ATTRIBUTE, "") for item in items), default="")
+    start = tier.bucket_start(tier.key(start))
+    if watermark:
+        start = max(start, source.bucket_start(watermark))
+
+    def is_new(key):
+        """Whether a row of `source` is not yet included in a row of `tier`."""
+        return key > watermark and (
+            _is_new is None or _is_new(tier.key(source.bucket_start(key)))
+        )
+
+    pending = [
+        row
+        for row in query_rows(source.key(start), source.key(end))
+        if is_new(row["timestamp"])
+    ]
+    pending = complete_rollups(pending, source, sources, start, end, query_rows, is_new)
+
+    by_timestamp = {item["timestamp"]: item for item in items}
+    for row in pending:
+        timestamp = tier.key(source.bucket_start(row["timestamp"]))
+        rollup = by_timestamp.get(
+            timestamp, {"player": row["player"], "timestamp": timestamp}
+        )
+        row = {
+            key: value
+            for key, value in row.items()
+            if key not in ("player", "timestamp", WATERMARK_ATTRIBUTE)
+        }
+        by_timestamp[timestamp] = add_nested_dicts(rollup, row)
+    return [by_timestamp[timestamp] for timestamp in sorted(by_timestamp)]
+
+
+def lint_item(item, aggregation_level, selection=None):
+    """Lint an item returned from HiScores Table Query.
+
+    Packed items, and the flat leaves of atomically updated rollups, are
+    expanded into nested `skills` and `activities` maps, which are trimmed to
+    `selection` (see `projection.select`).
+
+    """
+    item = trim_item(merge_flat_leaves(decode_snapshot(item)), selection)
+    if aggregation_level == AggregationLevel.NONE:
+        # If no aggregation, no action needed
+        pass
+    elif aggregation_level in LEVEL_TIERS:
+        item["timestamp"] = item["timestamp"].split("#")[1]
+        item.pop(WATERMARK_ATTRIBUTE, None)
+        divisor = item.pop("divisor")
+        if "skills" in item:
+            item["skills"] = normalize_nested_dict(item["skills"], divisor)
+        if "activities" in item:
+            item["activities"] = normalize_nested_dict(item["activities"], divisor)
+    else:
+        raise ValueError(f"Unsupported aggregation_level '{aggregation_level}.")
+
+    item["aggregationLevel"] = aggregation_level
+    return item
+
+
+def lint_items(items, aggregation_level, selection=None):
+    """Lint items returned from HiScores Table Query, lazily, in order."""
+    return (lint_item(item, aggregation_level, selection) for item in items)
+
+
+def to_columns(items, selection=None):
+    """Transpose linted items into one array of timestamps and one array of
+    integers per selected leaf, named by `flat_name`.
+
+    Values are truncated to integers, as `CustomEncoder` encodes decimals, and
+    leaves missing from an item are `None`.
+
+    Examples:
+    >>> items = [
+    ...     {"player": "P", "timestamp": "t0", "skills": {"Magic": {"xp": 2.5}}},
+    ...     {"player": "P", "timestamp": "t1"},
+    ... ]
+    >>> to_columns(items, {"skills": {"Magic": ("xp",)}, "activities": {}})
+    {'player': 'P', 'aggregationLevel': None, 'timestamps': ['t0', 't1'], 'columns': {'skills.Magic.xp': [2, None]}}
+
+    """  # noqa: E501
+    leaves = selected_leaves(selection)
+    columns = {flat_name(*leaf): [] for leaf in leaves}
+    # look up each row of an item once, for all of its selected columns
+    rows = dict()
+    for (attribute, row, col), column in zip(leaves, columns.values()):
+        rows.setdefault((attribute, row), []).append((col, column))
+    first, timestamps = dict(), []
+    for item in items:
+        first = first or item
+        timestamps.append(item["timestamp"])
+        for (attribute, row), cols in rows.items():
+            values = item.get(attribute, {}).get(row, {})
+            for col, column in cols:
+                value = values.get(col)
+                column.append(None if value is None else int(value))
+    return {
+        "player": first.get("player"),
+        "aggregationLevel": first.get("aggregationLevel"),
+        "timestamps": timestamps,
+        "columns": columns,
+    }
+
+
+def dump_json(value, cls=CustomEncoder):
+    """Encode a value as JSON, encoding an iterator, such as a generator of
+    linted items, as an array one item at a time instead of all at once.
+
+    Each item can be freed once it is encoded, but the encoded text, like any
+    response body, still grows with the length of the array.
+
+    Examples:
+    >>> dump_json(i * 2 for i in range(3))
+    '[0, 2, 4]'
+    >>> dump_json({"status": 400})
+    '{"status": 400}'
+
+    """
+    if not isinstance(value, Iterator):
+        return json.dumps(value, cls=cls)
+    encoder = cls()
+    buffer = io.StringIO()
+    buffer.write("[")
+    for i, item in enumerate(value):
+        if i:
+            buffer.write(", ")
+        # `encode` uses the C encoder, which `iterencode` does not
+        buffer.write(encoder.encode(item))
+    buffer.write("]")
+    return buffer.getvalue()
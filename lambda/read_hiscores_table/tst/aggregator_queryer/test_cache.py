@@ -0,0 +1,152 @@
+from decimal import Decimal
+
+import pytest
+import read_hiscores_table.lib.aggregation_queryer.cache as cache
+from botocore.exceptions import ClientError
+from hiscores_common.lib.table.keys import QUERY_CACHE_PARTITION
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeTable(object):
+    """Table of items by key, as the DynamoDB backend reads and writes them."""
+
+    def __init__(self):
+        self.items = dict()
+
+    def get_item(self, Key):
+        item = self.items.get((Key["player"], Key["timestamp"]))
+        return {} if item is None else {"Item": dict(item)}
+
+    def put_item(self, Item):
+        self.items[(Item["player"], Item["timestamp"])] = dict(Item)
+
+
+class Builder(object):
+    def __init__(self, value="body"):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_lru_evicts_least_recently_used():
+    lru = cache.LRUCacheBackend(max_entries=2)
+    lru.set("a", cache.CacheEntry("A"))
+    lru.set("b", cache.CacheEntry("B"))
+    lru.get("a")
+    lru.set("c", cache.CacheEntry("C"))
+    assert lru.get("b") is None
+    assert [lru.get(key).value for key in "ac"] == ["A", "C"]
+
+
+def test_lru_evicts_by_size():
+    lru = cache.LRUCacheBackend(max_bytes=10)
+    lru.set("a", cache.CacheEntry("a" * 4))
+    lru.set("b", cache.CacheEntry("b" * 4))
+    lru.set("a", cache.CacheEntry("a" * 2))
+    assert lru.size == 6
+    lru.set("c", cache.CacheEntry("c" * 5))
+    assert lru.get("b") is None
+    assert lru.size == 7
+    # larger than the whole cache: not stored, nothing evicted
+    lru.set("d", cache.CacheEntry("d" * 11))
+    assert lru.get("d") is None
+    assert len(lru) == 2
+
+
+def test_entries_expire(clock):
+    query_cache = cache.QueryCache(clock=clock)
+    build = Builder()
+    query_cache.get_or_build("open", build, ttl_secs=60)
+    query_cache.get_or_build("closed", build)
+    clock.now = 59.0
+    query_cache.get_or_build("open", build, ttl_secs=60)
+    assert build.calls == 2
+    clock.now = 60.0
+    assert query_cache.get("open") is None
+    assert query_cache.get("closed") == "body"
+    query_cache.get_or_build("open", build, ttl_secs=60)
+    assert build.calls == 3
+    assert (query_cache.hits, query_cache.misses) == (1, 3)
+
+
+def test_shared_sqlite_hit_fills_local(tmp_path, clock):
+    path = tmp_path / "cache.db"
+    writer = cache.get_query_cache(f"sqlite:{path}")
+    reader = cache.get_query_cache(f"sqlite:{path}")
+    writer._clock = reader._clock = clock
+    writer.set("key", "body", ttl_secs=60)
+    assert len(reader.local) == 0
+    assert reader.get_or_build("key", Builder("rebuilt"), ttl_secs=60) == "body"
+    assert reader.local.get("key") == cache.CacheEntry("body", 60.0)
+    clock.now = 60.0
+    assert reader.get("key") is None
+
+
+def test_dynamo_backend(clock):
+    table = FakeTable()
+    query_cache = cache.get_query_cache("dynamodb", table=table)
+    query_cache._clock = query_cache.shared._clock = clock
+    query_cache.set("closed", "body")
+    query_cache.set("open", "body", ttl_secs=59.5)
+    items = {item["timestamp"]: item for item in table.items.values()}
+    assert all(key[0] == QUERY_CACHE_PARTITION for key in table.items)
+    assert len(items) == 2
+    # entries that never expire are still removed from the table after a day
+    assert [item["expiresAt"] for item in items.values()] == [
+        Decimal(cache.CLOSED_TTL_SECS + 1),
+        Decimal(60),
+    ]
+
+    other = cache.QueryCache(shared=cache.DynamoCacheBackend(table), clock=clock)
+    assert other.get("closed") == other.get("open") == "body"
+    clock.now = 60.0
+    assert other.local.get("open") is not None
+    assert other.get("open") is None
+    assert other.get("closed") == "body"
+
+
+def test_dynamo_backend_skips_large_values():
+    table = FakeTable()
+    backend = cache.DynamoCacheBackend(table, max_bytes=4)
+    backend.set("key", cache.CacheEntry("\N{EURO SIGN}" * 2))
+    assert backend.get("key") is None
+
+
+def test_shared_failures_are_misses(mocker):
+    table = FakeTable()
+    error = ClientError({"Error": {"Code": "ThrottlingException"}}, "GetItem")
+    mocker.patch.object(table, "get_item", side_effect=error)
+    mocker.patch.object(table, "put_item", side_effect=error)
+    query_cache = cache.get_query_cache("dynamodb", table=table)
+    build = Builder()
+    assert query_cache.get_or_build("key", build) == "body"
+    assert query_cache.get_or_build("key", build) == "body"
+    assert build.calls == 1
+    assert query_cache.get("other") is None
+
+
+@pytest.mark.parametrize("spec", ["memory", "sqlite::memory:", "dynamodb"])
+def test_get_query_cache(spec):
+    query_cache = cache.get_query_cache(spec, table=FakeTable(), max_entries=3)
+    assert query_cache.local.max_entries == 3
+    assert (query_cache.shared is None) == (spec == "memory")
+
+
+def test_dynamo_requires_table():
+    with pytest.raises(ValueError):
+        cache.get_query_cache("dynamodb")
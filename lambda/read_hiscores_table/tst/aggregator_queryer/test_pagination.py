@@ -0,0 +1,95 @@
+import threading
+
+import pytest
+import read_hiscores_table.lib.aggregation_queryer.pagination as pagination
+import read_hiscores_table.lib.aggregation_queryer.util as util
+
+TIMESTAMPS = [
+    f"2021-12-{day:02d} {hour:02d}:00:00" for day in (17, 18) for hour in range(24)
+]
+
+
+class PagedQuery(object):
+    """Query of sorted items, returning at most `page_items` items per page."""
+
+    def __init__(self, timestamps=TIMESTAMPS, page_items=5):
+        self.items = [{"timestamp": t} for t in timestamps]
+        self.page_items = page_items
+        self.calls = []
+        self.threads = set()
+
+    def __call__(self, low, high, Limit=None, ExclusiveStartKey=None):
+        self.calls.append((low, high, Limit, ExclusiveStartKey))
+        self.threads.add(threading.get_ident())
+        items = [
+            item
+            for item in self.items
+            if low <= item["timestamp"] <= high
+            and (ExclusiveStartKey is None or item["timestamp"] > ExclusiveStartKey)
+        ]
+        page = items[: min(Limit or self.page_items, self.page_items)]
+        response = {"Items": page}
+        if len(page) < len(items):
+            response["LastEvaluatedKey"] = page[-1]["timestamp"]
+        return response
+
+
+def test_query_all_follows_pages():
+    query = PagedQuery()
+    items = pagination.query_all(lambda **kwargs: query("0", "9", **kwargs))
+    assert items == query.items
+    assert len(query.calls) == 10
+
+
+@pytest.mark.parametrize("limit", [0, 3, 5, 12, 100])
+def test_query_all_limit(limit):
+    query = PagedQuery()
+    items = pagination.query_all(lambda **kwargs: query("0", "9", **kwargs), limit)
+    assert items == query.items[:limit]
+    assert all(call[2] <= limit for call in query.calls)
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+@pytest.mark.parametrize("rows_per_segment", [1, 7, 48])
+def test_query_segments_matches_whole_range(max_workers, rows_per_segment):
+    low, high = "2021-12-17", "2021-12-18 12:00:00"
+    segments = util.split_key_range(low, high, 3600, rows_per_segment, max_workers)
+    assert len(segments) == min(max_workers, -(-36 // rows_per_segment))
+    query = PagedQuery()
+    items = pagination.query_segments(query, segments, max_workers=max_workers)
+    assert items == pagination.query_all(lambda **kwargs: query(low, high, **kwargs))
+    assert len(items) == 37
+
+
+def test_query_segments_concurrent():
+    query = PagedQuery()
+    segments = util.split_key_range(TIMESTAMPS[0], TIMESTAMPS[-1], 3600, 4, 8)
+    barrier = threading.Barrier(len(segments), timeout=5)
+
+    def blocking_query(*args, **kwargs):
+        # every segment must be in flight at once to get past the barrier
+        if kwargs.get("ExclusiveStartKey") is None:
+            barrier.wait()
+        return query(*args, **kwargs)
+
+    items = pagination.query_segments(blocking_query, segments, max_workers=8)
+    assert items == query.items
+    assert len(query.threads) == len(segments) == 8
+
+
+def test_query_segments_limit_reads_in_order():
+    query = PagedQuery()
+    segments = util.split_key_range(TIMESTAMPS[0], TIMESTAMPS[-1], 3600, 4, 8)
+    items = pagination.query_segments(query, segments, limit=7, max_workers=8)
+    assert items == query.items[:7]
+    assert {call[0] for call in query.calls} == {low for low, _ in segments[:2]}
+
+
+def test_iter_segments_reads_ahead_boundedly():
+    query = PagedQuery()
+    segments = util.split_key_range(TIMESTAMPS[0], TIMESTAMPS[-1], 3600, 4, 8)
+    pages = pagination.iter_segments(query, segments, max_workers=2)
+    assert next(pages) == query.items[:5]
+    pages.close()
+    # the second page of the first range, and the first page of the second
+    assert len(query.calls) <= 3
@@ -0,0 +1,150 @@
+import re
+
+import pytest
+import read_hiscores_table.lib.aggregation_queryer.projection as projection
+import read_hiscores_table.lib.aggregation_queryer.util as util
+from hiscores_common.lib.snapshot.codec import encode_snapshot
+from hiscores_common.lib.snapshot.constants import (
+    HISCORES_RESPONSE_ACTIVITIES,
+    HISCORES_RESPONSE_SKILLS,
+)
+from hiscores_common.tst.snapshot.test_codec import snapshot
+
+
+def paths(kwargs):
+    """Get the document paths of a projection, with their names substituted."""
+    names = kwargs["ExpressionAttributeNames"]
+    return {
+        ".".join(names.get(name, name) for name in path.split("."))
+        for path in kwargs["ProjectionExpression"].split(",")
+    }
+
+
+@pytest.mark.parametrize(
+    "kwargs,skills,activities",
+    [
+        (dict(skills=["Magic"]), {"Magic": ("rnk", "lvl", "xp")}, {}),
+        (dict(activities=["Zulrah"]), {}, {"Zulrah": ("rnk", "kc")}),
+        (dict(skills=["Magic"], activities=[], fields=["kc"]), {}, {}),
+        (
+            dict(skills=[], activities=["Zulrah"], fields=["kc"]),
+            {},
+            {"Zulrah": ("kc",)},
+        ),
+        (
+            dict(fields=["xp"]),
+            {skill: ("xp",) for skill in HISCORES_RESPONSE_SKILLS},
+            {},
+        ),
+    ],
+)
+def test_select(kwargs, skills, activities):
+    assert projection.select(**kwargs) == {"skills": skills, "activities": activities}
+
+
+def test_select_orders_by_schema():
+    selection = projection.select(skills=["Magic", "Attack"], fields=["xp", "rnk"])
+    assert selection == projection.select(
+        skills=["Attack", "Magic"], fields=["rnk", "xp"]
+    )
+    assert list(selection["skills"]) == ["Attack", "Magic"]
+    assert selection["skills"]["Magic"] == ("rnk", "xp")
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        dict(),
+        dict(fields=["rnk", "lvl", "xp", "kc"]),
+        dict(skills=HISCORES_RESPONSE_SKILLS, activities=HISCORES_RESPONSE_ACTIVITIES),
+    ],
+)
+def test_select_everything(kwargs):
+    assert projection.select(**kwargs) is None
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        dict(skills=["magic"]),
+        dict(activities=["Magic"]),
+        dict(fields=["experience"]),
+    ],
+)
+def test_select_unknown(kwargs):
+    with pytest.raises(ValueError):
+        projection.select(**kwargs)
+
+
+def test_projection():
+    selection = projection.select(
+        skills=["Magic"], activities=["Zulrah"], fields=["kc"]
+    )
+    selection["skills"] = {"Magic": ("rnk", "lvl", "xp")}
+    kept = set(projection.KEPT_ATTRIBUTES) | {"timestamp"}
+    assert paths(projection.projection(selection, flat=False)) == kept | {
+        "skills.Magic",
+        "activities.Zulrah.kc",
+    }
+    # flat leaves are top-level attributes whose names hold dots
+    kwargs = projection.projection(selection)
+    flat = {
+        "skills.Magic.rnk",
+        "skills.Magic.lvl",
+        "skills.Magic.xp",
+        "activities.Zulrah.kc",
+    }
+    assert flat <= set(kwargs["ExpressionAttributeNames"].values())
+    assert len(kwargs["ProjectionExpression"].split(",")) == len(kept) + 2 + len(flat)
+
+
+def test_projection_placeholders():
+    kwargs = projection.projection(projection.select(fields=["rnk"]))
+    expression = kwargs["ProjectionExpression"]
+    assert "Zulrah" not in expression and "rnk" not in expression
+    # names shared by several paths share one placeholder
+    assert len(kwargs["ExpressionAttributeNames"]) == len(
+        set(kwargs["ExpressionAttributeNames"].values())
+    )
+
+
+@pytest.mark.parametrize(
+    "selection",
+    [
+        projection.select(skills=["Magic"], fields=["xp"]),
+        projection.select(fields=["rnk"]),
+        projection.select(skills=["Attack"], activities=["Zulrah"]),
+    ],
+)
+@pytest.mark.parametrize("flat", [True, False])
+def test_projection_only_placeholders(selection, flat):
+    # names such as `base` are reserved words, which DynamoDB rejects
+    kwargs = projection.projection(selection, flat=flat)
+    names = kwargs["ExpressionAttributeNames"]
+    for name in re.split(r"[,.]", kwargs["ProjectionExpression"]):
+        assert name.startswith("#") and name in names
+
+
+def test_lint_items_trims_packed():
+    selection = projection.select(skills=["Magic"], fields=["xp"])
+    items = [encode_snapshot(snapshot())]
+    expected = {"Magic": {"xp": snapshot()["skills"]["Magic"]["xp"]}}
+    (linted,) = util.lint_items(items, util.AggregationLevel.NONE, selection)
+    assert linted["skills"] == expected
+    assert "activities" not in linted
+
+
+def test_lint_items_trims_flat_leaves():
+    selection = projection.select(skills=["Magic"], activities=["Zulrah"])
+    items = [
+        {
+            "timestamp": "Daily#2021-12-17",
+            "divisor": 2,
+            "skills.Magic.xp": 10,
+            "skills": {"Magic": {"lvl": 198}},
+            "activities": {"Obor": {"kc": 2}},
+        }
+    ]
+    (linted,) = util.lint_items(items, util.AggregationLevel.DAILY, selection)
+    assert linted["skills"] == {"Magic": {"lvl": 99.0, "xp": 5.0}}
+    assert "activities" not in linted
@@ -1,8 +1,12 @@
 import decimal
 import json
+from datetime import datetime
 
 import pytest
 import read_hiscores_table.lib.aggregation_queryer.util as util
+from hiscores_common.lib.snapshot.codec import encode_snapshot
+from hiscores_common.lib.table.tiers import derivation_sources, parse_tiers
+from hiscores_common.tst.snapshot.test_codec import snapshot
 
 
 def test_custom_encoder():
@@ -100,12 +104,18 @@ def linted_daily_items():
     ],
 )
 def test_lint_items(items, aggregation_level, expected):
-    assert util.lint_items(items, aggregation_level) == expected
+    assert list(util.lint_items(items, aggregation_level)) == expected
+
+
+def test_lint_items_packed():
+    items = [encode_snapshot(snapshot())]
+    expected = [dict(snapshot(), aggregationLevel=util.AggregationLevel.NONE)]
+    assert list(util.lint_items(items, util.AggregationLevel.NONE)) == expected
 
 
 def test_lint_items_invalid():
     with pytest.raises(ValueError):
-        util.lint_items([{}], 3)
+        list(util.lint_items([{}], 3))
 
 
 @pytest.mark.parametrize(
@@ -122,12 +132,38 @@ def test_infer_aggregation_level(start_time, end_time, expected):
     assert util.infer_aggregation_level(start_time, end_time) == expected
 
 
+@pytest.mark.parametrize(
+    "start_time,end_time,expected",
+    [
+        ("2021-12-18 00:00:00", "2021-12-18 18:30:00", util.AggregationLevel.NONE),
+        ("2021-12-15 00:00:00", "2021-12-18 00:00:00", util.AggregationLevel.HOURLY),
+        ("2021-11-01 00:00:00", "2021-12-18 00:00:00", util.AggregationLevel.DAILY),
+        ("2021-06-01 00:00:00", "2021-12-18 00:00:00", util.AggregationLevel.WEEKLY),
+        ("2017-01-01 00:00:00", "2021-12-18 00:00:00", util.AggregationLevel.MONTHLY),
+        ("1990-01-01 00:00:00", "2021-12-18 00:00:00", util.AggregationLevel.YEARLY),
+    ],
+)
+def test_infer_aggregation_level_all_tiers(start_time, end_time, expected):
+    level = util.infer_aggregation_level(
+        start_time, end_time, tiers=list(util.LEVEL_TIERS.values())
+    )
+    assert level == expected
+
+
+def test_plan_aggregation_level_coarsest_available():
+    tiers = [util.LEVEL_TIERS[util.AggregationLevel.DAILY]]
+    level = util.plan_aggregation_level(10 * 365 * 86400, tiers=tiers)
+    assert level == util.AggregationLevel.DAILY
+
+
 @pytest.mark.parametrize(
     "start_time,end_time,aggregation_level",
     [
         ("2021-12-18 00:00:00", "2021-12-18 18:30:00", util.AggregationLevel.NONE),
         ("2021-12-17", "2021-12-18", util.AggregationLevel.DAILY),
         ("2020-12-17 00:00:00", "2021-12-17 00:00:00", util.AggregationLevel.MONTHLY),
+        ("2021-12-17 20:41:59", "2021-12-18", util.AggregationLevel.HOURLY),
+        ("2021-12-17 20:41:59", "2022-12-17", util.AggregationLevel.YEARLY),
     ],
 )
 def test_get_query_boundaries(start_time, end_time, aggregation_level):
@@ -145,13 +181,265 @@ def test_get_query_boundaries(start_time, end_time, aggregation_level):
         assert all(
             [util.valid_datetime(dt.split("#")[1], util.MONTH_FMT) for dt in result]
         )
+    elif aggregation_level == util.AggregationLevel.HOURLY:
+        assert result == ("Hourly#2021-12-17 20:00:00", "Hourly#2021-12-18 00:00:00")
+    else:
+        assert result == ("Yearly#2021", "Yearly#2022")
 
 
 def test_get_query_boundaries_invalid():
     with pytest.raises(ValueError):
         util.get_query_boundaries("", "", 3)
+    with pytest.raises(ValueError):
+        util.get_query_boundaries("", "", util.AggregationLevel.DAILY)
 
 
 def test_convert_timestamp_invalid():
     with pytest.raises(ValueError):
         util.convert_timestamp("", [])
+
+
+def test_resolve_deltas_fetches_missing_bases(mocker):
+    base = snapshot()
+    get_base = mocker.Mock(return_value=encode_snapshot(base))
+    items = [
+        {"player": "PlayerName", "timestamp": "2021-12-17 21:00:00", "base": "t0"},
+        {"player": "PlayerName", "timestamp": "2021-12-17 21:30:00", "base": "t0"},
+    ]
+    result = list(util.resolve_deltas(items, get_base))
+    get_base.assert_called_once_with("t0")
+    assert [item["timestamp"] for item in result] == [
+        "2021-12-17 21:00:00",
+        "2021-12-17 21:30:00",
+    ]
+    assert all(item["skills"] == base["skills"] for item in result)
+
+
+def test_lint_items_flat_leaves():
+    items = [
+        {
+            "timestamp": "Daily#2021-12-17",
+            "divisor": 2,
+            "skills.Magic.xp": 10,
+            "skills": {"Magic": {"lvl": 198}},
+        }
+    ]
+    expected = [
+        {
+            "timestamp": "2021-12-17",
+            "skills": {"Magic": {"lvl": 99.0, "xp": 5.0}},
+            "aggregationLevel": util.AggregationLevel.DAILY,
+        }
+    ]
+    assert list(util.lint_items(items, util.AggregationLevel.DAILY)) == expected
+
+
+def test_lint_items_hourly():
+    items = [{"timestamp": "Hourly#2021-12-17 20:00:00", "divisor": 2}]
+    expected = [
+        {
+            "timestamp": "2021-12-17 20:00:00",
+            "aggregationLevel": util.AggregationLevel.HOURLY,
+        }
+    ]
+    assert list(util.lint_items(items, util.AggregationLevel.HOURLY)) == expected
+
+
+def rollup_row(timestamp, divisor, through=None):
+    row = {
+        "player": "PlayerName",
+        "timestamp": timestamp,
+        "skills": {"Magic": {"xp": divisor}},
+        "divisor": divisor,
+    }
+    if through is not None:
+        row["through"] = through
+    return row
+
+
+@pytest.fixture
+def rollup_rows():
+    """Rows of daily, monthly and yearly tiers derived hierarchically, where
+    neither the last two days nor the open month have been rolled up yet."""
+    rows = [
+        rollup_row("Daily#2021-11-30", 1),
+        rollup_row("Daily#2021-12-30", 1),
+        rollup_row("Daily#2021-12-31", 1),
+        rollup_row("Daily#2022-01-01", 1),
+        rollup_row("Monthly#2021-11", 5, through="Daily#2021-11-30"),
+        rollup_row("Monthly#2021-12", 1, through="Daily#2021-12-30"),
+        rollup_row("Yearly#2021", 5, through="Monthly#2021-11"),
+    ]
+    return {row["timestamp"]: row for row in rows}
+
+
+@pytest.mark.parametrize(
+    "tier,expected",
+    [
+        ("daily", {}),
+        ("monthly", {"Monthly#2021-11": 5, "Monthly#2021-12": 2, "Monthly#2022-01": 1}),
+        ("yearly", {"Yearly#2021": 7, "Yearly#2022": 1}),
+    ],
+)
+def test_complete_rollups(rollup_rows, tier, expected):
+    tier = util.LEVEL_TIERS[getattr(util.AggregationLevel, tier.upper())]
+    sources = derivation_sources(parse_tiers("daily,monthly,yearly"))
+    start, end = datetime(2021, 11, 15), datetime(2022, 1, 31)
+
+    def query_rows(low, high):
+        return [rollup_rows[key] for key in sorted(rollup_rows) if low <= key <= high]
+
+    items = query_rows(tier.key(start), tier.key(end))
+    result = util.complete_rollups(items, tier, sources, start, end, query_rows)
+    assert [row["timestamp"] for row in result] == sorted(
+        expected or [row["timestamp"] for row in items]
+    )
+    for row in result:
+        assert row["divisor"] == row["skills"]["Magic"]["xp"]
+        assert row["divisor"] == expected.get(row["timestamp"], row["divisor"])
+    linted = list(util.lint_items(result, util.AggregationLevel.MONTHLY))
+    assert all("through" not in row for row in linted)
+
+
+@pytest.mark.parametrize(
+    "low,high,count",
+    [
+        ("2021-12", "2022-01", 16),
+        ("2021-12-17 20:41:59", "2021-12-17 21:00:00", 1),
+        ("Hourly#2021-12-17 20:00:00", "Hourly#2021-12-18 20:00:00", 3),
+        ("Weekly#2021-12-13", "Weekly#2024-12-16", 16),
+        ("Monthly#2021-12", "Monthly#2022-12", 2),
+        ("Yearly#2021", "Yearly#2023", 1),
+        ("Daily#2021-12-31", "Daily#2021-12-17", 1),
+        ("Registry#a", "Registry#z", 1),
+    ],
+)
+def test_split_key_range(low, high, count):
+    segments = util.split_key_range(low, high, 7200, 10, 16)
+    assert len(segments) == count
+    assert segments[0][0] == low and segments[-1][1] == high
+    assert all(a[1] == b[0] for a, b in zip(segments, segments[1:]))
+    if count > 1:
+        assert all(a < b for a, b in segments)
+        # boundaries are keys of the same tier as the range
+        assert all(key.count("#") == low.count("#") for key, _ in segments)
+
+
+def test_resolve_deltas_skips_missing_bases(mocker, caplog):
+    get_base = mocker.Mock(side_effect=[None, {"timestamp": "t2", "skills": {}}])
+    items = [
+        {"timestamp": "t1", "base": "t0"},
+        {"timestamp": "t3", "base": "t0"},
+        {"timestamp": "t4", "base": "t2"},
+    ]
+    assert [item["timestamp"] for item in util.resolve_deltas(items, get_base)] == [
+        "t4"
+    ]
+    assert get_base.call_args_list == [mocker.call("t0"), mocker.call("t2")]
+    assert "Skipping delta 't1' of missing base 't0'" in caplog.text
+
+
+def test_resolve_deltas_is_lazy(mocker):
+    get_base = mocker.Mock(return_value={"timestamp": "t0", "skills": {"Magic": 1}})
+    read = []
+
+    def items():
+        for item in [
+            {"timestamp": "t1", "base": "t0"},
+            {"timestamp": "t2", "skills": {"Magic": 2}},
+            {"timestamp": "t3", "base": "t2"},
+            {"timestamp": "t4", "base": "t0"},
+        ]:
+            read.append(item["timestamp"])
+            yield item
+
+    resolved = util.resolve_deltas(items(), get_base)
+    assert next(resolved)["skills"] == {"Magic": 1}
+    assert read == ["t1"]
+    assert [item["skills"] for item in resolved] == [
+        {"Magic": 2},
+        {"Magic": 2},
+        {"Magic": 1},
+    ]
+    # only the latest base is kept, so t0 is fetched again
+    assert get_base.call_count == 2
+
+
+def test_dump_json_matches_dumps():
+    items = list(util.lint_items(daily_items(), util.AggregationLevel.DAILY))
+    expected = json.dumps(items, cls=util.CustomEncoder)
+    assert util.dump_json(iter(items)) == expected
+    assert util.dump_json(iter([])) == json.dumps([])
+
+
+def test_to_columns_matches_rows():
+    items = [
+        dict(snapshot(), timestamp=f"2021-12-17 20:{minute:02d}:00")
+        for minute in (0, 30)
+    ]
+    items[1]["activities"].pop("Zulrah")
+    rows = json.loads(
+        util.dump_json(util.lint_items(items, util.AggregationLevel.NONE))
+    )
+    columns = util.to_columns(util.lint_items(items, util.AggregationLevel.NONE))
+    columns = json.loads(json.dumps(columns, cls=util.CustomEncoder))
+    assert columns["player"] == "PlayerName"
+    assert columns["aggregationLevel"] == "AggregationLevel.NONE"
+    assert columns["timestamps"] == [row["timestamp"] for row in rows]
+    assert len(columns["columns"]) == 24 * 3 + 82 * 2
+    for name, values in columns["columns"].items():
+        attribute, row, col = name.split(".")
+        assert values == [r[attribute].get(row, {}).get(col) for r in rows]
+    assert columns["columns"]["activities.Zulrah.kc"][1] is None
+
+
+def test_to_columns_truncates_rollups():
+    items = [
+        {"timestamp": "Daily#2021-12-17", "divisor": 2, "skills.Magic.xp": 5},
+        {"timestamp": "Daily#2021-12-18", "divisor": 1, "skills.Magic.xp": 5},
+    ]
+    selection = {"skills": {"Magic": ("xp",)}, "activities": {}}
+    linted = util.lint_items(items, util.AggregationLevel.DAILY, selection)
+    columns = util.to_columns(linted, selection)
+    assert columns["timestamps"] == ["2021-12-17", "2021-12-18"]
+    assert columns["columns"] == {"skills.Magic.xp": [2, 5]}
+
+
+def test_to_columns_empty():
+    columns = util.to_columns(iter([]), {"skills": {}, "activities": {}})
+    assert columns == {
+        "player": None,
+        "aggregationLevel": None,
+        "timestamps": [],
+        "columns": {},
+    }
+
+
+@pytest.mark.parametrize(
+    "days,expected",
+    [
+        (1, util.AggregationLevel.NONE),
+        (2, util.AggregationLevel.NONE),
+        (5, util.AggregationLevel.NONE),
+        (7, util.AggregationLevel.NONE),
+        (9, util.AggregationLevel.DAILY),
+        (90, util.AggregationLevel.DAILY),
+        (400, util.AggregationLevel.MONTHLY),
+    ],
+)
+def test_plan_aggregation_level_default_tiers(days, expected):
+    # with daily and monthly rollups only, ranges of a few days are read raw
+    # rather than as a handful of daily rows
+    assert util.plan_aggregation_level(days * 86400) == expected
+
+
+def test_plan_aggregation_level_nearest_target():
+    tiers = list(util.LEVEL_TIERS.values())
+    for days in (1, 3, 10, 60, 365, 3650):
+        level = util.plan_aggregation_level(days * 86400, tiers=tiers)
+        period = (
+            util.LEVEL_TIERS[level].period_secs if level in util.LEVEL_TIERS else 1800
+        )
+        points = days * 86400 / period
+        # the chosen level is within a factor of the tier spacing of the target
+        assert 100 / 7 <= points <= 100 * 4
@@ -0,0 +1,137 @@
+#!/.venv/bin/python
+"""Rebuild the rollup rows of the HiScores table from its raw snapshots.
+
+Recovers rollups after the aggregator missed stream records, or after the
+rollup schema changed. Raw items are read with a parallel scan, or from the
+files of a table export, folded into rollup rows of every tier across a pool
+of processes, and written back with batched writes, overwriting the rows they
+rebuild. Pause the aggregator while the rebuild runs. For example:
+
+    python rebuild_aggregates.py --table HiScores --segments 64 --workers 16
+    python rebuild_aggregates.py --table HiScores --export export/data/*.json.gz
+
+Pass `--endpoint-url http://localhost:8000` to run against DynamoDB Local.
+
+"""
+import argparse
+import functools
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "lambda"))
+
+import boto3  # noqa: E402
+from aggregator.lib.dynamo_aggregator.rebuild import (  # noqa: E402
+    aggregate_export_file,
+    aggregate_scan_segment,
+    rebuild_rows,
+)
+from get_and_parse_hiscores.lib.dynamo_writer.buffered import (  # noqa: E402
+    BufferedBatchWriter,
+)
+from hiscores_common.lib.table.tiers import (  # noqa: E402
+    DEFAULT_TIERS,
+    derivation_sources,
+    parse_tiers,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def dynamo_table(name, endpoint_url=None):
+    """Build a table resource; called in each process that needs one."""
+    return boto3.resource("dynamodb", endpoint_url=endpoint_url).Table(name)
+
+
+def write_rows(table_factory, rows, writers=8):
+    """Write rows with BatchWriteItem from `writers` threads.
+
+    Returns:
+        list: Rows that could not be written.
+
+    """
+
+    def write(chunk):
+        with BufferedBatchWriter(table_factory()) as writer:
+            unprocessed = [item for row in chunk for item in writer.put_item(row)]
+            return unprocessed + writer.flush()
+
+    chunks = [rows[i::writers] for i in range(writers)]
+    with ThreadPoolExecutor(writers) as pool:
+        return [row for unprocessed in pool.map(write, chunks) for row in unprocessed]
+
+
+def rebuild(args, table_factory):
+    """Rebuild and write every rollup row. Returns the number of rows written."""
+    tiers = parse_tiers(args.tiers)
+    sources = derivation_sources(tiers) if args.strategy == "hierarchical" else {}
+    raw_tiers = [tier for tier in tiers if tier.name not in sources]
+    if args.export:
+        shards = args.export
+        aggregate_shard = functools.partial(
+            aggregate_export_file, tiers=raw_tiers, table_factory=table_factory
+        )
+    else:
+        shards = range(args.segments)
+        aggregate_shard = functools.partial(
+            aggregate_scan_segment,
+            table_factory=table_factory,
+            total_segments=args.segments,
+            tiers=raw_tiers,
+            page_size=args.page_size,
+        )
+
+    start = time.perf_counter()
+    # fork, so that workers inherit module state such as in-memory tables
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(args.workers, mp_context=context) as pool:
+        rows = rebuild_rows(shards, aggregate_shard, sources, map_fn=pool.map)
+    logger.info(
+        f"Aggregated {len(shards)} shards into {len(rows)} rows in "
+        f"{time.perf_counter() - start:.1f}s."
+    )
+    if args.dry_run:
+        return 0
+
+    start = time.perf_counter()
+    failed = write_rows(table_factory, rows, writers=args.writers)
+    if failed:
+        logger.error(f"Failed to write {len(failed)} rows.")
+    logger.info(
+        f"Wrote {len(rows) - len(failed)} rows in {time.perf_counter() - start:.1f}s."
+    )
+    return len(rows) - len(failed)
+
+
+def add_arguments(parser):
+    parser.add_argument("--table", default="HiScores", help="Table name.")
+    parser.add_argument("--endpoint-url", help="DynamoDB endpoint, e.g. for Local.")
+    parser.add_argument(
+        "--export",
+        nargs="+",
+        help="Read raw items from these export files instead of scanning.",
+    )
+    parser.add_argument("--segments", type=int, default=4 * os.cpu_count())
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--writers", type=int, default=8, help="Writer threads.")
+    parser.add_argument("--page-size", type=int, help="Items per scan page.")
+    parser.add_argument("--tiers", default=DEFAULT_TIERS, help="Tiers to rebuild.")
+    parser.add_argument(
+        "--strategy",
+        choices=("direct", "hierarchical"),
+        default="direct",
+        help="Rollup strategy of the aggregator.",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Do not write.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    add_arguments(parser)
+    args = parser.parse_args()
+    rebuild(args, functools.partial(dynamo_table, args.table, args.endpoint_url))
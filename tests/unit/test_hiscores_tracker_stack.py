@@ -12,7 +12,7 @@ def test_synthesize():
     # Assert no extraneous resources
     template.resource_count_is("AWS::Lambda::Function", 4)
     template.resource_count_is("AWS::DynamoDB::Table", 1)
-    template.resource_count_is("AWS::SQS::Queue", 1)
+    template.resource_count_is("AWS::SQS::Queue", 3)
     template.resource_count_is("AWS::ApiGateway::RestApi", 2)
     template.resource_count_is("AWS::Events::Rule", 1)
 
@@ -52,6 +52,29 @@ def test_synthesize():
         },
     )
 
+    # Test GetAndParse consumes batches with partial failure reporting
+    template.has_resource_properties(
+        "AWS::Lambda::EventSourceMapping",
+        {
+            "BatchSize": 10,
+            "FunctionResponseTypes": ["ReportBatchItemFailures"],
+        },
+    )
+
+    # Test Aggregator consumes batches of stream records, retrying failures
+    template.has_resource_properties(
+        "AWS::Lambda::EventSourceMapping",
+        {
+            "BatchSize": 100,
+            "MaximumBatchingWindowInSeconds": 10,
+            "StartingPosition": "TRIM_HORIZON",
+            "FunctionResponseTypes": ["ReportBatchItemFailures"],
+            "BisectBatchOnFunctionError": True,
+            "MaximumRetryAttempts": 3,
+            "DestinationConfig": {"OnFailure": assertions.Match.any_value()},
+        },
+    )
+
     # Test Aggregator created
     template.has_resource_properties(
         "AWS::Lambda::Function",